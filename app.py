@@ -15,43 +15,51 @@
 # Script con el código de la aplicación principal en Streamlit
 
 # librerías internas
+import argparse
+import contextlib
 from functools import partial
+import hashlib
 from io import BytesIO
 import os
-from pathlib import Path
-import random
 import time
+import uuid
 # librerías de terceros
 import streamlit as st
 from streamlit import delta_generator
 # librerías del proyecto
-from backend.builder import build_docx_from_xml
-from backend.db import UserDBHandler
-from backend.extractor import (get_text_from_docx,
-                                extract_word_to_xml, 
-                                delete_xml_path, 
-                                get_text_elements_and_tree,
-                                get_language,
-                                get_topic,
-                                get_num_words,
-                                get_vocabulary,
-                                )
-from backend.models import OpenAIResponse
-from backend.paths import WORD_FOLDER
-from backend.translator import (translate,
-                                )
+from backend.builder import build_docx_from_original, build_zip
+from backend.db import RevisionDB, RevisionDBHandler, TranslationMemoryDBHandler, UserDBHandler
+from backend.extractor import delete_xml_path
+from backend import events
+from backend.events import EventBus, Throttle, log_event
+from backend.hedging import Hedger
+from backend.metrics import JobMetrics
+from backend.profiling import PROFILE_MODES, profile
+from backend.routing import RoutingPolicy, get_routing_latency_savings
+from backend.scheduler import FairScheduler, is_priority_job
+from backend.models import Evento, MemoryEntry, OpenAIResponse
+from backend.pipeline import translate_to_languages
+from backend.revisions import build_revision_record, match_revision
+from backend.tm import (FORMATS,
+                        TranslationMemoryError,
+                        get_format,
+                        get_memory_keys,
+                        iter_memory_entries,
+                        iter_units,
+                        write_units,
+                        )
+from backend.preprocessing import (PreprocessingCancelled,
+                                    start_analysis,
+                                    start_preprocessing,
+                                    )
 from backend.validator import (exists_apikey, 
                                 apikey_is_admin,
                                 apikey_is_active,
                                 has_words_left,
-                                are_special_char
                                 )
-from backend.xml_validator import all_xml_files_good
-from backend.utils import (estimate_openai_cost,
-                            get_datetime_formatted,
+from backend.xml_validator import all_xml_parts_good
+from backend.utils import (get_datetime_formatted,
                             add_suffix_to_filename,
-                            get_to_extract_list,
-                            wait_randomly,
                             get_model_version,
                             )
 from streamlit_utils import (texto, 
@@ -89,10 +97,8 @@ LISTA_ESPECIALIDADES = [
     'Tecnología y Software',
     'Videojuegos',
 ]
-CHECKPOINT_ELEMENT_STEP = 50
+UI_UPDATES_PER_SECOND = 4
 
-# Instanciamos el handler para interacción con db
-db_handler = UserDBHandler('usuarios')
 # instancia footer con argumentos fijos
 put_footer = partial(footer, 2024, True)
 # Instanciamos distintos tipos de mensajes
@@ -102,6 +108,50 @@ texto_titulo = partial(texto, font_family='Rubik Doodle Shadow', font_size=60, c
 texto_subtitulo = partial(texto, font_family='Dancing Script', centrar=True)
 
 # Funciones específicas del proyecto
+@st.cache_resource
+def get_db_handler() -> UserDBHandler:
+    """Devuelve el handler para interacción con db. Se conecta en el primer uso
+    y la conexión se comparte entre sesiones.
+    """
+    return UserDBHandler('usuarios')
+
+@st.cache_resource
+def get_revision_db_handler() -> RevisionDBHandler:
+    """Devuelve el handler de las revisiones de documentos traducidos. Comparte la conexión con get_db_handler"""
+    return RevisionDBHandler(client=get_db_handler().client)
+
+@st.cache_resource
+def get_tm_db_handler() -> TranslationMemoryDBHandler:
+    """Devuelve el handler de la memoria de traducción. Comparte la conexión con get_db_handler"""
+    return TranslationMemoryDBHandler(client=get_db_handler().client)
+
+@st.cache_resource
+def get_scheduler() -> FairScheduler:
+    """Devuelve el planificador de llamadas al LLM compartido por todas las sesiones
+    para repartir los límites de la organización de forma justa entre usuarios.
+    """
+    return FairScheduler.from_env()
+
+@st.cache_resource
+def get_hedger() -> Hedger:
+    """Devuelve el Hedger compartido por todas las sesiones: plazo por llamada al LLM
+    y hedging con las latencias recientes de todos los trabajos.
+    """
+    return Hedger.from_env()
+
+def parse_cli_args() -> None:
+    """Lee los flags de línea de comandos pasados tras '--' en `streamlit run app.py -- --profile sample`
+    y los vuelca a las variables de entorno que lee backend.profiling
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', choices=PROFILE_MODES, help="Activa el profiling de los trabajos")
+    parser.add_argument('--profile-stages', help="Etapas a perfilar separadas por comas. Por defecto 'job'")
+    args, _ = parser.parse_known_args()
+    if args.profile:
+        os.environ['TRUEFORM_PROFILE'] = args.profile
+    if args.profile_stages:
+        os.environ['TRUEFORM_PROFILE_STAGES'] = args.profile_stages
+
 def init() -> None:
     """Inicializa variables de sesión necesarias
     """
@@ -114,12 +164,70 @@ def init() -> None:
 
 def reset_all() -> None:
     """Desactiva todas las flags y borra la ruta xml completa
-    Borra toda la sesión
+    Cancela el preprocesado en segundo plano y borra toda la sesión
     """
+    for trabajo in ('preprocessing', 'analysis'):
+        if (en_curso:=st.session_state.get(trabajo)) is not None:
+            en_curso.cancel()
     deactivate_flags(['parsed_document', 'translated_document'])
     delete_xml_path()
     st.session_state.clear()
 
+def save_analysis(nombre_documento:str) -> None:
+    """Espera al análisis en segundo plano del documento (si aún no ha terminado), registra
+    sus duraciones y guarda en sesión lo que se usa después. Activa la flag parsed_document.
+    """
+    job_metrics:JobMetrics = st.session_state['job_metrics']
+    try:
+        analisis, duraciones, segundos = st.session_state['analysis'].result()
+    except Exception as exc:
+        # Sin análisis no se puede traducir: en el siguiente rerun se vuelve a lanzar
+        st.session_state['analysis'] = None
+        show_error_and_stop(f"No se ha podido analizar el documento: {exc}")
+    job_metrics.observe('stage_duration_seconds', segundos, stage='preprocessing')
+    for tarea, duracion in duraciones.items():
+        job_metrics.observe('stage_duration_seconds', duracion, stage=f'preprocessing_{tarea}')
+    idioma_es, idioma_en = analisis['idioma']
+    topic:OpenAIResponse = analisis['tematica']
+    nombre_archivo, _ = os.path.splitext(nombre_documento)
+    # Guardamos en sesión solo lo que se usa después: el texto del documento vive
+    # en la tabla de segmentos del preprocesado
+    save_in_session(['nombre_archivo', 'idioma_es', 'idioma_en', 'tematica',
+                        'num_words', 'estimated_cost'],
+                    [nombre_archivo, idioma_es, idioma_en, topic.response,
+                        analisis['num_words'], analisis['estimated_cost']])
+    # Acumulamos los costes
+    accumulate_in_session(['real_total_cost'], [topic.total_cost])
+    # Activamos la flag para indicar que se ha cargado archivo correctamente
+    activate_flags(['parsed_document'])
+
+def translation_memory_section(clave:str) -> None:
+    """Importación y exportación de la memoria de traducción del usuario en TMX o XLIFF"""
+    with st.expander("Memoria de traducción (TMX / XLIFF)"):
+        if not clave or not exists_apikey(clave, get_db_handler()):
+            texto_descriptivo("Introduce una clave válida para importar o exportar tu memoria de traducción")
+            return
+        archivo = st.file_uploader("Importar memoria", type=[extension.lstrip('.') for extension in FORMATS])
+        if archivo is not None and st.button("Importar", use_container_width=True):
+            start = time.perf_counter()
+            try:
+                unidades = iter_memory_entries(iter_units(archivo, get_format(archivo.name)))
+                n = get_tm_db_handler().insert_units(clave, unidades)
+            except TranslationMemoryError as exc:
+                texto_error(str(exc))
+                return
+            segundos = time.perf_counter() - start
+            texto_descriptivo(f"{n:,} unidades importadas en {segundos:.1f} s ({n / max(segundos, 1e-9):,.0f} unidades/s)")
+        formato = st.selectbox("Formato de exportación", options=sorted(set(FORMATS.values())))
+        if st.button("Exportar", use_container_width=True):
+            start = time.perf_counter()
+            buffer = BytesIO()
+            n = write_units(buffer, get_tm_db_handler().iter_units(clave), formato)
+            segundos = time.perf_counter() - start
+            texto_descriptivo(f"{n:,} unidades exportadas en {segundos:.1f} s ({n / max(segundos, 1e-9):,.0f} unidades/s)")
+            st.download_button(label="Descargar memoria", data=buffer.getvalue(), file_name=f"memoria.{formato}",
+                                mime="application/xml", use_container_width=True)
+
 def show_error_and_stop(msg:str, progress_bar_list:list[delta_generator.DeltaGenerator]=None) -> None:
     """Función que realiza 4 cosas:
     - muestra mensaje de error
@@ -142,115 +250,50 @@ def show_error_and_stop(msg:str, progress_bar_list:list[delta_generator.DeltaGen
         [barra.empty() for barra in progress_bar_list]
     st.stop()
 
-def extract_translate_replace(
-        *,
-        apikey:str,
-        model:str,
-        clave:str,
-        document_words:int,
-        target_language:str,
-        filename:str,
-        to_extract_list:list[Path],
-        progress_bar_list:list[delta_generator.DeltaGenerator],
-        chain_params:dict
-        ) -> None:
-    # Unpack de las progress bar
-    document_bar, element_bar = progress_bar_list
-    # Contamos el número de documentos a traducir
-    n_documentos = len(to_extract_list)
-    step_document = 1 / n_documentos
-    # Inicializamos en sesión el número de running words traducidas
-    st.session_state['running_translated_words'] = 0
+def get_progress_subscriber(barras:dict[str, delta_generator.DeltaGenerator]) -> Throttle:
+    """Devuelve un suscriptor del bus que pinta el avance de cada idioma en su barra de progreso.
+    Está limitado a UI_UPDATES_PER_SECOND actualizaciones por segundo.
 
-    for idx, doc in enumerate(to_extract_list, start=1):
-        document_bar.progress(idx * step_document, f"Gestionando documento {idx}/{n_documentos}...")
-        # Creamos el tree y el root
-        text_elements, tree = get_text_elements_and_tree(doc)
-        n_elements = len(text_elements)
-        # Hacemos un sanity check: si n_elements > que document_words, algo se ha parseado mal
-        #st.write(f"{n_elements=}, {document_words=}")
-        if n_elements > document_words:
-            show_error_and_stop("El documento no se ha extraído correctamente debido a su formateo. Por favor, asegúrate de que el documento haya sido escrito por ti,", [document_bar, element_bar])
-        step_process = 1 / n_elements
-        for id, (element, text) in enumerate(text_elements, start=1):
-            element_bar.progress(id * step_process, f"Traduciendo al {target_language} elemento {id}/{n_elements}")
-            # Validaciones de traducción            
-            # Sacamos número de palabras del elemento
-            # No traducir caracteres etc.
-            num_running_words = len(text.strip().split())
-            if (len(text) == 1) or text.isspace() or text.isdigit() or text.isnumeric() or are_special_char(text.strip()):
-                element.text = text
-                continue
-            # Buscamos en el diccionario si el texto sin espacios ya ha sido traducido
-            if (transl:=st.session_state['diccionary'].get(text.strip())) is not None:
-                element.text = transl
-                continue
-            # Gestionamos la 'memoria' pasando texto anterior y posterior al prompt de traducción
-            # Solo para el document.xml
-            if doc == "document.xml":
-                texto_bruto:str = st.session_state['docx_text']
-                indice_init = texto_bruto.find(text)
-                indice_anterior = max(0, indice_init - 100) # Ojo índices del principio
-                texto_anterior = texto_bruto[indice_anterior:indice_init]
-                texto_anterior = "..." + " ".join(texto_anterior.split()[1:]) # Quitamos primera palabra y añadimos ...
-                # Sacamos el texto posterior
-                indice_fin = indice_init + len(text)
-                indice_posterior = min(indice_fin + 100, len(text))
-                texto_posterior = texto[indice_fin: indice_posterior]
-                texto_posterior = " ".join(texto_posterior.split()[:-1]) + "..."
-            else:
-                texto_anterior = "..."
-                texto_posterior = "..."
-            # Añadimos texto_anterior y posterior a la chain_params
-            chain_params['texto_anterior'] = texto_anterior
-            chain_params['texto_posterior'] = texto_posterior
-            # Pasamos por el traductor
-            response:OpenAIResponse = translate(apikey=apikey,
-                                            model=model,
-                                            text=text,
-                                            **chain_params)
-            translated_text:str = response.response
-            translation_cost:float = response.total_cost
-            # Si es una sola palabra añadimos al diccionario quitando espacios
-            if len(text.split()) == 1:
-                st.session_state['diccionary'][text.strip()] = translated_text.strip()
-            # Verificamos que los espacios al principio y al final coincidan con el texto original
-            # Si no coinciden añadimos espacios pertinentes.
-            if text[0].isspace() and (not translated_text[0].isspace()):
-                translated_text = " " + translated_text
-            if text[-1].isspace() and (not translated_text[-1].isspace()):
-                translated_text = translated_text + " " 
-            # Sustituimos el texto traducido en el elemento
-            element.text = translated_text
-            # Acumulamos coste en sesión y el número de palabras
-            accumulate_in_session(['real_total_cost', 'running_translated_words'], [translation_cost, num_running_words])
-            # Acumulado el texto en sesión
-            st.session_state['ultimo_texto_traducido'] = st.session_state.get('ultimo_texto_traducido', '') + translated_text
-            # Cada 50 elementos guardamos en db por si el proceso se interrumpe
-            if not id % CHECKPOINT_ELEMENT_STEP:
-                db_handler.update('clave', clave, {'ultimo_texto_traducido': st.session_state.get('ultimo_texto_traducido', '')})
-            # Cooldown aleatorio con probabilidad del 50%
-            if random.random() < 0.5:
-                wait_randomly(2)
-        # Limpiamos la barra de progreso
-        element_bar.empty()
-        # Guardamos el arbol en el archivo
-        tree.write(doc)
-    # Traducimos el nombre del documento
-    response:OpenAIResponse = translate(apikey=apikey,
-                                            model=model,
-                                            text=filename,
-                                            **chain_params)
-    translated_filename = response.response
-    translation_cost = response.total_cost
-    # Acumulamos los costes en sesión
-    accumulate_in_session(['real_total_cost'], [translation_cost])
-    # Guardamos en sesión el nombre traducido
-    save_in_session(['translated_filename'], [translated_filename])
-    # Limpiamos la barra de documentos
-    document_bar.empty()
-    # Guardamos en db el texto bruto traducido
-    db_handler.update('clave', clave, {'ultimo_texto_traducido': st.session_state.get('ultimo_texto_traducido', '')})
+    Parameters
+    ----------
+    barras : dict[str, delta_generator.DeltaGenerator]
+        barra de progreso de cada idioma destino
+
+    Returns
+    -------
+    Throttle
+        _description_
+    """
+    documento_actual = {}
+    def on_event(evento:Evento) -> None:
+        datos = evento.datos
+        idioma = datos['idioma']
+        if evento.tipo == events.DOCUMENTO_INICIADO:
+            documento_actual[idioma] = f"documento {datos['indice']}/{datos['n_documentos']}"
+            barras[idioma].progress(0, f"Traduciendo al {idioma} {documento_actual[idioma]}...")
+        elif evento.tipo == events.SEGMENTO_INICIADO:
+            barras[idioma].progress(datos['indice'] / datos['n_elementos'],
+                                    f"Traduciendo al {idioma} {documento_actual.get(idioma, '')} elemento {datos['indice']}/{datos['n_elementos']}")
+        elif evento.tipo == events.TRABAJO_FINALIZADO:
+            barras[idioma].empty()
+    return Throttle(on_event, max_por_segundo=UI_UPDATES_PER_SECOND)
+
+def accumulate_segment(evento:Evento) -> None:
+    """Suscriptor del bus que acumula en sesión el coste y las palabras traducidas
+    para que queden contabilizadas aunque el proceso se interrumpa.
+    """
+    palabras = evento.datos['palabras'] if evento.datos['origen'] == 'llm' else 0
+    accumulate_in_session(['real_total_cost', 'running_translated_words'], [evento.datos['coste'], palabras])
+
+def get_checkpoint_subscriber(clave:str, idioma:str) -> callable:
+    """Devuelve un suscriptor del bus que guarda en db el texto traducido hasta el momento
+    al idioma pasado
+    """
+    def on_checkpoint(evento:Evento) -> None:
+        if evento.datos.get('idioma', idioma) != idioma:
+            return
+        get_db_handler().update('clave', clave, {'ultimo_texto_traducido': evento.datos['texto_traducido']})
+    return on_checkpoint
 
 # MAIN FUNCTION
 def main() -> None:
@@ -263,6 +306,7 @@ def main() -> None:
     )
     # inicializamos session state
     init()
+    parse_cli_args()
     # Logo
     imagen_con_enlace('https://i.imgur.com/ITqqjOK.jpg','', centrar=True, max_width=8)
     # Titulo
@@ -277,11 +321,11 @@ def main() -> None:
     # inputs
     col1, col2 = st.columns(2)
     with col1:
-        texto("Introduce el idioma al que traducir", font_family='Dancing Script', font_size=20, centrar=True)
-        idioma = st.selectbox("idioma", 
-                            options=LISTA_IDIOMAS, 
+        texto("Introduce los idiomas a los que traducir", font_family='Dancing Script', font_size=20, centrar=True)
+        idiomas = st.multiselect("idiomas",
+                            options=LISTA_IDIOMAS,
                             label_visibility="hidden",
-                            index=1)
+                            default=[LISTA_IDIOMAS[1]])
     with col2:
         texto_descriptivo("Introduce tu clave")
         clave = st.text_input("clave", label_visibility="hidden", help="Tu clave personal dada por el administrador.")
@@ -296,87 +340,95 @@ def main() -> None:
     texto_descriptivo("Carga tu documento Word")
     documento = st.file_uploader("documento", label_visibility="hidden", type=["docx"], on_change=reset_all)
     if documento and not st.session_state.get('parsed_document'):
-        # Guardamos el nombre del archivo en sesión
-        nombre_archivo, _ = os.path.splitext(documento.name)
-        # Creamos la barra de progreso
-        preprocess_bar = st.progress(0)
-        t_wait = 0.2        
-        # Extraemos los textos
-        preprocess_bar.progress(0.25, 'Extrayendo los textos...')
-        docx_text = get_text_from_docx(BytesIO(documento.read()))
-        num_words = get_num_words(docx_text)
-        vocabulary = get_vocabulary(docx_text)
-        time.sleep(t_wait)     
-        # Sacamos el idioma del texto
-        preprocess_bar.progress(0.50, 'Identificando el idioma del documento...')
-        # Para el idioma pasamos el primer documento de la lista to_extract, que será siempre el document.xml
-        idioma_es, idioma_en = get_language(docx_text)
-        time.sleep(t_wait)
-        # Sacamos el tema del documento
-        preprocess_bar.progress(0.75, 'Identificando la temática del documento...')
-        # Para sacar el tema usamos el primer documento (document.xml)
-        topic:OpenAIResponse = get_topic(docx_text, idioma_es, documento.name)
-        preprocess_bar.progress(0.95, 'Estimando costes...')
-        estimated_cost = estimate_openai_cost(num_words)
-        time.sleep(t_wait)
-        # Guardamos todo en sesión
-        preprocess_bar.progress(1, 'Guardando en sesión...')
-        save_in_session(['nombre_archivo', 'docx_text', 'idioma_es', 'idioma_en', 'tematica',
-                            'num_words', 'estimated_cost', 'vocabulary', 'vocab_size'], 
-                        [nombre_archivo, docx_text, idioma_es, idioma_en, topic.response,
-                            num_words, estimated_cost, vocabulary, len(vocabulary)])
-        # Acumulamos los costes
-        accumulate_in_session(['real_total_cost'], [topic.total_cost])
-        time.sleep(t_wait)
-        preprocess_bar.empty()
-        # Activamos la flag para indicar que se ha cargado archivo correctamente
-        activate_flags(['parsed_document'])
+        # Lanzamos en segundo plano la extracción y segmentación de las partes xml
+        # para que estén listas cuando el usuario pulse Traducir
+        documento_bytes = documento.getvalue()
+        documento_id = hashlib.sha256(documento_bytes).hexdigest()
+        save_in_session(['preprocessing'], [start_preprocessing(st.session_state.get('preprocessing'),
+                                                                documento_id, documento_bytes)])
+        # Cada documento cargado es un trabajo con sus propias métricas
+        if (analisis:=st.session_state.get('analysis')) is None or analisis.documento_id != documento_id:
+            save_in_session(['job_metrics'], [JobMetrics(uuid.uuid4().hex)])
+        # Texto, idioma, temática y estimación se ejecutan en segundo plano según sus dependencias:
+        # la página se pinta sin esperar y en cada rerun se comprueba si han terminado
+        save_in_session(['analysis'], [start_analysis(st.session_state.get('analysis'), documento_id, documento_bytes,
+                                                        documento.name, st.session_state['job_metrics'].job_id)])
+        if st.session_state['analysis'].done():
+            save_analysis(documento.name)
+        else:
+            texto_descriptivo("Analizando el documento en segundo plano. Puedes ir completando el resto de campos.")
         # Escribimos el número de palabras al usuario
     if st.session_state.get('num_words') is not None:
         texto_descriptivo(f"Tu documento tiene {st.session_state['num_words']:,} palabras")
+    if (preprocesado:=st.session_state.get('preprocessing')) is not None and preprocesado.done():
+        # Los errores del preprocesado se muestran al traducir
+        with contextlib.suppress(Exception):
+            plan = preprocesado.result()
+            texto_descriptivo(f"{plan.n_llamadas:,} de {plan.n_segmentos:,} segmentos irán al traductor "
+                                f"(~{plan.tokens_estimados:,} tokens por idioma)")
+            if segmentos_originales := sum(parte.normalizacion.textos_antes for parte in plan.partes if parte.normalizacion):
+                texto_descriptivo(f"Segmentos tras fusionar los runs con el mismo formato: "
+                                    f"{plan.n_segmentos:,} de {segmentos_originales:,}")
+    # Si es una nueva versión de un documento ya traducido, solo se traducen los párrafos que cambian
+    documento_anterior = None
+    if documento and clave and st.checkbox("Es una nueva versión de un documento ya traducido"):
+        try:
+            documentos_anteriores = get_revision_db_handler().get_documents(clave)
+        except Exception as exc:
+            documentos_anteriores = []
+            texto_error(f'No se han podido leer las versiones anteriores: {exc}')
+        if documentos_anteriores:
+            nombre_archivo = st.session_state.get('nombre_archivo')
+            documento_anterior = st.selectbox("Versión anterior", options=documentos_anteriores,
+                                                index=documentos_anteriores.index(nombre_archivo)
+                                                if nombre_archivo in documentos_anteriores else 0)
+        else:
+            texto_descriptivo("No hay versiones anteriores guardadas con tu clave")
 
     añadir_salto()
     # Botón para traducir
     traducir = st.button(label="Traducir", use_container_width=True)
+    if traducir and documento and not st.session_state.get('parsed_document') and st.session_state.get('analysis'):
+        # El análisis aún no ha terminado: ahora sí hay que esperarlo
+        with st.spinner('Analizando el documento...'):
+            save_analysis(documento.name)
     if traducir and st.session_state.get('parsed_document') and not st.session_state.get('translated_document'):
         # Creamos la barra de progreso
         validation_bar = st.progress(0)
-        t_wait = 0.2
 
         # VALIDACIONES
         # Verificar que el idioma destino != idioma del documento
         validation_bar.progress(0.16, 'Verificando idiomas...')
-        time.sleep(t_wait)
-        if st.session_state['idioma_es'].lower() == idioma.lower():
+        if not idiomas:
+            show_error_and_stop('Elige al menos un idioma de destino.', [validation_bar])
+        if st.session_state['idioma_es'].lower() in (idioma.lower() for idioma in idiomas):
             show_error_and_stop(f'El idioma del documento y el idioma de destino no pueden coincidir.', [validation_bar])         
         # Verificar si la clave está insertada
         validation_bar.progress(0.16, 'Verificando clave...')
-        time.sleep(t_wait)
         if not clave:
             show_error_and_stop('Inserta una clave válida para continuar.', [validation_bar])
+        db_handler = get_db_handler()
         # Verificar si clave (o apikey) existe
         validation_bar.progress(0.16, 'Verificando clave...')
-        time.sleep(t_wait)
         if not exists_apikey(clave, db_handler):
             show_error_and_stop("La clave no es válida.", [validation_bar])
         # Verificar si apikey de admin
         validation_bar.progress(0.16, 'Verificando clave...')
-        time.sleep(t_wait)        
         if not apikey_is_admin(clave, db_handler):            
             # Verificar si usuario activo
             validation_bar.progress(0.16, 'Verificando usuario activo...')
-            time.sleep(t_wait)
             if not apikey_is_active(clave, db_handler):
                 show_error_and_stop("Tu clase no está activada. Contacta con el administrador.", [validation_bar])
             # Verificar si usuario palabras consumidas + palabras del documento < palabras contratadas
             validation_bar.progress(0.16, 'Verificando palabras restantes...')
-            time.sleep(t_wait)
-            if not has_words_left(clave, st.session_state.num_words, db_handler):
+            # Cada idioma destino consume las palabras del documento
+            if not has_words_left(clave, st.session_state.num_words * len(idiomas), db_handler):
                 show_error_and_stop(f"Has sobrepasado tu límite de palabras a traducir: {db_handler.get_palabras_limite(clave)}")
         # Guardamos la api key y el modelo en sesión
-        save_in_session(['openai_apikey', 'model'], [db_handler.get_api_key(clave), db_handler.get_model(clave)])
+        save_in_session(['openai_apikey', 'model', 'routing_policy', 'glosario'],
+                        [db_handler.get_api_key(clave), db_handler.get_model(clave),
+                            RoutingPolicy(**db_handler.get_routing(clave)), db_handler.get_glosario(clave)])
         validation_bar.progress(1, 'Validaciones completadass')
-        time.sleep(t_wait)
         validation_bar.empty()
         # Mostramos nombre del usuario y palabras acumuladas del total
         user_name = db_handler.get_nombre(clave)
@@ -387,48 +439,133 @@ def main() -> None:
 
         # TRADUCCIONES
         # A Partir de aqui usamos la api key
-        document_bar = st.progress(0)
-        element_bar = st.progress(0)
+        barras = {idioma: st.progress(0) for idioma in idiomas}
         start = time.perf_counter()
-        # Sacamos los archivos xml del documento
-        extract_word_to_xml(BytesIO(documento.read()))
-        # Confeccionamos la lista de documentos xml a parsear
-        to_extract_list = get_to_extract_list(WORD_FOLDER)
-        # lanzamos el bucle de traducción y reemplazo
+        job_metrics:JobMetrics = st.session_state['job_metrics']
+        # Recogemos las partes xml ya segmentadas en segundo plano desde la carga del documento
         try:
-            extract_translate_replace(
-                apikey=st.session_state.get('openai_apikey'),
-                clave=clave,
-                model=st.session_state.get('model'),
-                target_language=idioma,
-                filename=st.session_state.get('nombre_archivo'),
-                to_extract_list=to_extract_list,
-                document_words=st.session_state['num_words'],
-                progress_bar_list=[document_bar, element_bar],
-                chain_params={
-                'origin_lang': st.session_state['idioma_es'],
-                'destiny_lang': idioma,
-                'doc_features': st.session_state['tematica'],
-                'doc_context': contexto,
-            })
+            with job_metrics.stage('preprocessing_wait'):
+                preparado = st.session_state['preprocessing'].result()
+        except PreprocessingCancelled:
+            show_error_and_stop('El documento ha cambiado. Vuelve a pulsar Traducir.', list(barras.values()))
         except Exception as exc:
-            show_error_and_stop(f"Ha ocurrido un error: {exc}", [document_bar, element_bar])
+            show_error_and_stop(f"Ha ocurrido un error al extraer el documento: {exc}", list(barras.values()))
+        # Cargamos de la memoria de traducción las unidades que coinciden con segmentos del documento
+        claves_documento = get_memory_keys(preparado.partes)
+        memoria_previa = {}
+        for idioma in idiomas:
+            diccionario = st.session_state['diccionary'].setdefault(idioma, {})
+            try:
+                diccionario.update(get_tm_db_handler().get_translations(clave, st.session_state['idioma_es'], idioma,
+                                                                        claves_documento - diccionario.keys()))
+            except Exception as exc:
+                texto_error(f'No se ha podido leer la memoria de traducción: {exc}')
+            memoria_previa[idioma] = set(diccionario)
+        # Párrafos sin cambios respecto a la versión anterior, por idioma
+        revisiones = {}
+        if documento_anterior is not None:
+            for idioma in idiomas:
+                if (registro := get_revision_db_handler().get_revision(clave, documento_anterior, idioma)) is None:
+                    continue
+                coincidencia = match_revision(preparado.partes, registro)
+                revisiones[idioma] = coincidencia.traducciones
+                texto_descriptivo(f"{idioma}: {coincidencia.parrafos_reutilizados:,} de {coincidencia.parrafos:,} "
+                                    f"párrafos sin cambios respecto a {documento_anterior}")
+        # Suscribimos la interfaz, la sesión, la db y el logging al bus de eventos
+        bus = EventBus()
+        bus.subscribe(get_progress_subscriber(barras))
+        bus.subscribe(accumulate_segment, [events.SEGMENTO_FINALIZADO, events.LLAMADA_DESCARTADA])
+        bus.subscribe(get_checkpoint_subscriber(clave, idiomas[0]), [events.CHECKPOINT, events.TRABAJO_FINALIZADO])
+        bus.subscribe(log_event)
+        bus.subscribe(job_metrics.on_event)
+        # Inicializamos en sesión el número de running words traducidas
+        st.session_state['running_translated_words'] = 0
+        # lanzamos el bucle de traducción y reemplazo: una sola extracción y un hilo por idioma
+        resultados = {}
+        try:
+            with profile(job_metrics.job_id, 'job'):
+                resultados = translate_to_languages(
+                    idiomas=idiomas,
+                    apikey=st.session_state.get('openai_apikey'),
+                    model=st.session_state.get('model'),
+                    filename=st.session_state.get('nombre_archivo'),
+                    partes=preparado.partes,
+                    document_words=st.session_state['num_words'],
+                    diccionarios=st.session_state['diccionary'],
+                    bus=bus,
+                    routing_policy=st.session_state['routing_policy'],
+                    glosarios=st.session_state['glosario'],
+                    revisiones=revisiones,
+                    scheduler=get_scheduler(),
+                    tenant=clave,
+                    prioritario=is_priority_job(st.session_state['num_words'], len(idiomas)),
+                    hedger=get_hedger(),
+                    chain_params={
+                    'origin_lang': st.session_state['idioma_es'],
+                    'doc_features': st.session_state['tematica'],
+                    'doc_context': contexto,
+                })
+            save_in_session(['ultimo_texto_traducido'], [resultados[idiomas[0]].texto_traducido])
+            if sin_traducir := job_metrics.get_counter('segments_total', origen='sin_traducir'):
+                texto_error(f"{sin_traducir:,.0f} segmentos se han dejado sin traducir porque el modelo no ha respondido a tiempo")
+        except Exception as exc:
+            show_error_and_stop(f"Ha ocurrido un error: {exc}", list(barras.values()))
         finally:
             try:
                 # Actualizamos la fecha actual y los campos último coste y últimas palabras
                 db_handler.update('clave', clave, {'ultimo_uso': get_datetime_formatted(),})
                 db_handler.update('clave', clave, {'ultimo_coste': st.session_state['real_total_cost']})
                 db_handler.update('clave', clave, {
-                    'ultimo_palabras': min(st.session_state['running_translated_words'], st.session_state['num_words'])})
+                    'ultimo_palabras': min(st.session_state['running_translated_words'],
+                                            st.session_state['num_words'] * len(idiomas))})
                 # Incrementamos en db las palabras traducidas y el coste
                 db_handler.increment_number('clave', clave, 'palabras_acumulado', st.session_state['running_translated_words'])
                 db_handler.increment_number('clave', clave, 'coste_acumulado', st.session_state['real_total_cost'])
             except Exception as exc:
                 texto_error(f'Se ha producido el siguiente error al guardar los datos: {exc}')
-        # Pasamos por el validator de XML para para en caso de que haya salido algo mal
-        xml_ok, error = all_xml_files_good(WORD_FOLDER)
-        if not xml_ok:
-            show_error_and_stop(f'Ha habido un error con los XML: {", ".join(error)}. Inténtalo con otro archivo.')
+        # Solo validamos las partes xml que hemos modificado, en memoria
+        for idioma, resultado in resultados.items():
+            with job_metrics.stage('validation'), profile(job_metrics.job_id, 'validation'):
+                xml_ok, error = all_xml_parts_good(resultado.partes_modificadas, validar_esquema=True)
+            if not xml_ok:
+                show_error_and_stop(f'Ha habido un error con los XML en {idioma}: {", ".join(error)}. Inténtalo con otro archivo.')
+        # Añadimos a la memoria de traducción las entradas aprendidas en este trabajo
+        try:
+            for idioma, claves_previas in memoria_previa.items():
+                diccionario = st.session_state['diccionary'][idioma]
+                get_tm_db_handler().insert_units(clave, (MemoryEntry(origen, diccionario[origen], st.session_state['idioma_es'], idioma)
+                                                            for origen in diccionario.keys() - claves_previas))
+        except Exception as exc:
+            texto_error(f'Se ha producido el siguiente error al guardar la memoria de traducción: {exc}')
+        # Guardamos la traducción de cada idioma como revisión para las próximas versiones del documento
+        try:
+            for idioma, resultado in resultados.items():
+                get_revision_db_handler().save_revision(RevisionDB(
+                    clave=clave, documento=st.session_state['nombre_archivo'], idioma=idioma,
+                    partes=build_revision_record(preparado.partes, resultado.traducciones,
+                                                    resultado.sin_traducir)))
+        except Exception as exc:
+            texto_error(f'Se ha producido el siguiente error al guardar la revisión: {exc}')
+        # Generamos una sola vez un archivo Word por idioma (y el zip con todos) y los guardamos en
+        # sesión: cada rerun de Streamlit solo vuelve a pintar los botones de descarga
+        archivos_descarga = {}
+        for idioma, resultado in resultados.items():
+            archivo_descarga = add_suffix_to_filename(documento.name, [resultado.translated_filename,
+                                                                        get_model_version(st.session_state['model'])])
+            buffer = BytesIO()
+            with job_metrics.stage('rebuild'), profile(job_metrics.job_id, 'rebuild'):
+                build_docx_from_original(buffer, documento.getvalue(), resultado.partes_modificadas)
+            archivos_descarga[idioma] = (archivo_descarga, buffer.getvalue())
+        zip_descarga = None
+        if len(archivos_descarga) > 1:
+            buffer = BytesIO()
+            # Una carpeta por idioma por si dos traducciones del nombre coinciden
+            build_zip(buffer, {f"{idioma}/{archivo_descarga}": contenido
+                                for idioma, (archivo_descarga, contenido) in archivos_descarga.items()})
+            zip_descarga = buffer.getvalue()
+        save_in_session(['archivos_descarga', 'zip_descarga'], [archivos_descarga, zip_descarga])
+        # Exportamos las métricas del trabajo una sola vez, con la reconstrucción incluida
+        job_metrics.export()
         # Activamos la flag de traducción
         activate_flags(['translated_document'])
         # Visualizar tiempo transcurrido
@@ -436,26 +573,66 @@ def main() -> None:
         minutos = (time.perf_counter() - start) // 60
         segundos = (time.perf_counter() - start) % 60
         texto_descriptivo(f'Traducción finalizada. Tiempo transcurrido: <b>{minutos:.0f} minutos y {segundos:.0f} segundos</b>.') 
+        if (espera_cola := job_metrics.get_histogram('stage_duration_seconds', stage='queue_wait')) is not None:
+            texto_descriptivo(f"Espera media en cola por llamada: {espera_cola.sum / espera_cola.count:.2f} s")
+        get_scheduler().log_queue_delays()
+        if duplicadas := job_metrics.get_counter('hedged_calls_total'):
+            texto_descriptivo(f"Llamadas lentas duplicadas: {duplicadas:.0f}. "
+                                f"Coste de las descartadas: {job_metrics.get_counter('hedge_discarded_cost_dollars_total'):.4f} $")
+        if (politica := st.session_state['routing_policy']).activo:
+            economicos = job_metrics.sum_counters('routing_decisions_total', model=politica.modelo_economico)
+            texto_descriptivo(f"Segmentos enviados al modelo económico: {economicos:.0f}. "
+                                f"Ahorro estimado: {job_metrics.get_counter('routing_savings_dollars_total'):.4f} $")
+            latencias = job_metrics.latency_by_model()
+            if latencias:
+                texto_descriptivo("Latencia media por llamada: " + ", ".join(
+                    f"{modelo} {media:.2f} s ({llamadas})" for modelo, (llamadas, media) in latencias.items()))
+            ahorro_latencia = get_routing_latency_savings(latencias, politica.modelo_economico,
+                                                            politica.modelo_premium or st.session_state['model'])
+            if ahorro_latencia is not None:
+                texto_descriptivo(f"Tiempo de LLM ahorrado con el modelo económico: {ahorro_latencia:.1f} s")
+        # Solo hay tokens cacheados si el proveedor los informa (prefijos de 1024 tokens o más)
+        if job_metrics.get_counter('cached_prompt_tokens_total'):
+            texto_descriptivo(f"Tokens de prompt: {job_metrics.get_counter('prompt_tokens_total'):,.0f}. "
+                                f"Servidos desde la caché del proveedor: {job_metrics.cached_token_ratio():.0%}")
+        elif prompt_tokens := job_metrics.get_counter('prompt_tokens_total'):
+            texto_descriptivo(f"Tokens de prompt: {prompt_tokens:,.0f}")
+        if revisiones:
+            texto_descriptivo(f"Segmentos reutilizados de la versión anterior: {job_metrics.revision_reuse_ratio():.0%}. "
+                                f"Ahorro estimado: {job_metrics.get_counter('revision_savings_dollars_total'):.4f} $")
+        if terminos_glosario := job_metrics.get_counter('glossary_terms_total'):
+            texto_descriptivo(f"Términos del glosario aplicados: {terminos_glosario:.0f}. "
+                                f"No respetados: {job_metrics.get_counter('glossary_violations_total'):.0f}")
         
     
         # RECONTRUCCION  Y DESCARGA DEL DOCUMENTO
-    if st.session_state.get('translated_document'):        
-        # Generamos de nuevo el archivo Word
-        archivo_descarga = add_suffix_to_filename(documento.name, [st.session_state.get('translated_filename'), 
-                                                                    get_model_version(st.session_state['model'])])
-        build_docx_from_xml(archivo_descarga)
-        # Mostrar botón para descargar el archivo traducido.
+    if st.session_state.get('translated_document'):
+        archivos_descarga = st.session_state['archivos_descarga']
+        # Mostrar botón para descargar cada archivo traducido.
         añadir_salto()
-        with open(archivo_descarga, "rb") as file:
+        agrupar = st.session_state['zip_descarga'] is not None and st.checkbox("Descargar todos los idiomas en un zip")
+        if agrupar:
             st.download_button(
-                label = "Descargar",
-                data = file,
-                file_name = archivo_descarga,
-                mime = "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                #on_click=update_counter, # TODO: Agregar contador de veces que se descarga archivo
+                label = "Descargar zip",
+                data = st.session_state['zip_descarga'],
+                file_name = f"{st.session_state['nombre_archivo']}.zip",
+                mime = "application/zip",
                 use_container_width=True,
-                help="Descarga el documento traducido"
+                help="Descarga los documentos traducidos en un zip"
             )
+        else:
+            for idioma, (archivo_descarga, contenido) in archivos_descarga.items():
+                st.download_button(
+                    label = f"Descargar ({idioma})",
+                    data = contenido,
+                    file_name = archivo_descarga,
+                    mime = "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    #on_click=update_counter, # TODO: Agregar contador de veces que se descarga archivo
+                    use_container_width=True,
+                    help="Descarga el documento traducido"
+                )
+    añadir_salto()
+    translation_memory_section(clave)
     st.session_state
     # Footer
     put_footer()
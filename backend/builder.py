@@ -14,35 +14,137 @@
 
 # Script con el código relacionado con la creación del nuevo documento Word ya traducido
 
-import os
-import xml.etree.ElementTree as ET
+import copy
+from io import BytesIO
+import struct
+import sys
+from typing import BinaryIO
 import zipfile
 
 from dotenv import load_dotenv
 
-from .paths import XML_FOLDER
-
 load_dotenv()
 
-def build_docx_from_xml(archivo_destino:str, directorio_fuente:str=XML_FOLDER) -> None:
-    """Crea un archivo docx a partir de su árbol de documentos xml
+# Cabecera local de una entrada del zip según la especificación APPNOTE (sección 4.3.7):
+# firma, versión, flags, método, hora, fecha, CRC, tamaños y longitudes del nombre y del campo extra
+LOCAL_HEADER = struct.Struct('<4s5HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# Bit 3 de los flags: CRC y tamaños en un data descriptor tras los datos
+DATA_DESCRIPTOR_FLAG = 0x08
+# La escritura en bruto registra la entrada en el ZipFile destino a través de atributos
+# internos de zipfile (fp, filelist, NameToInfo, start_dir, _didModify, _writing).
+# Solo se usa en las versiones de CPython en las que se ha comprobado; en el resto se
+# descomprime y recomprime con la API pública.
+RAW_COPY_VERSIONS = ((3, 8), (3, 14))
+RAW_COPY_ATTRIBUTES = ('fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify', '_writing')
+
+def _read_raw_member(documento:bytes, info:zipfile.ZipInfo) -> bytes:
+    """Devuelve los bytes comprimidos tal cual están en el zip original,
+    sin descomprimirlos. La cabecera local se lee en la posición pública
+    ZipInfo.header_offset.
+
+    Parameters
+    ----------
+    documento : bytes
+        el zip original en bytes
+    info : zipfile.ZipInfo
+        entrada del zip a leer
+
+    Returns
+    -------
+    bytes
+        datos comprimidos de la entrada
+
+    Raises
+    ------
+    zipfile.BadZipFile
+        si en header_offset no hay una cabecera local
+    """
+    cabecera = LOCAL_HEADER.unpack_from(documento, info.header_offset)
+    if cabecera[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Cabecera local incorrecta en {info.filename}")
+    # Saltamos el nombre y el campo extra de la cabecera local
+    inicio = info.header_offset + LOCAL_HEADER.size + cabecera[-2] + cabecera[-1]
+    return documento[inicio:inicio + info.compress_size]
+
+def can_copy_raw(zip_destino:zipfile.ZipFile) -> bool:
+    """Si se pueden escribir entradas en bruto en el zip destino en esta versión de Python"""
+    return (RAW_COPY_VERSIONS[0] <= sys.version_info[:2] < RAW_COPY_VERSIONS[1]
+            and all(hasattr(zip_destino, atributo) for atributo in RAW_COPY_ATTRIBUTES)
+            and not zip_destino._writing)
+
+def _write_raw_member(zip_destino:zipfile.ZipFile, info:zipfile.ZipInfo, datos_comprimidos:bytes) -> None:
+    """Escribe una entrada ya comprimida en el zip destino sin recomprimirla,
+    manteniendo CRC, tamaños, fecha y método de compresión originales.
+    Solo se debe llamar si can_copy_raw(zip_destino).
+
+    Parameters
+    ----------
+    zip_destino : zipfile.ZipFile
+        zip destino abierto en modo escritura
+    info : zipfile.ZipInfo
+        entrada del zip original
+    datos_comprimidos : bytes
+        bytes comprimidos leídos con _read_raw_member
+    """
+    nueva_info = copy.copy(info)
+    # CRC y tamaños ya se conocen: van en la cabecera local y no en un data descriptor
+    nueva_info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    nueva_info.header_offset = zip_destino.fp.tell()
+    zip_destino.fp.write(nueva_info.FileHeader())
+    zip_destino.fp.write(datos_comprimidos)
+    # Registramos la entrada para que aparezca en el directorio central
+    zip_destino.filelist.append(nueva_info)
+    zip_destino.NameToInfo[nueva_info.filename] = nueva_info
+    zip_destino.start_dir = zip_destino.fp.tell()
+    zip_destino._didModify = True
+
+def build_docx_from_original(
+        archivo_destino:str|BinaryIO,
+        documento_original:bytes,
+        partes_modificadas:dict[str, bytes],
+        ) -> None:
+    """Crea el docx traducido a partir del docx original.
+    Las partes no modificadas (imágenes, fuentes, objetos embebidos...) se copian
+    con sus bytes comprimidos sin recomprimir (o se recomprimen con la API pública
+    de zipfile si la versión de Python no está soportada, ver can_copy_raw) y solo
+    las partes xml modificadas se vuelven a comprimir con deflate. Se conserva el orden original de las entradas
+    y sus metadatos, de forma que [Content_Types].xml sigue siendo la primera.
+
+    Parameters
+    ----------
+    archivo_destino : str | BinaryIO
+        ruta o buffer donde escribir el docx
+    documento_original : bytes
+        el docx original en bytes
+    partes_modificadas : dict[str, bytes]
+        nombre de la parte dentro del docx y su nuevo contenido
+    """
+    with zipfile.ZipFile(BytesIO(documento_original), 'r') as zip_origen, \
+            zipfile.ZipFile(archivo_destino, 'w') as zip_destino:
+        for info in zip_origen.infolist():
+            if info.filename in partes_modificadas:
+                nueva_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                nueva_info.compress_type = zipfile.ZIP_DEFLATED
+                nueva_info.external_attr = info.external_attr
+                nueva_info.create_system = info.create_system
+                zip_destino.writestr(nueva_info, partes_modificadas[info.filename])
+            elif can_copy_raw(zip_destino):
+                _write_raw_member(zip_destino, info, _read_raw_member(documento_original, info))
+            else:
+                zip_destino.writestr(info, zip_origen.read(info))
+
+def build_zip(archivo_destino:str|BinaryIO, archivos:dict[str, bytes]) -> None:
+    """Agrupa varios archivos (p.ej. los docx traducidos a cada idioma) en un zip.
+    Los docx ya van comprimidos, así que se guardan sin recomprimir.
 
     Parameters
     ----------
-    archivo_destino : str
-        _description_
-    directorio_fuente : str, optional
-        _description_, by default XML_FOLDER
+    archivo_destino : str | BinaryIO
+        ruta o buffer donde escribir el zip
+    archivos : dict[str, bytes]
+        nombre de cada archivo dentro del zip y su contenido
     """
-    # Crea un archivo zip con la opción de escritura
-    with zipfile.ZipFile(archivo_destino, 'w') as docx:
-        # Camina por el directorio fuente
-        for root, dirs, files in os.walk(directorio_fuente):
-            for file in files:
-                # Crea el path completo del archivo
-                full_path = os.path.join(root, file)
-                # Crea el path relativo que va dentro del zip,
-                # esto es importante para mantener la estructura
-                rel_path = os.path.relpath(full_path, directorio_fuente)
-                # Agrega el archivo al zip
-                docx.write(full_path, rel_path)
+    with zipfile.ZipFile(archivo_destino, 'w', compression=zipfile.ZIP_STORED) as zip_destino:
+        for nombre, contenido in archivos.items():
+            zip_destino.writestr(nombre, contenido)
@@ -16,17 +16,79 @@ limitations under the License.
 Script con el código relacionado con langchain, los prompts y las chains
     """
 
+from typing import Any
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import LLMResult
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables.base import RunnableSequence
-from langchain_openai import ChatOpenAI
 import os
 
-OPENAI_API_KEY_ADMIN = os.environ['OPENAI_API_KEY']
+from .llm_backends import LLM_BACKENDS, DEFAULT_CASSETTE, CassetteChatModel, FakeChatModel
+
+# Prompt de traducción con memoria separado en un mensaje de sistema, idéntico en todas las
+# llamadas de un trabajo (instrucciones fijas primero y después los campos del trabajo),
+# y un mensaje de usuario mínimo con lo que cambia en cada segmento. El mensaje de sistema
+# no llega a los 1024 tokens que OpenAI exige para cachear un prefijo, así que con este prompt
+# no se esperan tokens cacheados; PromptUsageCallback solo registra los que informe el proveedor.
+TRANSLATION_SYSTEM_PROMPT = '''Eres un experto traductor de documentos.
+Los textos del documento a traducir serán en forma de palabras, frases o párrafos.
+Se te pasará el texto anterior y posterior al texto a traducir para que tengas el contexto.
+Respeta el formato del texto en la traducción. Ejemplo de Español a Francés:
+TEXTO: ' dónde hacía calor, '
+TRADUCCIÓN: ' où il faisait chaud, '
 
-def get_llm(temperature:float, api_key:str, model:str='gpt-3.5-turbo') -> ChatOpenAI:
-    """Devuelve un objeto ChatOpenAi de langchain con los parametros
-    pasados por argumento
+No traduzcas nombres propios.
+Mantén sin cambios los marcadores como ⟦1⟧ y ⟦2⟧.
+Si se te da un glosario, usa sus traducciones.
+Traduce solo el TEXTO A TRADUCIR.
+
+Tu misión es traducir un documento del {idioma_origen} al {idioma_destino}.
+El documento es {tematica} de tipo {contexto}.
+Traduce solo los textos en {idioma_origen}.
+Responde solo con la traducción en {idioma_destino}.'''
+TRANSLATION_HUMAN_PROMPT = '''{glosario}
+TEXTO ANTERIOR: {texto_anterior}
+TEXTO POSTERIOR: {texto_posterior}
+TEXTO A TRADUCIR: {texto}
+TRADUCCIÓN:'''
+
+class PromptUsageCallback(BaseCallbackHandler):
+    """Acumula los tokens de prompt y los tokens de prompt servidos desde la caché del proveedor
+    (prompt_tokens_details.cached_tokens en OpenAI) de las llamadas de una chain.
+    """
+    def __init__(self) -> None:
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def on_llm_end(self, response:LLMResult, **kwargs:Any) -> None:
+        uso = (response.llm_output or {}).get('token_usage') or {}
+        if uso:
+            self.prompt_tokens += uso.get('prompt_tokens', 0)
+            self.cached_tokens += (uso.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+            return
+        # Sin llm_output (p.ej. streaming) el uso viene en los metadatos del mensaje
+        for generaciones in response.generations:
+            for generacion in generaciones:
+                metadatos = getattr(getattr(generacion, 'message', None), 'usage_metadata', None) or {}
+                self.prompt_tokens += metadatos.get('input_tokens', 0)
+                self.cached_tokens += (metadatos.get('input_token_details') or {}).get('cache_read', 0)
+
+def get_admin_api_key() -> str:
+    """Devuelve la api key de OpenAI del administrador. Se lee al usarla y no al importar
+    el módulo, para que la app arranque sin ella y sin cargar el entorno antes de tiempo.
+    """
+    return os.environ['OPENAI_API_KEY']
+
+def get_llm(temperature:float, api_key:str, model:str='gpt-3.5-turbo', timeout:float | None=None) -> BaseChatModel:
+    """Devuelve el LLM de langchain con los parametros pasados por argumento.
+    El backend se elige con la variable de entorno TRUEFORM_LLM_BACKEND:
+    - 'openai' (por defecto): ChatOpenAI
+    - 'fake': FakeChatModel local configurado con las variables TRUEFORM_FAKE_*
+    - 'record': ChatOpenAI grabando las respuestas en el cassette TRUEFORM_CASSETTE
+    - 'replay': respuestas del cassette TRUEFORM_CASSETTE, sin red
 
     Parameters
     ----------
@@ -36,15 +98,32 @@ def get_llm(temperature:float, api_key:str, model:str='gpt-3.5-turbo') -> ChatOp
         _description_
     model : str, optional
         _description_, by default 'gpt3.5-turbo'
+    timeout : float | None, optional
+        segundos máximos por petición a OpenAI, by default None
 
     Returns
     -------
-    ChatOpenAI
+    BaseChatModel
         _description_
     """
-    return ChatOpenAI(temperature=temperature,
+    backend = os.environ.get('TRUEFORM_LLM_BACKEND', 'openai')
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"TRUEFORM_LLM_BACKEND debe ser uno de {LLM_BACKENDS}, no {backend!r}")
+    if backend == 'fake':
+        return FakeChatModel.from_env(model)
+    ruta_cassette = os.environ.get('TRUEFORM_CASSETTE', DEFAULT_CASSETTE)
+    if backend == 'replay':
+        return CassetteChatModel(modo='replay', ruta=ruta_cassette, model_name=model, temperature=temperature)
+    # Import diferido: langchain_openai (y openai) son lentos de importar
+    from langchain_openai import ChatOpenAI
+    llm = ChatOpenAI(temperature=temperature,
                         openai_api_key=api_key,
-                        model=model)
+                        model=model,
+                        timeout=timeout)
+    if backend == 'record':
+        return CassetteChatModel(modo='record', ruta=ruta_cassette, model_name=model,
+                                    temperature=temperature, inner=llm)
+    return llm
 
 def get_topic_chain() -> RunnableSequence:
     """Devuelve la chain de sacar el topic para invocar con los parámetros
@@ -74,7 +153,7 @@ def get_topic_chain() -> RunnableSequence:
         El documento en cuestión es
         '''
         )
-    llm = get_llm(0.3, OPENAI_API_KEY_ADMIN)
+    llm = get_llm(0.3, get_admin_api_key())
 
     chain = (
         prompt_traduccion
@@ -110,6 +189,7 @@ def get_translation_chain(apikey:str, model:str) -> RunnableSequence:
 
         Traduce solo los textos en {idioma_origen}.
         No traduzcas nombres propios.
+        Mantén sin cambios los marcadores como ⟦1⟧ y ⟦2⟧.
         Responde solo con la traducción en {idioma_destino}.
 
         TEXTO: {texto}
@@ -124,9 +204,10 @@ def get_translation_chain(apikey:str, model:str) -> RunnableSequence:
     )
     return chain
 # Prueba de chain insertando una especie de 'memoria'
-def get_translation_chain_with_memory(apikey:str, model:str) -> RunnableSequence:
+def get_translation_chain_with_memory(apikey:str, model:str, timeout:float | None=None) -> RunnableSequence:
     """Devuelve la chain para la traducción de los textos.
-    Este prompt incorpora el texto anterior y posterior
+    Este prompt incorpora el texto anterior y posterior.
+    El mensaje de sistema no cambia dentro de un trabajo y el de usuario solo lleva el segmento
 
     Parameters
     ----------
@@ -134,34 +215,19 @@ def get_translation_chain_with_memory(apikey:str, model:str) -> RunnableSequence
         _description_
     model : str
         _description_
+    timeout : float | None, optional
+        segundos máximos por petición a OpenAI, by default None
 
     Returns
     -------
     RunnableSequence
         _description_
     """
-    prompt = ChatPromptTemplate.from_template(
-        '''
-        Eres un experto traductor de documentos.
-        Tu misión es traducir un documento del {idioma_origen} al {idioma_destino}.
-        El documento es {tematica} de tipo {contexto}.
-        Los textos del documento a traducir serán en forma de palabras, frases o párrafos.
-        Se te pasará el texto anterior y posterior al texto a traducir para que tengas el contexto.
-        Respeta el formato del texto en la traducción. Ejemplo de Español a Francés:
-        TEXTO: ' dónde hacía calor, '
-        TRADUCCIÓN: ' où il faisait chaud, '
-
-        Traduce solo los textos en {idioma_origen}.
-        No traduzcas nombres propios.
-        Traduce solo el TEXTO A TRADUCIR.
-        Responde solo con la traducción en {idioma_destino}.
-
-        TEXTO ANTERIOR: {texto_anterior}
-        TEXTO POSTERIOR: {texto_posterior}
-        TEXTO A TRADUCIR: {texto}
-        TRADUCCIÓN:
-        ''')
-    llm = get_llm(0.1, api_key=apikey, model=model)
+    prompt = ChatPromptTemplate.from_messages([
+        ('system', TRANSLATION_SYSTEM_PROMPT),
+        ('human', TRANSLATION_HUMAN_PROMPT),
+    ])
+    llm = get_llm(0.1, api_key=apikey, model=model, timeout=timeout)
 
     chain = (
         prompt
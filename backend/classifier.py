@@ -0,0 +1,107 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el clasificador de segmentos. Decide, sin llamar al LLM, si un segmento:
+# - SKIP: no es lingüístico (números, URLs, emails, códigos, fechas, importes, rutas,
+#   números romanos, puntuación...) y se deja tal cual
+# - MASK: mezcla texto con entidades no lingüísticas que se pueden enmascarar
+# - TRANSLATE: texto normal a traducir
+# Todos los patrones se compilan una sola vez al importar el módulo.
+
+from collections import Counter
+from collections.abc import Iterable
+import re
+import string
+
+SKIP = 'skip'
+MASK = 'mask'
+TRANSLATE = 'translate'
+
+PUNCTUATION = string.punctuation + '“”‘’«»¿¡…–—•·°'
+_NO_WORD_BEFORE = r'(?<![\w@/.-])'
+_NO_WORD_AFTER = r'(?![\w@/-])'
+_ROMAN = r'(?=[MDCLXVI])(?!I(?!\w))M{0,3}(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})(?![\w])'
+# Palabras tras las que un número romano es un número y no una palabra en mayúsculas
+ROMAN_CONTEXT_WORDS = (
+    'capítulo', 'siglo', 'tomo', 'libro', 'parte', 'título', 'anexo', 'apartado', 'sección', 'artículo',
+    'volumen', 'fase', 'chapter', 'century', 'part', 'book', 'volume', 'section', 'article', 'annex',
+    'appendix', 'phase',
+)
+_ROMAN_AFTER_WORD = '(?:' + "|".join(f'(?<=\\b(?i:{palabra})\\s)' for palabra in ROMAN_CONTEXT_WORDS) + ')'
+
+# Entidades no lingüísticas con nombre. El orden importa: las más específicas primero.
+ENTITY_PATTERNS = {
+    'url': r'(?:https?://|www\.)[^\s<>"]+[^\s<>".,;:!?)\]]',
+    'email': r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+',
+    # Solo rutas con ancla (unidad, \\, ~/, ./ o una / inicial con al menos dos componentes)
+    # y sin espacios: 'y/o', 'km/h' o 'input/output' son texto
+    'path': (r'(?<![\w/.~\\])(?:[A-Za-z]:\\|\\\\|~/|\.{1,2}/)[\w.\\/-]*\w'
+                r'|(?<![\w/.~\\])/[\w.-]*\w(?:/[\w.-]*\w)+'
+                r'|[\w-]+\.(?:docx?|xlsx?|pptx?|pdf|txt|csv|xml|json|zip|png|jpe?g)\b'),
+    'date': _NO_WORD_BEFORE + r'(?:\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}[/.-]\d{1,2}[/.-]\d{1,2})' + _NO_WORD_AFTER,
+    'amount': (r'(?:[€$£¥]\s?[+-]?\d[\d.,\s]*\d|[€$£¥]\s?\d'
+                r'|[+-]?\d[\d.,]*\s?(?:€|\$|£|¥|EUR|USD|GBP)(?![A-Za-z]))'),
+    'code': _NO_WORD_BEFORE + r'(?=[A-Z0-9_/.-]*\d)(?=[A-Z0-9_/.-]*[A-Z-])[A-Z0-9]+(?:[-_/.][A-Z0-9]+)+' + _NO_WORD_AFTER
+            + r'|' + _NO_WORD_BEFORE + r'[A-Z]{1,4}\d{2,}[A-Z0-9]*' + _NO_WORD_AFTER,
+    # Numeración de apartados (3.1.2) como una sola entidad. No si sigue un decimal con coma
+    # o un porcentaje: 1.234,56 y 1.234.567 % los enmascara number
+    'outline': _NO_WORD_BEFORE + r'\d+(?:\.\d+)+(?![.,]\d|\s?%)' + _NO_WORD_AFTER,
+    'number': _NO_WORD_BEFORE + r'[+-]?\d+(?:[.,\s]\d{3})*(?:[.,]\d+)?(?:\s?%)?' + _NO_WORD_AFTER,
+    # Solo con contexto (una palabra como Capítulo o Siglo delante, o un marcador de lista
+    # como 'IV.' o 'II)'), nunca una I suelta: 'I am', 'MI CASA' o 'MIX' son texto
+    'roman': _ROMAN_AFTER_WORD + _ROMAN + r'|(?<![\w])' + _ROMAN + r'(?=[.)](?:\s|$))',
+}
+ENTITY_PATTERN = re.compile("|".join(f"(?P<{nombre}>{patron})" for nombre, patron in ENTITY_PATTERNS.items()))
+PUNCTUATION_OR_SPACE = re.compile(f"[{re.escape(PUNCTUATION)}\\s]*")
+
+def classify_segment(texto:str | None) -> str:
+    """Devuelve SKIP, MASK o TRANSLATE para el segmento
+
+    Parameters
+    ----------
+    texto : str | None
+        texto del w:t
+
+    Returns
+    -------
+    str
+        etiqueta del segmento
+    """
+    if texto is None or len(texto) == 1 or texto.isspace() or texto.isnumeric():
+        return SKIP
+    texto = texto.strip()
+    if PUNCTUATION_OR_SPACE.fullmatch(texto):
+        return SKIP
+    residuo = ENTITY_PATTERN.sub('', texto)
+    if PUNCTUATION_OR_SPACE.fullmatch(residuo):
+        return SKIP
+    if len(residuo) != len(texto):
+        return MASK
+    return TRANSLATE
+
+def classify_segments(textos:Iterable[str | None]) -> tuple[list[str], Counter[str]]:
+    """Clasifica en una sola pasada una lista de segmentos
+
+    Parameters
+    ----------
+    textos : Iterable[str | None]
+        _description_
+
+    Returns
+    -------
+    tuple[list[str], Counter[str]]
+        etiqueta de cada segmento y recuento por etiqueta
+    """
+    etiquetas = [classify_segment(texto) for texto in textos]
+    return etiquetas, Counter(etiquetas)
@@ -15,19 +15,34 @@
 # Script con el código relacionado la comunicación con base de datos
 # y modelos de base de datos
 
-from collections.abc import Sequence
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator, Sequence
+from functools import cache
 import json
 import os
-from typing import Any, Union
+from typing import TYPE_CHECKING, Any, Union
 
-from passlib.context import CryptContext
 from pydantic import BaseModel, Field
-from pymongo import MongoClient
 
+from backend.models import MemoryEntry, TranslationUnit
 from backend.utils import get_datetime_formatted
 
+# pymongo y passlib/bcrypt se importan al usarlos: la conexión y el esquema de hash
+# no se crean al importar el módulo
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+    from pymongo import MongoClient
+
 DEFAULT_DB = 'TrueFormTranslator'
-HASH_SCHEMA = CryptContext(schemes=["bcrypt"], deprecated= "auto")
+# Documentos por operación en las escrituras y lecturas en bloque de la memoria de traducción
+BATCH_SIZE = 1_000
+
+@cache
+def get_hash_schema() -> CryptContext:
+    """Devuelve el contexto de hash de las claves, creado en el primer uso"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated= "auto")
 
 def hash_apikey(key:str) -> str:
     """Devuelve una key hasheada
@@ -37,7 +52,7 @@ def hash_apikey(key:str) -> str:
     _type_
         _description_
     """
-    return HASH_SCHEMA.hash(key)
+    return get_hash_schema().hash(key)
 
 def verify_apikey(key:str, key_hash:str) -> bool:
     """Comprueba si la key y la hash key coinciden
@@ -54,7 +69,7 @@ def verify_apikey(key:str, key_hash:str) -> bool:
     bool
         _description_
     """
-    return HASH_SCHEMA.verify(key, key_hash)
+    return get_hash_schema().verify(key, key_hash)
 
 class UsuarioDB(BaseModel):
     nombre:str
@@ -74,10 +89,23 @@ class UsuarioDB(BaseModel):
     facturado_accumulado:float # importe facturado hasta la fecha a este usuario
     coste_acumulado:float = 0 # coste acumulado hasta la fecha por este usuario
     ultimo_text_traducido:str = '' # checkpoint que se van guardando del texto traducido por seguridad
+    routing:dict = {} # política de enrutado entre modelos (ver backend.routing.RoutingPolicy)
+    glosario:dict[str, dict[str, str]] = {} # por idioma destino: término -> traducción obligatoria
+
+class RevisionDB(BaseModel):
+    clave:str
+    documento:str # nombre del documento sin extensión
+    idioma:str # idioma destino
+    fecha:str = Field(default_factory=get_datetime_formatted)
+    partes:list[dict] # huella y traducciones de cada párrafo (ver backend.revisions)
 
 class DBHandler(Sequence):
-    def __init__(self, collection:str, database:str=DEFAULT_DB) -> None:
-        self.client = MongoClient(os.environ["DB_MONGO"])
+    def __init__(self, collection:str, database:str=DEFAULT_DB, client:MongoClient|None=None) -> None:
+        # Se puede inyectar un cliente ya creado (p.ej. un sustituto en memoria para pruebas de carga)
+        if client is None:
+            from pymongo import MongoClient
+            client = MongoClient(os.environ["DB_MONGO"])
+        self.client = client
         self.db = self.client[database]
         self.collection = collection
     
@@ -170,8 +198,8 @@ class DBHandler(Sequence):
         )
 
 class UserDBHandler(DBHandler):
-    def __init__(self, collection:str, database:str=DEFAULT_DB) -> None:
-        super().__init__(collection, database)
+    def __init__(self, collection:str, database:str=DEFAULT_DB, client:MongoClient|None=None) -> None:
+        super().__init__(collection, database, client)
         self.conn = self.db[self.collection]
 
 
@@ -221,6 +249,111 @@ class UserDBHandler(DBHandler):
         user_dict:dict = self.conn.find_one({"clave": clave})
         return user_dict.get("model")
 
+    def get_routing(self, clave:str) -> dict:
+        user_dict:dict = self.conn.find_one({"clave": clave})
+        return user_dict.get("routing", {}) if user_dict is not None else {}
+
+    def get_glosario(self, clave:str) -> dict[str, dict[str, str]]:
+        user_dict:dict = self.conn.find_one({"clave": clave})
+        return user_dict.get("glosario", {}) if user_dict is not None else {}
+
+class RevisionDBHandler(DBHandler):
+    """Última traducción de cada documento por usuario e idioma, para retraducir solo lo que cambia"""
+    def __init__(self, collection:str='revisiones', database:str=DEFAULT_DB, client:MongoClient|None=None) -> None:
+        super().__init__(collection, database, client)
+        self.conn = self.db[self.collection]
+
+    def get_revision(self, clave:str, documento:str, idioma:str) -> list[dict] | None:
+        revision:dict = self.conn.find_one({"clave": clave, "documento": documento, "idioma": idioma})
+        return revision.get("partes") if revision is not None else None
+
+    def save_revision(self, revision:RevisionDB) -> None:
+        """Guarda la revisión sustituyendo la anterior del mismo documento e idioma"""
+        self.conn.delete_one({"clave": revision.clave, "documento": revision.documento, "idioma": revision.idioma})
+        self.insert(revision)
+
+    def get_documents(self, clave:str) -> list[str]:
+        """Documentos con alguna revisión guardada del usuario"""
+        return sorted({revision["documento"] for revision in self.conn.find({"clave": clave})})
+
+class TranslationMemoryDBHandler(DBHandler):
+    """Memoria de traducción de cada usuario: un documento por unidad con la misma clave
+    que la memoria del pipeline y, si se conoce, el par sin enmascarar para exportarlo.
+    Las escrituras (upserts) y las búsquedas se hacen por lotes.
+    """
+    KEY_FIELDS = ("clave", "idioma_origen", "idioma_destino", "origen")
+
+    def __init__(self, collection:str='memoria', database:str=DEFAULT_DB, client:MongoClient|None=None) -> None:
+        super().__init__(collection, database, client)
+        self.conn = self.db[self.collection]
+        self.conn.create_index([(campo, 1) for campo in self.KEY_FIELDS])
+
+    def _upsert(self, documentos:dict[tuple, dict]) -> None:
+        from pymongo import UpdateOne
+        self.conn.bulk_write([UpdateOne({campo: documento[campo] for campo in self.KEY_FIELDS}, {"$set": documento},
+                                        upsert=True) for documento in documentos.values()], ordered=False)
+
+    def insert_units(self, clave:str, unidades:Iterable[MemoryEntry], lote:int=BATCH_SIZE) -> int:
+        """Guarda las entradas en lotes de `lote` documentos con upserts sobre
+        (clave, idioma_origen, idioma_destino, origen): reimportar un archivo o guardar las
+        entradas de otro trabajo sustituye las unidades en vez de duplicarlas. Dentro del
+        mismo lote gana la última entrada. Consume las entradas en streaming.
+
+        Parameters
+        ----------
+        clave : str
+            _description_
+        unidades : Iterable[MemoryEntry]
+            _description_
+        lote : int, optional
+            documentos por bulk_write, by default BATCH_SIZE
+
+        Returns
+        -------
+        int
+            entradas guardadas
+        """
+        n, documentos = 0, {}
+        for unidad in unidades:
+            documento = {"clave": clave, **unidad._asdict()}
+            documentos[tuple(documento[campo] for campo in self.KEY_FIELDS)] = documento
+            if len(documentos) == lote:
+                self._upsert(documentos)
+                n += len(documentos)
+                documentos = {}
+        if documentos:
+            self._upsert(documentos)
+            n += len(documentos)
+        return n
+
+    def get_translations(self, clave:str, idioma_origen:str, idioma_destino:str, origenes:Iterable[str],
+                            lote:int=BATCH_SIZE) -> dict[str, str]:
+        """Traducciones de la memoria para los textos de origen, buscadas en lotes.
+        Si un origen está repetido gana la última unidad insertada.
+        """
+        traducciones, origenes = {}, list(origenes)
+        for inicio in range(0, len(origenes), lote):
+            for unidad in self.conn.find({"clave": clave, "idioma_origen": idioma_origen, "idioma_destino": idioma_destino,
+                                            "origen": {"$in": origenes[inicio:inicio + lote]}}):
+                traducciones[unidad["origen"]] = unidad["traduccion"]
+        return traducciones
+
+    def iter_units(self, clave:str, idioma_origen:str|None=None, idioma_destino:str|None=None) -> Iterator[TranslationUnit]:
+        """Recorre las unidades del usuario, opcionalmente de un par de idiomas, agrupadas por par.
+        Devuelve el par sin enmascarar si se guardó y si no la clave y la plantilla con sus marcadores.
+        """
+        filtro = {"clave": clave}
+        if idioma_origen is not None:
+            filtro["idioma_origen"] = idioma_origen
+        if idioma_destino is not None:
+            filtro["idioma_destino"] = idioma_destino
+        for unidad in self.conn.find(filtro).sort([("idioma_origen", 1), ("idioma_destino", 1)]):
+            if unidad.get("texto_origen") and unidad.get("texto_traduccion"):
+                origen, traduccion = unidad["texto_origen"], unidad["texto_traduccion"]
+            else:
+                origen, traduccion = unidad["origen"], unidad["traduccion"]
+            yield TranslationUnit(origen, traduccion, unidad["idioma_origen"], unidad["idioma_destino"])
+
 if __name__ == '__main__':
     pass
 
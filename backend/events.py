@@ -0,0 +1,113 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el bus de eventos interno por el que el pipeline de traducción
+# publica su avance. La interfaz, el logging y las métricas se suscriben a él.
+
+from collections.abc import Callable, Iterable
+import logging
+import reprlib
+import threading
+import time
+
+from .models import Evento
+
+# Tipos de evento
+TRABAJO_INICIADO = 'trabajo_iniciado'
+DOCUMENTO_INICIADO = 'documento_iniciado'
+SEGMENTO_INICIADO = 'segmento_iniciado'
+SEGMENTO_FINALIZADO = 'segmento_finalizado'
+DOCUMENTO_FINALIZADO = 'documento_finalizado'
+CHECKPOINT = 'checkpoint'
+TRABAJO_FINALIZADO = 'trabajo_finalizado'
+# Llamada al LLM duplicada por hedging que ha perdido: no se usa pero se paga
+LLAMADA_DESCARTADA = 'llamada_descartada'
+
+# Eventos que un suscriptor limitado nunca debe perderse
+EVENTOS_CLAVE = frozenset({TRABAJO_INICIADO, DOCUMENTO_INICIADO, DOCUMENTO_FINALIZADO, TRABAJO_FINALIZADO})
+
+logger = logging.getLogger(__name__)
+
+Suscriptor = Callable[[Evento], None]
+
+class EventBus:
+    """Bus de eventos síncrono y thread-safe. Cada suscriptor
+    puede filtrar por tipos de evento.
+    """
+    def __init__(self) -> None:
+        self._suscriptores:list[tuple[Suscriptor, frozenset[str] | None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback:Suscriptor, tipos:Iterable[str] | None=None) -> None:
+        """Suscribe callback a los tipos de evento pasados o a todos si tipos es None
+
+        Parameters
+        ----------
+        callback : Suscriptor
+            función que recibe el Evento
+        tipos : Iterable[str] | None, optional
+            tipos de evento a recibir, by default None
+        """
+        with self._lock:
+            self._suscriptores.append((callback, frozenset(tipos) if tipos is not None else None))
+
+    def unsubscribe(self, callback:Suscriptor) -> None:
+        with self._lock:
+            self._suscriptores = [(cb, tipos) for cb, tipos in self._suscriptores if cb is not callback]
+
+    def publish(self, tipo:str, **datos) -> None:
+        """Publica un evento del tipo pasado con los datos como kwargs.
+        Un suscriptor que falla no interrumpe el pipeline.
+
+        Parameters
+        ----------
+        tipo : str
+            tipo de evento
+        """
+        evento = Evento(tipo, datos, time.time())
+        with self._lock:
+            suscriptores = list(self._suscriptores)
+        for callback, tipos in suscriptores:
+            if tipos is not None and tipo not in tipos:
+                continue
+            try:
+                callback(evento)
+            except Exception:
+                logger.exception(f"Error en el suscriptor {callback!r} con el evento {tipo}")
+
+class Throttle:
+    """Envuelve un suscriptor para que reciba como máximo max_por_segundo eventos.
+    Los eventos en `siempre` se entregan siempre. Pensado para la interfaz,
+    donde cada actualización es un mensaje por el websocket.
+    """
+    def __init__(self, callback:Suscriptor, max_por_segundo:float=4, siempre:frozenset[str]=EVENTOS_CLAVE) -> None:
+        self.callback = callback
+        self.intervalo = 1 / max_por_segundo
+        self.siempre = siempre
+        self._ultimo = float('-inf')
+        self._lock = threading.Lock()
+
+    def __call__(self, evento:Evento) -> None:
+        with self._lock:
+            ahora = time.monotonic()
+            if evento.tipo not in self.siempre and ahora - self._ultimo < self.intervalo:
+                return
+            self._ultimo = ahora
+        self.callback(evento)
+
+def log_event(evento:Evento) -> None:
+    """Suscriptor que vuelca los eventos al logging. Los segmentos van a nivel DEBUG.
+    """
+    nivel = logging.DEBUG if evento.tipo in (SEGMENTO_INICIADO, SEGMENTO_FINALIZADO) else logging.INFO
+    logger.log(nivel, f"{evento.tipo}: {reprlib.repr(evento.datos)}")
@@ -16,22 +16,64 @@
 # y/o propiedades del documento Word
 
 
+# python-docx, langdetect, pycountry, textblob, langchain y las chains se importan
+# dentro de las funciones que los usan para que importar el módulo sea rápido
+
+from collections.abc import Iterable, Iterator
+from io import BytesIO
 import shutil
 import zipfile
 
-from docx import Document
-from langchain_community.callbacks import get_openai_callback
-from langdetect import detect, DetectorFactory
-from pathlib import Path
-import pycountry
-from textblob import TextBlob
-import xml.etree.ElementTree as ET
+from lxml import etree
+from pathlib import Path, PurePosixPath
 
-from .chains import get_topic_chain
 from .models import OpenAIResponse
 from .paths import XML_FOLDER
 from .utils import get_chunk, clean_word
 
+# Espacio de nombres utilizado en el documento Word XML
+NAMESPACES = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'wpc': "http://schemas.microsoft.com/office/word/2010/wordprocessingCanvas",
+    'wpi': "http://schemas.microsoft.com/office/word/2010/wordprocessingInk",
+    'wps': "http://schemas.microsoft.com/office/word/2010/wordprocessingShape",
+    'wp': "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
+}
+PARAGRAPH_TAG = f"{{{NAMESPACES['w']}}}p"
+TEXT_TAG = f"{{{NAMESPACES['w']}}}t"
+XML_PARSER = etree.XMLParser(resolve_entities=False, huge_tree=True)
+# Idioma por defecto declarado en los estilos del documento
+DEFAULT_LANGUAGE_XPATH = etree.XPath('w:docDefaults/w:rPrDefault/w:rPr/w:lang/@w:val', namespaces=NAMESPACES)
+# Nombre en español de los códigos ISO 639 que devuelve langdetect.
+# Evita la llamada de red de TextBlob para los idiomas habituales
+LANGUAGE_NAMES_ES = {
+    'ar': 'Árabe',
+    'ca': 'Catalán',
+    'cs': 'Checo',
+    'da': 'Danés',
+    'de': 'Alemán',
+    'el': 'Griego',
+    'en': 'Inglés',
+    'es': 'Español',
+    'fi': 'Finés',
+    'fr': 'Francés',
+    'hu': 'Húngaro',
+    'it': 'Italiano',
+    'ja': 'Japonés',
+    'ko': 'Coreano',
+    'nl': 'Neerlandés',
+    'no': 'Noruego',
+    'pl': 'Polaco',
+    'pt': 'Portugués',
+    'ro': 'Rumano',
+    'ru': 'Ruso',
+    'sv': 'Sueco',
+    'tr': 'Turco',
+    'uk': 'Ucraniano',
+    'zh-cn': 'Chino',
+    'zh-tw': 'Chino',
+}
+
 def get_text_from_docx(document:bytes) -> str:
     """Devuelve el texto extraido de un documento docx
 
@@ -45,6 +87,7 @@ def get_text_from_docx(document:bytes) -> str:
     str
         _description_
     """
+    from docx import Document
     doc:Document = Document(document)
     return " ".join(para.text for para in doc.paragraphs)
 
@@ -60,6 +103,28 @@ def extract_word_to_xml(document:bytes) -> None:
     with zipfile.ZipFile(document, 'r') as zip_ref:
         zip_ref.extractall(XML_FOLDER)
 
+def read_parts_from_docx(document:bytes) -> dict[str, bytes]:
+    """Lee del docx en memoria las partes xml a traducir sin descomprimirlo a disco:
+    el document.xml seguido de los headers y los footers, como get_to_extract_list.
+
+    Parameters
+    ----------
+    document : bytes
+        el docx en bytes
+
+    Returns
+    -------
+    dict[str, bytes]
+        nombre de la parte dentro del docx y su contenido
+    """
+    with zipfile.ZipFile(BytesIO(document), 'r') as zip_ref:
+        partes_word = [PurePosixPath(nombre) for nombre in zip_ref.namelist()
+                        if PurePosixPath(nombre).parent == PurePosixPath('word')]
+        nombres = ['word/document.xml']
+        for prefijo in ('header', 'footer'):
+            nombres.extend(parte.as_posix() for parte in partes_word if parte.name.startswith(prefijo))
+        return {nombre: zip_ref.read(nombre) for nombre in nombres}
+
 def delete_xml_path() -> None:
     """Elimina todo el directorio donde están almacenados los archivos xml.
     Elimina todo el arbol
@@ -67,36 +132,104 @@ def delete_xml_path() -> None:
     if XML_FOLDER.exists():
         shutil.rmtree(XML_FOLDER)
 
-def get_text_elements_and_tree(file_xml_path:Path) -> tuple[list[tuple[ET.Element, str]], ET.ElementTree]:
-    """Dado un archivo xml extrae cada elemento de texto y devuelve una lista de tuplas 
+def parse_xml(file_xml:Path|bytes) -> etree._ElementTree:
+    """Parsea un archivo xml (ruta o bytes) con XML_PARSER"""
+    if isinstance(file_xml, bytes):
+        return etree.ElementTree(etree.fromstring(file_xml, XML_PARSER))
+    return etree.parse(str(file_xml), XML_PARSER)
+
+def get_paragraph_ids(elementos:list[etree._Element]) -> list[int]:
+    """Devuelve el índice del párrafo (w:p más cercano) de cada elemento de texto.
+    Los elementos van en orden de documento: cada cambio de w:p es un párrafo nuevo.
+    """
+    ids, parrafo, ultimo = [], -1, None
+    for elemento in elementos:
+        actual = next(elemento.iterancestors(PARAGRAPH_TAG), None)
+        if actual is not ultimo:
+            parrafo, ultimo = parrafo + 1, actual
+        ids.append(parrafo)
+    return ids
+
+def iter_text_elements(tree:etree._ElementTree | etree._Element) -> Iterator[tuple[int, etree._Element]]:
+    """Devuelve los w:t que están dentro de un w:p, en orden de documento, con su posición
+    entre todos los w:t de la parte. Recorre el árbol una sola vez: la XPath equivalente
+    './/w:p//w:t' anida dos búsquedas de descendientes y en lxml su coste crece de forma
+    cuadrática con el tamaño de la parte.
+    """
+    for posicion, elemento in enumerate(tree.iter(TEXT_TAG)):
+        if next(elemento.iterancestors(PARAGRAPH_TAG), None) is not None:
+            yield posicion, elemento
+
+def get_text_elements(tree:etree._ElementTree | etree._Element) -> list[etree._Element]:
+    """Devuelve todos los w:t que están dentro de un w:p, en orden de documento"""
+    return [elemento for _, elemento in iter_text_elements(tree)]
+
+def get_text_elements_at(tree:etree._ElementTree | etree._Element, posiciones:Iterable[int]) -> list[etree._Element]:
+    """Recupera los w:t por su posición de iter_text_elements en una sola pasada por el árbol,
+    sin volver a comprobar sus ancestros. Sirve para las copias del tree de una parte ya segmentada.
+    """
+    elementos = list(tree.iter(TEXT_TAG))
+    return [elementos[posicion] for posicion in posiciones]
+
+def get_text_elements_and_tree(file_xml:Path|bytes) -> tuple[list[tuple[etree._Element, str]], etree._ElementTree]:
+    """Dado un archivo xml (ruta o bytes) extrae cada elemento de texto y devuelve una lista de tuplas 
     con los elementos y sus textos y el tree del documento
 
     Returns
     -------
-    list[tuple[ET.Element, str]]
+    list[tuple[etree._Element, str]]
         tupla con:
         - lista de tuplas con (Elemento, texto del elemento)
         - El tree del documento
     """
-    # Cargamos archivo document.xml donde está el texto
-    tree = ET.parse(file_xml_path)
-    root = tree.getroot()
-    # Espacio de nombres utilizado en el documento Word XML
-    namespaces = {
-        'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-        'wpc': "http://schemas.microsoft.com/office/word/2010/wordprocessingCanvas",
-        'wpi': "http://schemas.microsoft.com/office/word/2010/wordprocessingInk",
-        'wps': "http://schemas.microsoft.com/office/word/2010/wordprocessingShape",
-        'wp': "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
-    }
+    # Cargamos el xml donde está el texto
+    tree = parse_xml(file_xml)
     # Encontrar todos los elementos de texto y extraer el texto
-    text_elements = []
-    for paragraph in root.iterfind('.//w:p', namespaces):
-        for text_elem in paragraph.iterfind('.//w:t', namespaces):
-            text_elements.append((text_elem, text_elem.text))
+    text_elements = [(text_elem, text_elem.text) for text_elem in get_text_elements(tree)]
     # Devolvemos la lista y el tree
     return text_elements, tree
 
+def serialize_tree(tree:etree._ElementTree) -> bytes:
+    """Serializa el tree a bytes conservando los prefijos de los espacios de nombres
+    y la declaración xml original (encoding y standalone).
+
+    Parameters
+    ----------
+    tree : etree._ElementTree
+        _description_
+
+    Returns
+    -------
+    bytes
+        el xml serializado
+    """
+    return etree.tostring(tree,
+                            xml_declaration=True,
+                            encoding=tree.docinfo.encoding or 'UTF-8',
+                            standalone=tree.docinfo.standalone)
+
+def get_language_hint(document:bytes) -> str | None:
+    """Devuelve el código ISO 639 del idioma por defecto declarado en styles.xml
+    (w:docDefaults) o None si no lo declara. Es solo una pista: el texto puede estar
+    escrito en otro idioma.
+
+    Parameters
+    ----------
+    document : bytes
+        el docx en bytes
+
+    Returns
+    -------
+    str | None
+        p.ej. 'es' para 'es-ES'
+    """
+    with zipfile.ZipFile(BytesIO(document), 'r') as zip_ref:
+        if 'word/styles.xml' not in zip_ref.namelist():
+            return None
+        root = etree.fromstring(zip_ref.read('word/styles.xml'), XML_PARSER)
+    idiomas = DEFAULT_LANGUAGE_XPATH(root)
+    return idiomas[0].split('-')[0].lower() if idiomas else None
+
 def get_language(corpus:str) -> tuple[str]:
     """Dado un texto en str, devuelve el idioma del texto en
     español y en inglés
@@ -112,14 +245,18 @@ def get_language(corpus:str) -> tuple[str]:
         Tupla con el nombre del idioma en español y en inglés:
         idioma_es, idioma_en
     """
+    from langdetect import detect, DetectorFactory
+    import pycountry
     # Para que sea determinista
     DetectorFactory.seed = 0
     # Escribimos el texto a traducir
     # Sacamos el idioma en formato ISO 639 y en lenguaje natural
     idioma_iso = detect(corpus)
-    idioma_en = pycountry.languages.get(alpha_2=idioma_iso).name
-    # Como lo saca en inglés, pasamos por textblob para tenerlo en español
-    idioma_es = TextBlob(idioma_en).translate(from_lang='en', to='es').string
+    idioma_en = pycountry.languages.get(alpha_2=idioma_iso.split('-')[0]).name
+    # Como lo saca en inglés, pasamos por textblob para tenerlo en español si no está en el mapa
+    if (idioma_es := LANGUAGE_NAMES_ES.get(idioma_iso)) is None:
+        from textblob import TextBlob
+        idioma_es = TextBlob(idioma_en).translate(from_lang='en', to='es').string
     return idioma_es, idioma_en
 
 def get_num_words(corpus:str) -> int:
@@ -177,6 +314,8 @@ def get_topic(corpus:str, language:str, doc_name:str) -> OpenAIResponse:
     #? No sería mejor sacar 3 chunks uno del principio otro del medio y otro del final de documento ?
     chunk_1 = get_chunk(dataset)
     chunk_2 = get_chunk(dataset)
+    from langchain_community.callbacks import get_openai_callback
+    from .chains import get_topic_chain
     # Instanciamos la chain
     chain = get_topic_chain()
     # Envolvemos en callback para sacar el coste
@@ -0,0 +1,171 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el glosario del cliente (nombres de producto, términos legales...).
+# Los términos se compilan en un autómata de Aho-Corasick que encuentra en tiempo lineal
+# qué términos aparecen en cada segmento, de modo que solo esas entradas van al prompt.
+
+from collections import deque
+from collections.abc import Iterable
+
+class TermIndex:
+    """Autómata de Aho-Corasick sobre los términos pasados. La búsqueda no distingue
+    mayúsculas (casefold) y solo devuelve coincidencias de palabras completas.
+    """
+    def __init__(self, terminos:Iterable[str]) -> None:
+        self.terminos:list[str] = []
+        self._goto:list[dict[str, int]] = [{}]
+        self._fail:list[int] = [0]
+        # Índices de los términos que terminan en cada estado (incluidos los de sus sufijos)
+        self._salida:list[list[int]] = [[]]
+        # Longitud de cada término plegado con casefold, la que recorre el autómata
+        self._longitudes:list[int] = []
+        for termino in terminos:
+            self._add(termino)
+        self._build_failure_links()
+
+    def _add(self, termino:str) -> None:
+        termino = termino.strip()
+        if not termino:
+            return
+        estado = 0
+        for caracter in termino.casefold():
+            if (siguiente := self._goto[estado].get(caracter)) is None:
+                siguiente = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._salida.append([])
+                self._goto[estado][caracter] = siguiente
+            estado = siguiente
+        self._salida[estado].append(len(self.terminos))
+        self.terminos.append(termino)
+        self._longitudes.append(len(termino.casefold()))
+
+    def _build_failure_links(self) -> None:
+        cola = deque(self._goto[0].values())
+        while cola:
+            estado = cola.popleft()
+            for caracter, siguiente in self._goto[estado].items():
+                cola.append(siguiente)
+                fallo = self._fail[estado]
+                while fallo and caracter not in self._goto[fallo]:
+                    fallo = self._fail[fallo]
+                destino = self._goto[fallo].get(caracter, 0)
+                self._fail[siguiente] = destino if destino != siguiente else 0
+                self._salida[siguiente] = self._salida[siguiente] + self._salida[self._fail[siguiente]]
+
+    def __len__(self) -> int:
+        return len(self.terminos)
+
+    def find(self, texto:str) -> list[tuple[int, int, str]]:
+        """Devuelve las coincidencias (inicio, fin, término) en el texto, con fin exclusivo.
+        Un término solo coincide si no está pegado a otra letra o número.
+        El autómata recorre el texto con casefold carácter a carácter, que puede cambiar
+        la longitud (p.ej. 'İ' o 'ß'), y las posiciones se traducen de vuelta al texto original.
+
+        Parameters
+        ----------
+        texto : str
+            _description_
+
+        Returns
+        -------
+        list[tuple[int, int, str]]
+            _description_
+        """
+        coincidencias = []
+        estado = 0
+        # Posición en el texto original de cada carácter plegado que empieza un carácter original
+        inicios:list[int] = []
+        for posicion, original in enumerate(texto):
+            plegado = original.casefold()
+            for desplazamiento, caracter in enumerate(plegado):
+                inicios.append(posicion if desplazamiento == 0 else -1)
+                while estado and caracter not in self._goto[estado]:
+                    estado = self._fail[estado]
+                estado = self._goto[estado].get(caracter, 0)
+                # Una coincidencia tiene que acabar al final del plegado de un carácter original
+                if desplazamiento != len(plegado) - 1:
+                    continue
+                for indice in self._salida[estado]:
+                    inicio = inicios[len(inicios) - self._longitudes[indice]]
+                    if inicio >= 0 and _is_word_boundary(texto, inicio - 1) and _is_word_boundary(texto, posicion + 1):
+                        coincidencias.append((inicio, posicion + 1, self.terminos[indice]))
+        return coincidencias
+
+def _is_word_boundary(texto:str, posicion:int) -> bool:
+    return posicion < 0 or posicion >= len(texto) or not texto[posicion].isalnum()
+
+class Glossary:
+    """Glosario de un idioma destino: término original -> traducción obligatoria"""
+    def __init__(self, entradas:dict[str, str]) -> None:
+        self.entradas = {termino.strip().lower(): traduccion for termino, traduccion in entradas.items()
+                            if termino.strip()}
+        self.index = TermIndex(termino.strip() for termino in entradas)
+
+    def __len__(self) -> int:
+        return len(self.entradas)
+
+    def match(self, texto:str) -> dict[str, str]:
+        """Devuelve las entradas del glosario cuyos términos aparecen en el texto
+
+        Parameters
+        ----------
+        texto : str
+            _description_
+
+        Returns
+        -------
+        dict[str, str]
+            término tal y como aparece en el texto -> traducción
+        """
+        # Nos quedamos con las coincidencias más largas que no se solapan:
+        # 'contrato marco' gana a 'marco' dentro de la misma expresión
+        entradas, vistos, ultimo_fin = {}, set(), 0
+        for inicio, fin, termino in sorted(self.index.find(texto), key=lambda c: (c[0], -c[1])):
+            if inicio < ultimo_fin:
+                continue
+            ultimo_fin = fin
+            if (clave := termino.lower()) not in vistos:
+                vistos.add(clave)
+                entradas[texto[inicio:fin]] = self.entradas[clave]
+        return entradas
+
+    def check(self, entradas:dict[str, str], traduccion:str) -> list[str]:
+        """Comprueba que la traducción usa la traducción de cada entrada
+
+        Parameters
+        ----------
+        entradas : dict[str, str]
+            entradas devueltas por match para el texto original
+        traduccion : str
+            _description_
+
+        Returns
+        -------
+        list[str]
+            términos originales cuya traducción no aparece
+        """
+        if not entradas:
+            return []
+        encontrados = {termino.lower() for _, _, termino in TermIndex(entradas.values()).find(traduccion)}
+        return [termino for termino, traducido in entradas.items()
+                if traducido.strip().lower() not in encontrados]
+
+def format_glossary_entries(entradas:dict[str, str]) -> str:
+    """Formatea las entradas para el prompt de traducción. Vacío si no hay entradas"""
+    if not entradas:
+        return ''
+    lineas = "\n".join(f"- {termino} -> {traduccion}" for termino, traduccion in entradas.items())
+    return f"Usa obligatoriamente estas traducciones del glosario:\n{lineas}"
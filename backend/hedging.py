@@ -0,0 +1,185 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con los plazos por llamada y el hedging de las llamadas al LLM.
+# Una respuesta lenta de OpenAI (a veces más de 60 s) bloquea el bucle serie del pipeline:
+# cada llamada tiene un plazo máximo y, si tarda más que un percentil adaptativo de las
+# latencias recientes de su modelo, se lanza una llamada duplicada y gana la primera que
+# responde. La perdedora no se puede interrumpir a mitad de la petición HTTP: se cancela
+# si aún no ha empezado y, si no, se devuelve para que su coste se contabilice al terminar.
+# Igual con las que siguen en curso al vencer el plazo: viajan en DeadlineExceeded.pendientes.
+# La duplicada ocupa su propio hueco del planificador o del limitador: si no lo hay en ese
+# momento no se duplica, para no saltarse la concurrencia ni el reparto entre tenants.
+# Se configura con las variables de entorno TRUEFORM_LLM_DEADLINE y TRUEFORM_HEDGING.
+
+from collections import defaultdict, deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import os
+import threading
+import time
+
+from .models import OpenAIResponse
+from .profiling import profiled
+
+# Segundos máximos de espera por llamada al LLM, duplicada incluida
+DEFAULT_DEADLINE = 120
+# Percentil de la latencia reciente a partir del cual se duplica la llamada
+HEDGE_PERCENTILE = 95
+# Latencias recientes que se guardan por modelo y mínimo para estimar el percentil
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Proporción máxima de llamadas duplicadas: acota el coste extra si el LLM va lento en general
+MAX_HEDGE_RATIO = 0.1
+HEDGE_WORKERS = 32
+
+class DeadlineExceeded(TimeoutError):
+    """El LLM no ha respondido dentro del plazo. pendientes son las llamadas que siguen en
+    curso al vencer el plazo: su resultado tiene el coste real y hay que contabilizarlo
+    """
+    def __init__(self, mensaje:str, pendientes:list[Future] | None=None) -> None:
+        super().__init__(mensaje)
+        self.pendientes = pendientes or []
+
+class LatencyTracker:
+    """Latencias recientes de las llamadas por modelo. Thread-safe"""
+    def __init__(self, percentil:float=HEDGE_PERCENTILE, ventana:int=LATENCY_WINDOW,
+                    min_muestras:int=MIN_SAMPLES) -> None:
+        self.percentil = percentil
+        self.min_muestras = min_muestras
+        self._latencias:dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=ventana))
+        self._lock = threading.Lock()
+
+    def record(self, modelo:str, latencia:float) -> None:
+        with self._lock:
+            self._latencias[modelo].append(latencia)
+
+    def threshold(self, modelo:str) -> float | None:
+        """Devuelve el percentil de la latencia reciente del modelo o None si aún no hay muestras suficientes"""
+        with self._lock:
+            latencias = sorted(self._latencias.get(modelo, ()))
+        if len(latencias) < self.min_muestras:
+            return None
+        return latencias[min(len(latencias) - 1, round(self.percentil / 100 * (len(latencias) - 1)))]
+
+class Hedger:
+    """Ejecuta las llamadas al LLM con plazo y, opcionalmente, hedging.
+    Está pensado para compartirse entre trabajos: las latencias y el presupuesto
+    de duplicadas son globales.
+    """
+    def __init__(self, plazo:float | None=DEFAULT_DEADLINE, hedging:bool=True,
+                    latencias:LatencyTracker | None=None, max_ratio:float=MAX_HEDGE_RATIO) -> None:
+        self.plazo = plazo
+        self.hedging = hedging
+        self.latencias = latencias or LatencyTracker()
+        self.max_ratio = max_ratio
+        self.llamadas = 0
+        self.duplicadas = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='trueform-hedge')
+
+    @classmethod
+    def from_env(cls) -> 'Hedger':
+        """Crea el Hedger con el plazo de TRUEFORM_LLM_DEADLINE (0 sin plazo)
+        y el hedging activado si TRUEFORM_HEDGING es 1
+        """
+        plazo = float(os.environ.get('TRUEFORM_LLM_DEADLINE', DEFAULT_DEADLINE))
+        return cls(plazo or None, os.environ.get('TRUEFORM_HEDGING', '0') == '1')
+
+    def _timed(self, funcion:Callable[..., OpenAIResponse], kwargs:dict) -> OpenAIResponse:
+        start = time.perf_counter()
+        response = funcion(**kwargs)
+        # Se registran también las perdedoras: es la distribución real de latencias del modelo
+        self.latencias.record(kwargs.get('model', ''), time.perf_counter() - start)
+        return response
+
+    def _hedge_threshold(self, modelo:str) -> float | None:
+        if not self.hedging:
+            return None
+        with self._lock:
+            if self.duplicadas >= self.max_ratio * self.llamadas:
+                return None
+        umbral = self.latencias.threshold(modelo)
+        if umbral is None or (self.plazo is not None and umbral >= self.plazo):
+            return None
+        return umbral
+
+    def call(
+            self,
+            funcion:Callable[..., OpenAIResponse],
+            reservar_duplicada:Callable[[], Callable[[], None] | None] | None=None,
+            **kwargs,
+            ) -> tuple[OpenAIResponse, bool, list[Future]]:
+        """Llama a funcion(**kwargs) con plazo. Si el hedging está activo y la llamada supera
+        el percentil de latencia de su modelo, lanza una duplicada y devuelve la primera respuesta.
+
+        Parameters
+        ----------
+        funcion : Callable[..., OpenAIResponse]
+            función de traducción con la firma de translator.translate
+        reservar_duplicada : Callable[[], Callable[[], None] | None] | None, optional
+            toma sin esperar un hueco para la duplicada y devuelve la función que lo libera,
+            o None si no hay hueco y no se duplica. Por defecto siempre hay hueco
+        **kwargs
+            argumentos de funcion
+
+        Returns
+        -------
+        tuple[OpenAIResponse, bool, list[Future]]
+            respuesta, si se ha duplicado la llamada y llamadas descartadas que siguen en curso.
+            Su resultado tiene el coste real de la llamada y hay que contabilizarlo
+
+        Raises
+        ------
+        DeadlineExceeded
+            ninguna llamada ha respondido dentro del plazo. Lleva en pendientes las que siguen en curso
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.llamadas += 1
+        futuros = [self._executor.submit(profiled(self._timed), funcion, kwargs)]
+        duplicada = False
+        if (umbral := self._hedge_threshold(kwargs.get('model', ''))) is not None:
+            hechos, _ = wait(futuros, timeout=umbral)
+            if not hechos and (liberar := reservar_duplicada() if reservar_duplicada else lambda: None) is not None:
+                futuro = self._executor.submit(profiled(self._timed), funcion, kwargs)
+                # El hueco se libera al terminar o al cancelarse la duplicada
+                futuro.add_done_callback(lambda _: liberar())
+                futuros.append(futuro)
+                duplicada = True
+                with self._lock:
+                    self.duplicadas += 1
+        pendientes, error = set(futuros), None
+        while pendientes:
+            restante = None if self.plazo is None else self.plazo - (time.perf_counter() - start)
+            if restante is not None and restante <= 0:
+                break
+            hechos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                if futuro.exception() is None:
+                    return futuro.result(), duplicada, self._discard(pendientes)
+                error = error or futuro.exception()
+        if not pendientes and error is not None:
+            raise error
+        raise DeadlineExceeded(f"El LLM no ha respondido en {self.plazo:g} segundos", self._discard(pendientes))
+
+    @staticmethod
+    def _discard(futuros:set[Future]) -> list[Future]:
+        """Cancela las llamadas que aún no han empezado y devuelve las que siguen en curso"""
+        return [futuro for futuro in futuros if not futuro.cancel()]
+
+    def hedge_ratio(self) -> float:
+        """Proporción de llamadas duplicadas"""
+        with self._lock:
+            return self.duplicadas / self.llamadas if self.llamadas else 0.0
@@ -0,0 +1,256 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con backends de LLM alternativos a ChatOpenAI para pruebas de carga,
+# benchmarks y reproducción de trabajos sin red:
+# - FakeChatModel: LLM local reproducible por semilla con latencia configurable, llamadas
+#   colgadas, inyección de errores y 429
+# - CassetteChatModel: graba las respuestas reales en un cassette jsonl y las reproduce offline
+# Se seleccionan con la variable de entorno TRUEFORM_LLM_BACKEND en chains.get_llm
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import random
+import re
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from .utils import convert_words_to_tokens
+
+LLM_BACKENDS = ('openai', 'fake', 'record', 'replay')
+DEFAULT_CASSETTE = 'cassettes/trueform.jsonl'
+# Texto a traducir dentro de los prompts de chains.py
+SEGMENT_PATTERN = re.compile(r'TEXTO(?: A TRADUCIR)?:\s?(.*?)\n\s*TRADUCCIÓN:', re.DOTALL)
+
+class FakeLLMError(Exception):
+    """Error inyectado por el LLM falso"""
+    status_code = 500
+
+class FakeRateLimitError(FakeLLMError):
+    """429 inyectado por el LLM falso. Igual que openai.RateLimitError expone status_code"""
+    status_code = 429
+
+class CassetteMissError(KeyError):
+    """El prompt no está grabado en el cassette"""
+
+def sample_latency(spec:str, rng:random.Random) -> float:
+    """Devuelve una latencia en segundos según la distribución especificada:
+    - 'fixed:s'
+    - 'uniform:min,max'
+    - 'normal:media,desviacion' (truncada en 0)
+    - 'lognormal:mediana,sigma'
+
+    Parameters
+    ----------
+    spec : str
+        especificación de la distribución
+    rng : random.Random
+        generador aleatorio
+
+    Returns
+    -------
+    float
+        segundos de latencia
+    """
+    distribucion, _, parametros = spec.partition(':')
+    valores = [float(v) for v in parametros.split(',') if v]
+    match distribucion:
+        case 'fixed':
+            return valores[0] if valores else 0.0
+        case 'uniform':
+            return rng.uniform(*valores)
+        case 'normal':
+            return max(0.0, rng.gauss(*valores))
+        case 'lognormal':
+            mediana, sigma = valores
+            return rng.lognormvariate(0, sigma) * mediana
+    raise ValueError(f"Distribución de latencia no válida: {spec!r}")
+
+def count_tokens(texto:str) -> int:
+    """Estimación de tokens a partir de las palabras, la misma que usa la estimación de costes"""
+    return convert_words_to_tokens(len(texto.split()))
+
+def _prompt_text(messages:list[BaseMessage]) -> str:
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+# Mínimo de tokens del prefijo para que OpenAI lo sirva desde su caché de prompts
+PROMPT_CACHE_MIN_TOKENS = 1024
+# Mensajes de sistema ya vistos, para simular la caché de prompts del proveedor
+_system_prompts_vistos:set[str] = set()
+_system_prompts_lock = threading.Lock()
+
+def _cached_prompt_tokens(messages:list[BaseMessage]) -> int:
+    """Simula la caché de prefijos: si el mensaje de sistema ya se ha enviado antes y
+    tiene al menos PROMPT_CACHE_MIN_TOKENS tokens, sus tokens cuentan como cacheados.
+    """
+    if not messages or messages[0].type != 'system':
+        return 0
+    tokens = count_tokens(messages[0].content)
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        return 0
+    with _system_prompts_lock:
+        if messages[0].content in _system_prompts_vistos:
+            return tokens
+        _system_prompts_vistos.add(messages[0].content)
+        return 0
+
+# Generadores aleatorios del LLM falso por semilla, compartidos entre instancias: get_llm
+# crea un modelo por llamada y cada llamada debe hacer su propio sorteo
+_generadores:dict[int, random.Random] = {}
+_generadores_lock = threading.Lock()
+
+def reset_fake_generators() -> None:
+    """Reinicia los generadores del LLM falso para repetir la misma secuencia de sorteos"""
+    with _generadores_lock:
+        _generadores.clear()
+
+class FakeChatModel(BaseChatModel):
+    """LLM local reproducible: latencia, llamadas colgadas y errores salen de un generador
+    por semilla, de modo que una misma secuencia de llamadas da siempre los mismos sorteos
+    pero un reintento o una llamada duplicada sortea de nuevo. La respuesta es el texto a
+    traducir tal cual.
+    Devuelve el uso de tokens en llm_output para que get_openai_callback calcule costes,
+    incluidos los tokens de prompt cacheados como en OpenAI.
+    """
+    model_name:str = 'gpt-3.5-turbo'
+    latencia:str = 'fixed:0'
+    error_rate:float = 0.0
+    rate_limit_rate:float = 0.0
+    stall_rate:float = 0.0
+    stall_seconds:float = 0.0
+    seed:int = 0
+
+    @classmethod
+    def from_env(cls, model:str) -> 'FakeChatModel':
+        """Crea el modelo con la configuración de las variables de entorno TRUEFORM_FAKE_*"""
+        return cls(
+            model_name=model,
+            latencia=os.environ.get('TRUEFORM_FAKE_LATENCY', 'fixed:0'),
+            error_rate=float(os.environ.get('TRUEFORM_FAKE_ERROR_RATE', 0)),
+            rate_limit_rate=float(os.environ.get('TRUEFORM_FAKE_429_RATE', 0)),
+            stall_rate=float(os.environ.get('TRUEFORM_FAKE_STALL_RATE', 0)),
+            stall_seconds=float(os.environ.get('TRUEFORM_FAKE_STALL_SECONDS', 0)),
+            seed=int(os.environ.get('TRUEFORM_FAKE_SEED', 0)),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return 'trueform-fake'
+
+    def _generate(
+            self,
+            messages:list[BaseMessage],
+            stop:Optional[list[str]]=None,
+            run_manager:Optional[CallbackManagerForLLMRun]=None,
+            **kwargs:Any,
+            ) -> ChatResult:
+        prompt = _prompt_text(messages)
+        with _generadores_lock:
+            if (rng := _generadores.get(self.seed)) is None:
+                rng = _generadores[self.seed] = random.Random(self.seed)
+            latencia = sample_latency(self.latencia, rng)
+            if rng.random() < self.stall_rate:
+                latencia += self.stall_seconds
+            sorteo = rng.random()
+        time.sleep(latencia)
+        if sorteo < self.rate_limit_rate:
+            raise FakeRateLimitError("Rate limit reached (fake)")
+        if sorteo < self.rate_limit_rate + self.error_rate:
+            raise FakeLLMError("Internal server error (fake)")
+        segmentos = SEGMENT_PATTERN.findall(messages[-1].content)
+        respuesta = segmentos[-1] if segmentos else messages[-1].content
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(respuesta)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=respuesta))],
+            llm_output={
+                'token_usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                    'prompt_tokens_details': {'cached_tokens': _cached_prompt_tokens(messages)},
+                },
+                'model_name': self.model_name,
+            },
+        )
+
+# Cassettes cargados en memoria por ruta, compartidos entre instancias
+_cassettes:dict[str, dict[str, dict]] = {}
+_cassettes_lock = threading.Lock()
+
+def _load_cassette(ruta:str) -> dict[str, dict]:
+    with _cassettes_lock:
+        if ruta not in _cassettes:
+            entradas = {}
+            if Path(ruta).exists():
+                with open(ruta, encoding='utf-8') as f:
+                    for linea in f:
+                        entrada = json.loads(linea)
+                        entradas[entrada['key']] = entrada
+            _cassettes[ruta] = entradas
+        return _cassettes[ruta]
+
+class CassetteChatModel(BaseChatModel):
+    """Modo 'record': llama al modelo real (inner) y graba la respuesta y el uso de tokens.
+    Modo 'replay': devuelve la respuesta grabada sin red. Si no está, lanza CassetteMissError.
+    La clave es el hash del modelo, la temperatura y los mensajes.
+    """
+    modo:str = 'replay'
+    ruta:str = DEFAULT_CASSETTE
+    model_name:str = 'gpt-3.5-turbo'
+    temperature:float = 0.0
+    inner:Optional[BaseChatModel] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f'trueform-cassette-{self.modo}'
+
+    def _key(self, messages:list[BaseMessage]) -> str:
+        contenido = json.dumps([self.model_name, self.temperature, [(m.type, m.content) for m in messages]],
+                                ensure_ascii=False)
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+    def _generate(
+            self,
+            messages:list[BaseMessage],
+            stop:Optional[list[str]]=None,
+            run_manager:Optional[CallbackManagerForLLMRun]=None,
+            **kwargs:Any,
+            ) -> ChatResult:
+        key = self._key(messages)
+        cassette = _load_cassette(self.ruta)
+        if self.modo == 'replay':
+            if (entrada := cassette.get(key)) is None:
+                raise CassetteMissError(f"Prompt no grabado en {self.ruta}: {key}")
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=entrada['response']))],
+                                llm_output=entrada['llm_output'])
+        resultado = self.inner._generate(messages, stop=stop, **kwargs)
+        entrada = {
+            'key': key,
+            'response': resultado.generations[0].message.content,
+            'llm_output': resultado.llm_output,
+        }
+        with _cassettes_lock:
+            cassette[key] = entrada
+            Path(self.ruta).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.ruta, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        return resultado
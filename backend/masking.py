@@ -0,0 +1,85 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el enmascarado de entidades no lingüísticas (números, fechas, importes,
+# URLs, emails, códigos...) antes de traducir. Cada entidad se sustituye por un marcador
+# numerado ⟦1⟧, ⟦2⟧... de forma que líneas como
+#   'Factura 2024-0173 con vencimiento 15/03/2024' y 'Factura 2024-0174 con vencimiento 16/03/2024'
+# comparten la misma plantilla 'Factura ⟦1⟧ con vencimiento ⟦2⟧' y una sola traducción.
+
+from collections import Counter
+import re
+
+from .classifier import ENTITY_PATTERN
+from .models import MaskedSegment
+
+PLACEHOLDER = '⟦{}⟧'
+PLACEHOLDER_PATTERN = re.compile(r'⟦(\d+)⟧')
+
+class PlaceholderError(ValueError):
+    """La traducción no devuelve exactamente los marcadores de la plantilla"""
+
+def mask_segment(texto:str) -> MaskedSegment:
+    """Sustituye las entidades no lingüísticas del texto por marcadores numerados
+
+    Parameters
+    ----------
+    texto : str
+        _description_
+
+    Returns
+    -------
+    MaskedSegment
+        (plantilla, valores) con los valores originales en el orden de los marcadores
+    """
+    valores = []
+    def sustituir(match:re.Match) -> str:
+        valores.append(match.group())
+        return PLACEHOLDER.format(len(valores))
+    plantilla = ENTITY_PATTERN.sub(sustituir, texto)
+    return MaskedSegment(plantilla, tuple(valores))
+
+def unmask_segment(traduccion:str, valores:tuple[str, ...]) -> str:
+    """Restaura los valores originales en la traducción de la plantilla.
+    Comprueba que cada marcador aparece exactamente una vez.
+
+    Parameters
+    ----------
+    traduccion : str
+        traducción de la plantilla
+    valores : tuple[str, ...]
+        valores originales de mask_segment
+
+    Returns
+    -------
+    str
+        traducción con los valores originales
+
+    Raises
+    ------
+    PlaceholderError
+        si falta, sobra o se repite algún marcador
+    """
+    encontrados = Counter(int(n) for n in PLACEHOLDER_PATTERN.findall(traduccion))
+    esperados = Counter(range(1, len(valores) + 1))
+    if encontrados != esperados:
+        raise PlaceholderError(f"Marcadores esperados {sorted(esperados)}, obtenidos {sorted(encontrados.elements())}")
+    return PLACEHOLDER_PATTERN.sub(lambda match: valores[int(match.group(1)) - 1], traduccion)
+
+def fill_placeholders(texto:str, valores:tuple[str, ...]) -> str:
+    """Sustituye los marcadores que aparezcan en el texto por sus valores sin exigir que
+    estén todos, p.ej. en el contexto del prompt de un trozo de la plantilla
+    """
+    return PLACEHOLDER_PATTERN.sub(lambda match: valores[int(match.group(1)) - 1]
+                                    if int(match.group(1)) <= len(valores) else match.group(), texto)
@@ -0,0 +1,275 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con las métricas por trabajo de traducción: tiempos por etapa,
+# latencia de las llamadas al LLM, tokens, costes y aciertos de caché.
+# Se exportan en un json por trabajo y en formato texto de Prometheus.
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+import json
+import math
+from pathlib import Path
+import threading
+import time
+
+from . import events
+from .classifier import SKIP
+from .models import Evento
+from .paths import METRICS_FOLDER
+
+PREFIX = 'trueform'
+# Buckets en segundos para duraciones
+TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+# Buckets para tokens por llamada
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, math.inf)
+# Buckets para coste por llamada en $
+COST_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, math.inf)
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus"""
+    def __init__(self, buckets:tuple[float, ...]=TIME_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, valor:float) -> None:
+        self.counts[bisect_left(self.buckets, valor)] += 1
+        self.sum += valor
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """Devuelve (límite superior, observaciones <= límite) para cada bucket"""
+        acumulado, salida = 0, []
+        for limite, n in zip(self.buckets, self.counts):
+            acumulado += n
+            salida.append((limite, acumulado))
+        return salida
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'buckets': {('+Inf' if math.isinf(limite) else limite): n for limite, n in self.cumulative()},
+        }
+
+def _labels_key(labels:dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels:tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+class JobMetrics:
+    """Métricas de un trabajo de traducción. Se suscribe al EventBus del pipeline
+    con `on_event` y las etapas se cronometran con el context manager `stage`.
+    """
+    def __init__(self, job_id:str) -> None:
+        self.job_id = job_id
+        self.histograms:dict[tuple[str, tuple], Histogram] = {}
+        self.counters:dict[tuple[str, tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, nombre:str, valor:float, buckets:tuple[float, ...]=TIME_BUCKETS, **labels) -> None:
+        with self._lock:
+            key = (nombre, _labels_key(labels))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(valor)
+
+    def inc(self, nombre:str, valor:float=1, **labels) -> None:
+        with self._lock:
+            key = (nombre, _labels_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + valor
+
+    def get_counter(self, nombre:str, **labels) -> float:
+        return self.counters.get((nombre, _labels_key(labels)), 0)
+
+    def get_histogram(self, nombre:str, **labels) -> Histogram | None:
+        return self.histograms.get((nombre, _labels_key(labels)))
+
+    def sum_counters(self, nombre:str, **labels) -> float:
+        """Suma los contadores nombre cuyas etiquetas incluyen las pasadas"""
+        return sum(valor for (n, etiquetas), valor in self.counters.items()
+                    if n == nombre and labels.items() <= dict(etiquetas).items())
+
+    @contextmanager
+    def stage(self, nombre:str):
+        """Cronometra la etapa nombre y la registra en el histograma stage_duration_seconds
+
+        Parameters
+        ----------
+        nombre : str
+            nombre de la etapa
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_duration_seconds', time.perf_counter() - start, stage=nombre)
+
+    def on_event(self, evento:Evento) -> None:
+        """Suscriptor del EventBus del pipeline"""
+        datos = evento.datos
+        if evento.tipo == events.SEGMENTO_FINALIZADO:
+            self.inc('segments_total', origen=datos['origen'])
+            if datos['origen'] == 'revision':
+                self.inc('revision_savings_dollars_total', datos['coste_evitado'])
+            if datos['origen'] != 'llm':
+                return
+            self.inc('tokens_total', datos['tokens'])
+            self.inc('cost_dollars_total', datos['coste'])
+            self.observe('llm_tokens_per_call', datos['tokens'], TOKEN_BUCKETS)
+            self.observe('llm_cost_per_call_dollars', datos['coste'], COST_BUCKETS)
+            if datos.get('prompt_tokens'):
+                self.observe('llm_prompt_tokens_per_call', datos['prompt_tokens'], TOKEN_BUCKETS)
+                self.inc('prompt_tokens_total', datos['prompt_tokens'])
+                self.inc('cached_prompt_tokens_total', datos['cached_tokens'])
+            if 'latencia' in datos:
+                self.observe('llm_latency_seconds', datos['latencia'], model=datos.get('modelo', ''))
+            if 'modelo' in datos:
+                self.inc('routing_decisions_total', model=datos['modelo'], motivo=datos['motivo_routing'])
+                self.inc('cost_by_model_dollars_total', datos['coste'], model=datos['modelo'])
+                self.inc('routing_savings_dollars_total', datos['ahorro'])
+            if datos.get('terminos_glosario'):
+                self.inc('glossary_terms_total', datos['terminos_glosario'])
+                self.inc('glossary_violations_total', len(datos['glosario_incumplido']))
+            if 'idioma' in datos:
+                self.inc('cost_by_language_dollars_total', datos['coste'], idioma=datos['idioma'])
+            if 'espera' in datos:
+                self.observe('stage_duration_seconds', datos['espera'], stage='queue_wait')
+            if datos.get('duplicada'):
+                self.inc('hedged_calls_total')
+            if datos.get('trozos', 1) > 1:
+                self.inc('segments_split_total')
+                self.inc('segment_pieces_total', datos['trozos'])
+        elif evento.tipo == events.LLAMADA_DESCARTADA:
+            # Las llamadas duplicadas que pierden también se pagan
+            self.inc('tokens_total', datos['tokens'])
+            self.inc('cost_dollars_total', datos['coste'])
+            self.inc('hedge_discarded_cost_dollars_total', datos['coste'])
+            self.inc('cost_by_model_dollars_total', datos['coste'], model=datos['modelo'])
+            if 'idioma' in datos:
+                self.inc('cost_by_language_dollars_total', datos['coste'], idioma=datos['idioma'])
+        elif evento.tipo == events.DOCUMENTO_INICIADO:
+            if 'duracion_extraccion' in datos:
+                self.observe('stage_duration_seconds', datos['duracion_extraccion'], stage='extraction')
+            for etiqueta, n in datos.get('clasificacion', {}).items():
+                self.inc('segments_classified_total', n, parte=datos['parte'], etiqueta=etiqueta)
+            if normalizacion := datos.get('normalizacion'):
+                self.inc('xml_elements_total', normalizacion['elementos_antes'], fase='antes')
+                self.inc('xml_elements_total', normalizacion['elementos_despues'], fase='despues')
+                self.inc('text_elements_total', normalizacion['textos_antes'], fase='antes')
+                self.inc('text_elements_total', normalizacion['textos_despues'], fase='despues')
+                self.inc('runs_merged_total', normalizacion['runs_fusionados'])
+        elif evento.tipo == events.DOCUMENTO_FINALIZADO and 'duracion_escritura' in datos:
+            self.observe('stage_duration_seconds', datos['duracion_escritura'], stage='xml_write')
+
+    def cache_hit_rate(self) -> float:
+        """Proporción de segmentos traducibles servidos desde caché frente a los enviados al LLM"""
+        aciertos = self.get_counter('segments_total', origen='cache')
+        llamadas = self.get_counter('segments_total', origen='llm')
+        return aciertos / (aciertos + llamadas) if aciertos + llamadas else 0.0
+
+    def revision_reuse_ratio(self) -> float:
+        """Proporción de segmentos traducibles reutilizados de la versión anterior del documento"""
+        reutilizados = self.get_counter('segments_total', origen='revision')
+        traducibles = reutilizados + sum(self.get_counter('segments_total', origen=origen) for origen in ('cache', 'llm'))
+        return reutilizados / traducibles if traducibles else 0.0
+
+    def cached_token_ratio(self) -> float:
+        """Proporción de tokens de prompt servidos desde la caché de prompts del proveedor"""
+        prompt = self.get_counter('prompt_tokens_total')
+        return self.get_counter('cached_prompt_tokens_total') / prompt if prompt else 0.0
+
+    def latency_by_model(self) -> dict[str, tuple[int, float]]:
+        """Llamadas y latencia media en segundos de las llamadas al LLM por modelo"""
+        return {dict(labels)['model']: (hist.count, hist.sum / hist.count)
+                for (nombre, labels), hist in self.histograms.items()
+                if nombre == 'llm_latency_seconds' and hist.count}
+
+    def skip_rates(self) -> dict[str, float]:
+        """Proporción de segmentos que el clasificador deja sin traducir por parte del documento"""
+        totales, saltados = Counter(), Counter()
+        for (nombre, labels), valor in self.counters.items():
+            if nombre == 'segments_classified_total':
+                labels = dict(labels)
+                totales[labels['parte']] += valor
+                if labels['etiqueta'] == SKIP:
+                    saltados[labels['parte']] += valor
+        return {parte: saltados[parte] / total for parte, total in totales.items() if total}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'cache_hit_rate': self.cache_hit_rate(),
+                'cached_token_ratio': self.cached_token_ratio(),
+                'revision_reuse_ratio': self.revision_reuse_ratio(),
+                'latency_by_model': self.latency_by_model(),
+                'skip_rates': self.skip_rates(),
+                'counters': [{'name': nombre, 'labels': dict(labels), 'value': valor}
+                                for (nombre, labels), valor in self.counters.items()],
+                'histograms': [{'name': nombre, 'labels': dict(labels), **hist.to_dict()}
+                                for (nombre, labels), hist in self.histograms.items()],
+            }
+
+    def to_prometheus(self) -> str:
+        """Devuelve las métricas en formato texto de exposición de Prometheus"""
+        lineas = []
+        job = (('job_id', self.job_id),)
+        with self._lock:
+            for nombre in sorted({nombre for nombre, _ in self.counters}):
+                lineas.append(f"# TYPE {PREFIX}_{nombre} counter")
+                for (n, labels), valor in self.counters.items():
+                    if n == nombre:
+                        lineas.append(f"{PREFIX}_{nombre}{{{_format_labels(job + labels)}}} {valor}")
+            for nombre in sorted({nombre for nombre, _ in self.histograms}):
+                lineas.append(f"# TYPE {PREFIX}_{nombre} histogram")
+                for (n, labels), hist in self.histograms.items():
+                    if n != nombre:
+                        continue
+                    for limite, acumulado in hist.cumulative():
+                        le = '+Inf' if math.isinf(limite) else f"{limite:g}"
+                        lineas.append(f"{PREFIX}_{nombre}_bucket{{{_format_labels(job + labels + (('le', le),))}}} {acumulado}")
+                    lineas.append(f"{PREFIX}_{nombre}_sum{{{_format_labels(job + labels)}}} {hist.sum}")
+                    lineas.append(f"{PREFIX}_{nombre}_count{{{_format_labels(job + labels)}}} {hist.count}")
+        lineas.append(f"# TYPE {PREFIX}_skip_ratio gauge")
+        for parte, ratio in self.skip_rates().items():
+            lineas.append(f"{PREFIX}_skip_ratio{{{_format_labels(job + (('parte', parte),))}}} {ratio}")
+        lineas.append(f"# TYPE {PREFIX}_cache_hit_ratio gauge")
+        lineas.append(f"{PREFIX}_cache_hit_ratio{{{_format_labels(job)}}} {self.cache_hit_rate()}")
+        return "\n".join(lineas) + "\n"
+
+    def export(self, carpeta:Path=METRICS_FOLDER) -> Path:
+        """Escribe las métricas del trabajo en <job_id>.json y <job_id>.prom
+        (este último apto para el textfile collector de node_exporter).
+
+        Parameters
+        ----------
+        carpeta : Path, optional
+            carpeta destino, by default METRICS_FOLDER
+
+        Returns
+        -------
+        Path
+            ruta del json escrito
+        """
+        carpeta.mkdir(parents=True, exist_ok=True)
+        ruta_json = carpeta / f"{self.job_id}.json"
+        ruta_json.write_text(json.dumps(self.to_dict(), indent=2), encoding='utf-8')
+        (carpeta / f"{self.job_id}.prom").write_text(self.to_prometheus(), encoding='utf-8')
+        return ruta_json
@@ -18,4 +18,25 @@ from collections import namedtuple
 from collections.abc import Sequence
 import xml.etree.ElementTree as ET
 
-OpenAIResponse = namedtuple('OpenAIResponse', ['response', 'total_cost'])
\ No newline at end of file
+OpenAIResponse = namedtuple('OpenAIResponse', ['response', 'total_cost', 'total_tokens', 'prompt_tokens', 'cached_tokens'],
+                            defaults=[0, 0, 0])
+Evento = namedtuple('Evento', ['tipo', 'datos', 'timestamp'])
+# sin_traducir: índices (desde 0) de los segmentos que se han quedado en el idioma original, por parte
+# traducciones: texto final de cada segmento, por parte y en el orden de su SegmentTable
+TranslationResult = namedtuple('TranslationResult', ['partes_modificadas', 'translated_filename', 'texto_traducido',
+                                                    'sin_traducir', 'traducciones'])
+MaskedSegment = namedtuple('MaskedSegment', ['plantilla', 'valores'])
+SegmentedPart = namedtuple('SegmentedPart', ['nombre', 'tree', 'segmentos', 'mascaras', 'resumen', 'duracion_extraccion',
+                                                'normalizacion'])
+NormalizationStats = namedtuple('NormalizationStats', ['elementos_antes', 'elementos_despues', 'textos_antes',
+                                                        'textos_despues', 'ruido_eliminado', 'rsid_eliminados',
+                                                        'runs_fusionados'])
+PreparedDocument = namedtuple('PreparedDocument', ['partes', 'n_segmentos', 'n_llamadas', 'palabras_llm', 'tokens_estimados'])
+RevisionMatch = namedtuple('RevisionMatch', ['traducciones', 'parrafos_reutilizados', 'parrafos'])
+TranslationUnit = namedtuple('TranslationUnit', ['origen', 'traduccion', 'idioma_origen', 'idioma_destino'])
+# origen y traduccion son la clave y la plantilla de la memoria; texto_origen y texto_traduccion,
+# el par sin enmascarar cuando se conoce (unidades importadas)
+MemoryEntry = namedtuple('MemoryEntry', ['origen', 'traduccion', 'idioma_origen', 'idioma_destino', 'texto_origen',
+                                            'texto_traduccion'], defaults=[None, None])
+SegmentPieces = namedtuple('SegmentPieces', ['prefijo', 'trozos', 'separadores'])
+Tarea = namedtuple('Tarea', ['funcion', 'dependencias'], defaults=[()])
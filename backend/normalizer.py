@@ -0,0 +1,113 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con la normalización de las partes xml antes de segmentarlas.
+# Word llena el document.xml de ruido que no cambia cómo se ve el documento:
+# - w:proofErr (marcas del corrector) y w:lastRenderedPageBreak (caché de paginación)
+# - atributos w:rsid* (identificadores de sesión de edición)
+# - runs consecutivos con el mismo formato (w:rPr) que parten una frase en varios w:t
+# Quitar el ruido y fusionar los runs equivalentes reduce el número de segmentos a traducir
+# (y por tanto las llamadas al LLM) y el tamaño del xml, y da frases completas al LLM.
+
+from lxml import etree
+
+from .extractor import NAMESPACES
+from .models import NormalizationStats
+
+W = f"{{{NAMESPACES['w']}}}"
+NOISE_TAGS = (f'{W}proofErr', f'{W}lastRenderedPageBreak')
+RUN_TAG = f'{W}r'
+RUN_PROPERTIES_TAG = f'{W}rPr'
+TEXT_TAG = f'{W}t'
+RSID_PREFIX = f'{W}rsid'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+def _remove(elemento:etree._Element) -> None:
+    """Quita el elemento conservando su tail"""
+    padre = elemento.getparent()
+    if elemento.tail:
+        anterior = elemento.getprevious()
+        if anterior is not None:
+            anterior.tail = (anterior.tail or '') + elemento.tail
+        else:
+            padre.text = (padre.text or '') + elemento.tail
+    padre.remove(elemento)
+
+def _run_format(run:etree._Element) -> bytes | None:
+    """Devuelve el formato del run (atributos y w:rPr serializado) si el run solo
+    tiene texto y por tanto se puede fusionar, o None si tiene otro contenido
+    (tabuladores, saltos, campos, dibujos...).
+    """
+    propiedades = b''
+    for hijo in run:
+        if hijo.tag == RUN_PROPERTIES_TAG:
+            propiedades = etree.tostring(hijo)
+        elif hijo.tag != TEXT_TAG:
+            return None
+    return repr(sorted(run.attrib.items())).encode() + propiedades
+
+def _merge_runs(destino:etree._Element, origen:etree._Element) -> None:
+    """Añade el texto de origen al último w:t de destino y quita origen"""
+    textos = [hijo for hijo in origen if hijo.tag == TEXT_TAG]
+    ultimo = next((hijo for hijo in reversed(destino) if hijo.tag == TEXT_TAG), None)
+    for texto in textos:
+        if ultimo is None:
+            destino.append(texto)
+            ultimo = texto
+            continue
+        ultimo.text = (ultimo.text or '') + (texto.text or '')
+        contenido = ultimo.text
+        if texto.get(XML_SPACE) == 'preserve' or contenido != contenido.strip() or '  ' in contenido:
+            ultimo.set(XML_SPACE, 'preserve')
+    _remove(origen)
+
+def normalize_tree(tree:etree._ElementTree) -> NormalizationStats:
+    """Quita el ruido de Word del tree y fusiona los runs consecutivos con el mismo formato.
+    Modifica el tree.
+
+    Parameters
+    ----------
+    tree : etree._ElementTree
+        _description_
+
+    Returns
+    -------
+    NormalizationStats
+        recuentos de elementos y de w:t antes y después y de lo eliminado
+    """
+    root = tree.getroot()
+    elementos_antes = sum(1 for _ in root.iter())
+    textos_antes = sum(1 for _ in root.iter(TEXT_TAG))
+    # 1. Ruido: hay que quitarlo antes de fusionar porque separa runs equivalentes
+    ruido = list(root.iter(*NOISE_TAGS))
+    for elemento in ruido:
+        _remove(elemento)
+    rsid = 0
+    for elemento in root.iter(etree.Element):
+        for atributo in [a for a in elemento.attrib if a.startswith(RSID_PREFIX)]:
+            del elemento.attrib[atributo]
+            rsid += 1
+    # 2. Fusión de runs consecutivos (hermanos sin nada en medio) con el mismo formato
+    fusionados = 0
+    for run in list(root.iter(RUN_TAG)):
+        if run.getparent() is None or (formato := _run_format(run)) is None:
+            continue
+        siguiente = run.getnext()
+        while siguiente is not None and siguiente.tag == RUN_TAG and _run_format(siguiente) == formato:
+            _merge_runs(run, siguiente)
+            fusionados += 1
+            siguiente = run.getnext()
+    return NormalizationStats(elementos_antes, sum(1 for _ in root.iter()),
+                                textos_antes, sum(1 for _ in root.iter(TEXT_TAG)),
+                                len(ruido), rsid, fusionados)
@@ -18,4 +18,6 @@ from pathlib import Path
 
 XML_FOLDER = Path('backend/docx_xml')
 WORD_FOLDER = XML_FOLDER / Path('word')
-DOCUMENT_XML_PATH = WORD_FOLDER / 'document.xml'
\ No newline at end of file
+DOCUMENT_XML_PATH = WORD_FOLDER / 'document.xml'
+METRICS_FOLDER = Path('metrics')
+PROFILE_FOLDER = Path('profiles')
@@ -0,0 +1,608 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el bucle de extracción, traducción y reemplazo de los textos del documento.
+# No depende de Streamlit: el avance se publica en un EventBus.
+
+from array import array
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import copy
+from functools import partial
+from pathlib import Path
+import queue
+import random
+import time
+
+from . import events
+from .classifier import MASK, SKIP, classify_segments
+from .events import EventBus
+from .extractor import get_paragraph_ids, get_text_elements_at, iter_text_elements, parse_xml, serialize_tree
+from .glossary import Glossary, format_glossary_entries
+from .hedging import DeadlineExceeded, Hedger
+from .masking import PlaceholderError, fill_placeholders, mask_segment, unmask_segment
+from .models import MaskedSegment, OpenAIResponse, SegmentedPart, TranslationResult
+from .normalizer import normalize_tree
+from .paths import XML_FOLDER
+from .profiling import profiled
+from .ratelimit import RateLimiter
+from .routing import RoutingPolicy, get_routing_savings, route_segment
+from .scheduler import FairScheduler
+from .segments import SegmentTable
+from .splitter import DEFAULT_MAX_SEGMENT_TOKENS, get_piece_context, join_pieces, split_segment
+from .translator import translate
+from .utils import (get_cost_for_tokens,
+                    restore_edge_spaces,
+                    sanitize_xml_text,
+                    wait_randomly,
+                    )
+
+CHECKPOINT_ELEMENT_STEP = 50
+# Llamadas por segundo al LLM compartidas por todos los idiomas de un trabajo
+DEFAULT_CALLS_PER_SECOND = 2
+# Trozos de un segmento largo que se traducen a la vez
+SPLIT_WORKERS = 8
+# Reintentos de una llamada que supera el plazo. Si se agotan el segmento se deja sin traducir
+DEADLINE_RETRIES = 1
+
+class ExtractionError(Exception):
+    """El documento no se ha podido extraer correctamente"""
+
+def check_extraction(n_elements:int, document_words:int) -> None:
+    """Sanity check: si hay más elementos de texto que palabras en el documento, algo se ha parseado mal
+
+    Raises
+    ------
+    ExtractionError
+        _description_
+    """
+    if n_elements > document_words:
+        raise ExtractionError("El documento no se ha extraído correctamente debido a su formateo. Por favor, asegúrate de que el documento haya sido escrito por ti,")
+
+@contextmanager
+def llm_slot(
+        scheduler:FairScheduler | None,
+        tenant:str,
+        prioritario:bool,
+        rate_limiter:RateLimiter | None,
+        max_cooldown:float=0,
+        ):
+    """Espera el turno para llamar al LLM. Por orden de preferencia: el planificador justo
+    compartido entre sesiones (que también limita la concurrencia durante la llamada),
+    el limitador del trabajo o el cooldown aleatorio con probabilidad del 50%.
+    """
+    if scheduler is not None:
+        with scheduler.slot(tenant, prioritario):
+            yield
+        return
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    elif max_cooldown and random.random() < 0.5:
+        wait_randomly(max_cooldown)
+    yield
+
+def hedge_slot(
+        scheduler:FairScheduler | None,
+        tenant:str,
+        rate_limiter:RateLimiter | None,
+        ) -> Callable[[], Callable[[], None] | None]:
+    """Reserva sin esperar el hueco de una llamada duplicada: del planificador si se usa
+    (solo si no hay nadie en cola) o un token del limitador. Devuelve la función que lo
+    libera o None si no hay hueco.
+    """
+    def reservar() -> Callable[[], None] | None:
+        if scheduler is not None:
+            return scheduler.release if scheduler.try_acquire(tenant) else None
+        if rate_limiter is not None and rate_limiter.try_acquire() != 0:
+            return None
+        return lambda: None
+    return reservar
+
+def call_llm(
+        translate_fn:Callable[..., OpenAIResponse],
+        hedger:Hedger | None,
+        descartadas:list[tuple[str, Future]],
+        reservar_duplicada:Callable[[], Callable[[], None] | None] | None=None,
+        **kwargs,
+        ) -> tuple[OpenAIResponse, bool]:
+    """Llama al traductor, con plazo y hedging si se pasa hedger. Las llamadas
+    duplicadas que pierden y las que siguen en curso al vencer el plazo se añaden a
+    descartadas (modelo, futuro) para contabilizar su coste.
+    Cada duplicada toma antes su hueco con reservar_duplicada (ver hedge_slot).
+
+    Returns
+    -------
+    tuple[OpenAIResponse, bool]
+        respuesta y si se ha duplicado la llamada
+    """
+    if hedger is None:
+        return translate_fn(**kwargs), False
+    try:
+        response, duplicada, perdedoras = hedger.call(translate_fn, reservar_duplicada, timeout=hedger.plazo, **kwargs)
+    except DeadlineExceeded as exc:
+        descartadas.extend((kwargs['model'], futuro) for futuro in exc.pendientes)
+        raise
+    descartadas.extend((kwargs['model'], futuro) for futuro in perdedoras)
+    return response, duplicada
+
+def translate_pieces(
+        texto:str,
+        max_tokens:int,
+        chain_params:dict,
+        llamar:Callable[[str, dict], tuple[OpenAIResponse, bool, float]],
+        valores:tuple[str, ...]=(),
+        ) -> tuple[OpenAIResponse, bool, float, int]:
+    """Traduce el texto en una llamada o, si pasa de max_tokens, partido en fronteras de frase
+    en trozos que se traducen en paralelo, cada uno con el final del trozo anterior y el
+    principio del siguiente como contexto. Las traducciones se unen con los espacios originales.
+
+    Parameters
+    ----------
+    texto : str
+        texto a traducir (la plantilla si el segmento está enmascarado)
+    max_tokens : int
+        presupuesto de tokens por llamada
+    chain_params : dict
+        parámetros de la chain, con el texto_anterior y texto_posterior del segmento
+    llamar : Callable[[str, dict], tuple[OpenAIResponse, bool, float]]
+        llamada al LLM con turno: (texto, chain_params) -> (respuesta, duplicada, espera)
+    valores : tuple[str, ...], optional
+        valores enmascarados, para restaurarlos en el contexto de cada trozo, by default ()
+
+    Returns
+    -------
+    tuple[OpenAIResponse, bool, float, int]
+        respuesta con la traducción unida y costes y tokens sumados, si alguna llamada se ha duplicado,
+        espera máxima en cola y número de trozos
+    """
+    piezas = split_segment(texto, max_tokens)
+    if len(piezas.trozos) == 1:
+        response, duplicada, espera = llamar(texto, chain_params)
+        return response, duplicada, espera, 1
+
+    def traducir_trozo(indice:int) -> tuple[OpenAIResponse, bool, float]:
+        anterior, posterior = get_piece_context(piezas, indice, chain_params['texto_anterior'],
+                                                chain_params['texto_posterior'])
+        return llamar(piezas.trozos[indice], {**chain_params,
+                                                'texto_anterior': fill_placeholders(anterior, valores),
+                                                'texto_posterior': fill_placeholders(posterior, valores)})
+
+    n_trozos = len(piezas.trozos)
+    with ThreadPoolExecutor(max_workers=min(n_trozos, SPLIT_WORKERS), thread_name_prefix='trueform-trozo') as executor:
+        resultados = list(executor.map(profiled(traducir_trozo), range(n_trozos)))
+    respuestas = [response for response, _, _ in resultados]
+    response = OpenAIResponse(join_pieces(piezas, [response.response for response in respuestas]),
+                                sum(response.total_cost for response in respuestas),
+                                sum(response.total_tokens for response in respuestas),
+                                sum(response.prompt_tokens for response in respuestas),
+                                sum(response.cached_tokens for response in respuestas))
+    return response, any(duplicada for _, duplicada, _ in resultados), max(espera for _, _, espera in resultados), n_trozos
+
+def publish_discarded(bus:EventBus, descartadas:list[tuple[str, Future]], esperar:bool=False) -> None:
+    """Publica el coste de las llamadas descartadas que ya han terminado
+    (o de todas si esperar) y las quita de la lista.
+    """
+    if esperar:
+        wait([futuro for _, futuro in descartadas])
+    pendientes = []
+    for modelo, futuro in descartadas:
+        if not futuro.done():
+            pendientes.append((modelo, futuro))
+        elif not futuro.cancelled() and futuro.exception() is None:
+            response:OpenAIResponse = futuro.result()
+            bus.publish(events.LLAMADA_DESCARTADA, origen='descartada', modelo=modelo, palabras=0,
+                        coste=response.total_cost, tokens=response.total_tokens)
+    descartadas[:] = pendientes
+
+def segment_part(nombre:str, contenido:Path|bytes, parte_id:int=0, normalizar:bool=True) -> SegmentedPart:
+    """Parsea una parte xml, la normaliza (quita el ruido de Word y fusiona los runs con
+    el mismo formato), clasifica sus segmentos y enmascara los que lo necesitan.
+    El resultado no depende del idioma destino y puede compartirse entre idiomas.
+
+    Parameters
+    ----------
+    nombre : str
+        nombre de la parte dentro del docx, p.ej. word/document.xml
+    contenido : Path | bytes
+        ruta de la parte xml o su contenido
+    parte_id : int, optional
+        índice de la parte en el documento para la tabla de segmentos, by default 0
+    normalizar : bool, optional
+        si se normaliza la parte antes de segmentarla, by default True
+
+    Returns
+    -------
+    SegmentedPart
+        _description_
+    """
+    start = time.perf_counter()
+    tree = parse_xml(contenido)
+    normalizacion = normalize_tree(tree) if normalizar else None
+    # Posiciones en un array y no en tuplas (posición, elemento): en partes de millones de runs
+    # las tuplas subían el pico de memoria por encima de la representación anterior
+    posiciones, elementos = array('I'), []
+    for posicion, elemento in iter_text_elements(tree):
+        posiciones.append(posicion)
+        elementos.append(elemento)
+    textos = [elemento.text for elemento in elementos]
+    # Clasificamos todos los segmentos de la parte en una sola pasada
+    etiquetas, resumen = classify_segments(textos)
+    # Los textos van a la tabla compacta con la posición de su w:t para recuperarlo en cada
+    # copia del tree; solo los segmentos enmascarados guardan su MaskedSegment
+    segmentos, mascaras = SegmentTable(), {}
+    parrafos = get_paragraph_ids(elementos)
+    del elementos
+    for indice, (texto, etiqueta, parrafo, nodo) in enumerate(zip(textos, etiquetas, parrafos, posiciones)):
+        segmentos.append(texto, etiqueta, parte_id, parrafo, nodo)
+        if etiqueta == MASK:
+            mascaras[indice] = mask_segment(texto)
+    return SegmentedPart(nombre, tree, segmentos, mascaras, resumen, time.perf_counter() - start, normalizacion)
+
+def segment_parts(to_extract_list:list[Path], document_words:int, xml_folder:Path=XML_FOLDER) -> list[SegmentedPart]:
+    """Segmenta todas las partes del documento una sola vez y hace el sanity check de cada una"""
+    partes = [segment_part(Path(doc).relative_to(xml_folder).as_posix(), doc, parte_id)
+                for parte_id, doc in enumerate(to_extract_list)]
+    for parte in partes:
+        check_extraction(len(parte.segmentos), document_words)
+    return partes
+
+def extract_translate_replace(
+        *,
+        apikey:str,
+        model:str,
+        document_words:int,
+        filename:str,
+        chain_params:dict,
+        diccionario:dict[str, str],
+        bus:EventBus,
+        to_extract_list:list[Path] | None=None,
+        xml_folder:Path=XML_FOLDER,
+        translate_fn:Callable[..., OpenAIResponse]=translate,
+        max_cooldown:float=2,
+        routing_policy:RoutingPolicy | None=None,
+        partes:list[SegmentedPart] | None=None,
+        rate_limiter:RateLimiter | None=None,
+        glosario:Glossary | None=None,
+        scheduler:FairScheduler | None=None,
+        tenant:str='',
+        prioritario:bool=False,
+        hedger:Hedger | None=None,
+        revision:dict[str, dict[int, str]] | None=None,
+        max_segment_tokens:int=DEFAULT_MAX_SEGMENT_TOKENS,
+        ) -> TranslationResult:
+    """Traduce los textos de cada parte xml y devuelve un TranslationResult con
+    las partes traducidas en bytes, el nombre del archivo traducido y el texto traducido.
+    El avance, los costes y los tokens se publican como eventos en el bus.
+
+    Parameters
+    ----------
+    apikey : str
+        _description_
+    model : str
+        _description_
+    document_words : int
+        número de palabras del documento, para el sanity check
+    filename : str
+        nombre del archivo sin extensión
+    chain_params : dict
+        parámetros de la chain de traducción
+    diccionario : dict[str, str]
+        traducciones ya hechas de palabras sueltas. Se actualiza
+    bus : EventBus
+        bus donde publicar el avance
+    to_extract_list : list[Path] | None, optional
+        partes xml a traducir, descomprimidas en xml_folder. Obligatorio si no se pasa partes
+    xml_folder : Path, optional
+        carpeta donde se ha descomprimido el docx, by default XML_FOLDER
+    translate_fn : Callable[..., OpenAIResponse], optional
+        función de traducción con la firma de translator.translate, by default translate
+    max_cooldown : float, optional
+        segundos máximos del cooldown aleatorio entre llamadas, by default 2
+    routing_policy : RoutingPolicy | None, optional
+        política de enrutado entre modelo económico y premium, by default None (siempre model)
+    partes : list[SegmentedPart] | None, optional
+        partes ya segmentadas con segment_parts. Se traduce una copia de cada tree,
+        by default None (se segmenta cada parte de to_extract_list)
+    rate_limiter : RateLimiter | None, optional
+        limitador compartido que sustituye al cooldown aleatorio, by default None
+    glosario : Glossary | None, optional
+        glosario del idioma destino. Solo las entradas presentes en cada segmento van al prompt
+        y se comprueba que la traducción las respeta, by default None
+    scheduler : FairScheduler | None, optional
+        planificador justo compartido. Si se pasa sustituye a rate_limiter y al cooldown, by default None
+    tenant : str, optional
+        usuario para el planificador, p.ej. su clave, by default ''
+    prioritario : bool, optional
+        trabajo pequeño o interactivo para el planificador, by default False
+    hedger : Hedger | None, optional
+        plazo por llamada y hedging de las llamadas lentas. Sin él se llama directamente, by default None
+    revision : dict[str, dict[int, str]] | None, optional
+        traducciones de la versión anterior del documento a reutilizar, por parte e índice de
+        segmento (RevisionMatch.traducciones de revisions.match_revision), by default None
+    max_segment_tokens : int, optional
+        tokens estimados a partir de los cuales un segmento se parte en fronteras de frase
+        y sus trozos se traducen en paralelo, by default DEFAULT_MAX_SEGMENT_TOKENS
+
+    Returns
+    -------
+    TranslationResult
+        _description_
+    """
+    documentos = partes if partes is not None else to_extract_list
+    n_documentos = len(documentos)
+    routing_policy = routing_policy or RoutingPolicy()
+    partes_modificadas = {}
+    sin_traducir:dict[str, set[int]] = {}
+    traducciones:dict[str, list[str | None]] = {}
+    texto_traducido = ''
+    descartadas:list[tuple[str, Future]] = []
+    bus.publish(events.TRABAJO_INICIADO, n_documentos=n_documentos)
+
+    reservar_duplicada = hedge_slot(scheduler, tenant, rate_limiter)
+
+    def llamar(texto:str, params:dict, modelo:str) -> tuple[OpenAIResponse, bool, float]:
+        espera = 0.0
+        for intento in range(DEADLINE_RETRIES + 1):
+            # Esperamos turno: planificador, límite de llamadas o cooldown aleatorio
+            start = time.perf_counter()
+            with llm_slot(scheduler, tenant, prioritario, rate_limiter, max_cooldown):
+                espera += time.perf_counter() - start
+                # Pasamos por el traductor. Si no responde en el plazo reintentamos con un turno nuevo
+                try:
+                    response, duplicada = call_llm(translate_fn, hedger, descartadas, reservar_duplicada,
+                                                    apikey=apikey, model=modelo, text=texto, **params)
+                except DeadlineExceeded:
+                    if intento == DEADLINE_RETRIES:
+                        raise
+                    continue
+            return response, duplicada, espera
+
+    for idx, doc in enumerate(documentos, start=1):
+        if partes is not None:
+            # Las partes segmentadas se comparten entre idiomas: traducimos sobre una copia del tree
+            start = time.perf_counter()
+            parte = doc
+            tree = copy.deepcopy(parte.tree)
+            duracion_extraccion = parte.duracion_extraccion + time.perf_counter() - start
+        else:
+            parte = segment_part(Path(doc).relative_to(xml_folder).as_posix(), doc, idx - 1)
+            tree = parte.tree
+            duracion_extraccion = parte.duracion_extraccion
+        nombre_parte = parte.nombre
+        segmentos:SegmentTable = parte.segmentos
+        # Una sola pasada por el tree, sin repetir la selección de los w:t en cada idioma
+        elementos = get_text_elements_at(tree, segmentos.nodo)
+        n_elements = len(elementos)
+        bus.publish(events.DOCUMENTO_INICIADO, parte=nombre_parte, indice=idx,
+                    n_documentos=n_documentos, n_elementos=n_elements,
+                    duracion_extraccion=duracion_extraccion,
+                    clasificacion=dict(parte.resumen),
+                    normalizacion=parte.normalizacion._asdict() if parte.normalizacion else {})
+        check_extraction(n_elements, document_words)
+        reutilizables = (revision or {}).get(nombre_parte, {})
+        for id, element in enumerate(elementos, start=1):
+            text, etiqueta = segmentos.text(id - 1), segmentos.label(id - 1)
+            texto_llm, valores = parte.mascaras.get(id - 1) or MaskedSegment(text, ())
+            bus.publish(events.SEGMENTO_INICIADO, parte=nombre_parte, indice=id, n_elementos=n_elements)
+            # Sacamos número de palabras del elemento
+            num_running_words = len(text.split()) if text else 0
+            # No traducir caracteres, números, URLs, códigos etc.
+            if etiqueta == SKIP:
+                bus.publish(events.SEGMENTO_FINALIZADO, parte=nombre_parte, indice=id, origen='skip',
+                            palabras=num_running_words, coste=0, tokens=0)
+                continue
+            # Párrafo sin cambios respecto a la versión anterior: reutilizamos su traducción
+            if (id - 1) in reutilizables:
+                element.text = reutilizables[id - 1]
+                texto_traducido += element.text or ''
+                bus.publish(events.SEGMENTO_FINALIZADO, parte=nombre_parte, indice=id, origen='revision',
+                            palabras=num_running_words, coste=0, tokens=0,
+                            coste_evitado=get_cost_for_tokens(segmentos.tokens[id - 1], model))
+                continue
+            # Los números, fechas, importes, códigos... ya vienen enmascarados para que las
+            # líneas-plantilla compartan una sola traducción. La clave de la memoria es la plantilla.
+            clave_memoria = texto_llm.strip()
+            # Buscamos en el diccionario si el texto sin espacios ya ha sido traducido
+            if (transl:=diccionario.get(clave_memoria)) is not None:
+                try:
+                    element.text = sanitize_xml_text(restore_edge_spaces(text, unmask_segment(transl, valores)))
+                except PlaceholderError:
+                    # Entrada con los marcadores alterados (p.ej. importada): la descartamos y pasamos por el LLM
+                    diccionario.pop(clave_memoria, None)
+                else:
+                    bus.publish(events.SEGMENTO_FINALIZADO, parte=nombre_parte, indice=id, origen='cache',
+                                palabras=num_running_words, coste=0, tokens=0)
+                    continue
+            # Gestionamos la 'memoria' pasando texto anterior y posterior al prompt de traducción
+            # Solo para el document.xml
+            if Path(nombre_parte).name == "document.xml":
+                texto_anterior, texto_posterior = segmentos.surrounding_text(id - 1)
+            else:
+                texto_anterior = "..."
+                texto_posterior = "..."
+            # Añadimos texto_anterior y posterior a la chain_params
+            chain_params['texto_anterior'] = texto_anterior
+            chain_params['texto_posterior'] = texto_posterior
+            # Añadimos solo las entradas del glosario que aparecen en el segmento
+            entradas_glosario = glosario.match(texto_llm) if glosario is not None else {}
+            if glosario is not None:
+                chain_params['glosario'] = format_glossary_entries(entradas_glosario)
+            # Elegimos el modelo según longitud, complejidad y especialidad
+            decision = route_segment(texto_llm, chain_params['doc_context'], routing_policy, model)
+            # Los segmentos largos se parten en frases y sus trozos se traducen en paralelo
+            llamar_modelo = partial(llamar, modelo=decision.modelo)
+            start = time.perf_counter()
+            try:
+                response, duplicada, espera, trozos = translate_pieces(texto_llm, max_segment_tokens, chain_params,
+                                                                        llamar_modelo, valores)
+                coste, tokens = response.total_cost, response.total_tokens
+                prompt_tokens, cached_tokens = response.prompt_tokens, response.cached_tokens
+                try:
+                    translated_text = unmask_segment(response.response, valores)
+                except PlaceholderError:
+                    # El LLM ha alterado los marcadores: traducimos el texto original sin enmascarar
+                    clave_memoria = None
+                    response, duplicada_original, espera_original, trozos = translate_pieces(text, max_segment_tokens,
+                                                                                            chain_params, llamar_modelo)
+                    duplicada = duplicada or duplicada_original
+                    espera += espera_original
+                    translated_text = response.response
+                    coste, tokens = coste + response.total_cost, tokens + response.total_tokens
+                    prompt_tokens, cached_tokens = prompt_tokens + response.prompt_tokens, cached_tokens + response.cached_tokens
+            except DeadlineExceeded:
+                # El LLM no ha respondido ni reintentando: dejamos el texto original y seguimos con el documento
+                texto_traducido += text or ''
+                sin_traducir.setdefault(nombre_parte, set()).add(id - 1)
+                bus.publish(events.SEGMENTO_FINALIZADO, parte=nombre_parte, indice=id, origen='sin_traducir',
+                            palabras=num_running_words, coste=0, tokens=0)
+                publish_discarded(bus, descartadas)
+                continue
+            latencia = max(0.0, time.perf_counter() - start - espera)
+            # Si es una sola palabra o una plantilla enmascarada añadimos al diccionario quitando espacios
+            if clave_memoria is not None and (valores or len(text.split()) == 1):
+                diccionario[clave_memoria] = response.response.strip()
+            # Verificamos que los espacios al principio y al final coincidan con el texto original
+            translated_text = restore_edge_spaces(text, translated_text)
+            # Comprobamos que la traducción respeta el glosario
+            glosario_incumplido = glosario.check(entradas_glosario, translated_text) if entradas_glosario else []
+            # Sustituimos el texto traducido en el elemento
+            element.text = sanitize_xml_text(translated_text)
+            texto_traducido += translated_text
+            bus.publish(events.SEGMENTO_FINALIZADO, parte=nombre_parte, indice=id, origen='llm',
+                        palabras=num_running_words, coste=coste, tokens=tokens,
+                        prompt_tokens=prompt_tokens, cached_tokens=cached_tokens,
+                        latencia=latencia, espera=espera, enmascarado=bool(valores),
+                        modelo=decision.modelo, motivo_routing=decision.motivo,
+                        ahorro=get_routing_savings(tokens, decision.modelo, routing_policy.modelo_premium or model),
+                        terminos_glosario=len(entradas_glosario), glosario_incumplido=glosario_incumplido,
+                        duplicada=duplicada, trozos=trozos)
+            publish_discarded(bus, descartadas)
+            # Cada 50 elementos publicamos un checkpoint por si el proceso se interrumpe
+            if not id % CHECKPOINT_ELEMENT_STEP:
+                bus.publish(events.CHECKPOINT, texto_traducido=texto_traducido)
+        # Serializamos el arbol en memoria
+        start = time.perf_counter()
+        partes_modificadas[nombre_parte] = serialize_tree(tree)
+        traducciones[nombre_parte] = [elemento.text for elemento in elementos]
+        bus.publish(events.DOCUMENTO_FINALIZADO, parte=nombre_parte, indice=idx, n_documentos=n_documentos,
+                    duracion_escritura=time.perf_counter() - start)
+    # Traducimos el nombre del documento. No tiene contexto: si todos los segmentos venían
+    # de la revisión o de la memoria la chain_params no lleva texto_anterior ni texto_posterior
+    if glosario is not None:
+        chain_params['glosario'] = format_glossary_entries(glosario.match(filename))
+    start = time.perf_counter()
+    try:
+        response, duplicada, espera = llamar(filename, {**chain_params, 'texto_anterior': "...",
+                                                        'texto_posterior': "..."}, model)
+        bus.publish(events.SEGMENTO_FINALIZADO, parte='nombre_archivo', indice=0, origen='llm',
+                    palabras=0, coste=response.total_cost, tokens=response.total_tokens,
+                    latencia=max(0.0, time.perf_counter() - start - espera), duplicada=duplicada)
+    except DeadlineExceeded:
+        # Sin respuesta: el archivo traducido conserva el nombre original
+        response = OpenAIResponse(filename, 0, 0)
+        bus.publish(events.SEGMENTO_FINALIZADO, parte='nombre_archivo', indice=0, origen='sin_traducir',
+                    palabras=0, coste=0, tokens=0)
+    # Las llamadas descartadas terminan como tarde en el plazo: las esperamos para que el coste cuadre
+    publish_discarded(bus, descartadas, esperar=True)
+    bus.publish(events.TRABAJO_FINALIZADO, texto_traducido=texto_traducido)
+    return TranslationResult(partes_modificadas, response.response, texto_traducido, sin_traducir, traducciones)
+
+def translate_to_languages(
+        *,
+        idiomas:list[str],
+        document_words:int,
+        chain_params:dict,
+        diccionarios:dict[str, dict[str, str]],
+        bus:EventBus,
+        glosarios:dict[str, dict[str, str]] | None=None,
+        revisiones:dict[str, dict[str, dict[int, str]]] | None=None,
+        partes:list[SegmentedPart] | None=None,
+        to_extract_list:list[Path] | None=None,
+        xml_folder:Path=XML_FOLDER,
+        llamadas_por_segundo:float=DEFAULT_CALLS_PER_SECOND,
+        **kwargs,
+        ) -> dict[str, TranslationResult]:
+    """Traduce el documento a varios idiomas en un solo trabajo. Las partes se extraen,
+    clasifican y enmascaran una sola vez; cada idioma se traduce en su propio hilo
+    bajo un límite de llamadas compartido.
+    Los eventos de todos los idiomas se republican en bus desde el hilo que llama
+    (con el campo idioma), de modo que los suscriptores no necesitan ser thread-safe.
+
+    Parameters
+    ----------
+    idiomas : list[str]
+        idiomas destino
+    document_words : int
+        número de palabras del documento, para el sanity check
+    chain_params : dict
+        parámetros de la chain de traducción. destiny_lang se fija por idioma
+    diccionarios : dict[str, dict[str, str]]
+        memoria de traducciones por idioma. Se actualiza
+    bus : EventBus
+        bus donde publicar el avance
+    glosarios : dict[str, dict[str, str]] | None, optional
+        glosario por idioma destino (término -> traducción), by default None
+    revisiones : dict[str, dict[str, dict[int, str]]] | None, optional
+        traducciones reutilizables de la versión anterior por idioma destino, by default None
+    partes : list[SegmentedPart] | None, optional
+        partes ya segmentadas (p.ej. por el preprocesado en segundo plano), by default None
+    to_extract_list : list[Path] | None, optional
+        partes xml a segmentar si no se pasa partes, by default None
+    xml_folder : Path, optional
+        carpeta donde se ha descomprimido el docx, by default XML_FOLDER
+    llamadas_por_segundo : float, optional
+        límite de llamadas al LLM del trabajo completo, by default DEFAULT_CALLS_PER_SECOND
+    **kwargs
+        resto de argumentos de extract_translate_replace (apikey, model, filename...)
+
+    Returns
+    -------
+    dict[str, TranslationResult]
+        resultado por idioma, en el orden de idiomas
+    """
+    if partes is None:
+        partes = segment_parts(to_extract_list, document_words, xml_folder)
+    else:
+        for parte in partes:
+            check_extraction(len(parte.segmentos), document_words)
+    rate_limiter = RateLimiter(llamadas_por_segundo, rafaga=len(idiomas))
+    cola:queue.Queue = queue.Queue()
+
+    def traducir(idioma:str) -> TranslationResult:
+        entradas_glosario = (glosarios or {}).get(idioma)
+        bus_idioma = EventBus()
+        bus_idioma.subscribe(lambda evento: cola.put((idioma, evento)))
+        return extract_translate_replace(document_words=document_words,
+                                            chain_params={**chain_params, 'destiny_lang': idioma},
+                                            diccionario=diccionarios.setdefault(idioma, {}),
+                                            bus=bus_idioma,
+                                            partes=partes,
+                                            rate_limiter=rate_limiter,
+                                            glosario=Glossary(entradas_glosario) if entradas_glosario else None,
+                                            revision=(revisiones or {}).get(idioma),
+                                            **kwargs)
+
+    with ThreadPoolExecutor(max_workers=len(idiomas), thread_name_prefix='trueform-idioma') as executor:
+        futuros = {idioma: executor.submit(profiled(traducir), idioma) for idioma in idiomas}
+        # Vaciamos la cola hasta que todos los idiomas han terminado y no quedan eventos
+        pendientes = set(futuros.values())
+        while pendientes or not cola.empty():
+            try:
+                idioma, evento = cola.get(timeout=0.1)
+            except queue.Empty:
+                pendientes = {futuro for futuro in pendientes if not futuro.done()}
+                continue
+            bus.publish(evento.tipo, idioma=idioma, **evento.datos)
+    return {idioma: futuro.result() for idioma, futuro in futuros.items()}
@@ -0,0 +1,314 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el preprocesado especulativo del documento: en cuanto se carga el archivo
+# se extraen y segmentan sus partes xml, se planifica la deduplicación y se estiman
+# los tokens en segundo plano, mientras el usuario elige idiomas e introduce su clave.
+# El análisis del texto (idioma, temática, estimación) se ejecuta como un pequeño grafo
+# de dependencias cuyas tareas independientes corren en paralelo.
+
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
+from io import BytesIO
+import threading
+import time
+from typing import Any
+
+from .classifier import SKIP
+from .extractor import (LANGUAGE_NAMES_ES,
+                        get_language,
+                        get_language_hint,
+                        get_num_words,
+                        get_text_from_docx,
+                        get_topic,
+                        read_parts_from_docx,
+                        )
+from .models import MaskedSegment, PreparedDocument, SegmentedPart, Tarea
+from .pipeline import segment_part
+from .profiling import profile, profiled
+from .utils import convert_words_to_tokens, estimate_openai_cost
+
+# Cada documento cargado lanza dos trabajos: el preprocesado y el análisis
+PREPROCESSING_WORKERS = 4
+
+# Executor compartido por todas las sesiones
+_executor = ThreadPoolExecutor(max_workers=PREPROCESSING_WORKERS, thread_name_prefix='trueform-preprocess')
+
+class PreprocessingCancelled(CancelledError):
+    """El preprocesado se ha cancelado porque el usuario ha cambiado de documento"""
+
+def get_translation_plan(partes:list[SegmentedPart]) -> tuple[int, int, int]:
+    """Cuenta las llamadas al LLM que hará el pipeline teniendo en cuenta la memoria:
+    las plantillas enmascaradas y las palabras sueltas repetidas se traducen una sola vez.
+
+    Parameters
+    ----------
+    partes : list[SegmentedPart]
+        _description_
+
+    Returns
+    -------
+    tuple[int, int, int]
+        número de segmentos, número de llamadas y palabras enviadas al LLM
+    """
+    n_segmentos, n_llamadas, palabras = 0, 0, 0
+    memoria = set()
+    for parte in partes:
+        segmentos = parte.segmentos
+        n_segmentos += len(segmentos)
+        for indice in range(len(segmentos)):
+            if segmentos.label(indice) == SKIP:
+                continue
+            texto_llm, valores = parte.mascaras.get(indice) or MaskedSegment(segmentos.text(indice), ())
+            num_palabras = len(texto_llm.split())
+            # Misma regla de caché que extract_translate_replace
+            if valores or num_palabras == 1:
+                clave_memoria = texto_llm.strip()
+                if clave_memoria in memoria:
+                    continue
+                memoria.add(clave_memoria)
+            n_llamadas += 1
+            palabras += num_palabras
+    return n_segmentos, n_llamadas, palabras
+
+def prepare_document(documento:bytes, cancelado:threading.Event | None=None) -> PreparedDocument:
+    """Extrae en memoria y segmenta las partes a traducir del docx y calcula el plan de traducción.
+    Comprueba entre parte y parte si se ha cancelado.
+
+    Parameters
+    ----------
+    documento : bytes
+        el docx en bytes
+    cancelado : threading.Event | None, optional
+        evento que indica que el resultado ya no interesa, by default None
+
+    Returns
+    -------
+    PreparedDocument
+        _description_
+
+    Raises
+    ------
+    PreprocessingCancelled
+        si se activa cancelado antes de terminar
+    """
+    partes = []
+    for parte_id, (nombre, contenido) in enumerate(read_parts_from_docx(documento).items()):
+        if cancelado is not None and cancelado.is_set():
+            raise PreprocessingCancelled(f"Preprocesado cancelado en {nombre}")
+        partes.append(segment_part(nombre, contenido, parte_id))
+    n_segmentos, n_llamadas, palabras = get_translation_plan(partes)
+    return PreparedDocument(partes, n_segmentos, n_llamadas, palabras, convert_words_to_tokens(palabras))
+
+class PreprocessingJob:
+    """Preprocesado en segundo plano de un documento identificado por documento_id"""
+    def __init__(self, documento_id:str, documento:bytes) -> None:
+        self.documento_id = documento_id
+        self._cancelado = threading.Event()
+        self._futuro:Future = _executor.submit(profiled(prepare_document), documento, self._cancelado)
+
+    def cancel(self) -> None:
+        """Cancela el trabajo si no ha empezado o lo interrumpe en la siguiente parte"""
+        self._cancelado.set()
+        self._futuro.cancel()
+
+    def done(self) -> bool:
+        return self._futuro.done()
+
+    def result(self, timeout:float | None=None) -> PreparedDocument:
+        """Espera al resultado del preprocesado
+
+        Raises
+        ------
+        PreprocessingCancelled
+            si el trabajo se ha cancelado
+        """
+        if self._cancelado.is_set():
+            raise PreprocessingCancelled(f"Preprocesado del documento {self.documento_id} cancelado")
+        return self._futuro.result(timeout)
+
+def start_preprocessing(actual:PreprocessingJob | None, documento_id:str, documento:bytes) -> PreprocessingJob:
+    """Lanza el preprocesado del documento. Si ya hay uno en marcha para el mismo documento
+    lo reutiliza; si es de otro documento lo cancela.
+
+    Parameters
+    ----------
+    actual : PreprocessingJob | None
+        trabajo en curso de la sesión
+    documento_id : str
+        identificador del documento, p.ej. su hash
+    documento : bytes
+        el docx en bytes
+
+    Returns
+    -------
+    PreprocessingJob
+        _description_
+    """
+    if actual is not None:
+        if actual.documento_id == documento_id:
+            return actual
+        actual.cancel()
+    return PreprocessingJob(documento_id, documento)
+
+def _run_timed(funcion:Callable, **kwargs) -> tuple[Any, float]:
+    start = time.perf_counter()
+    resultado = funcion(**kwargs)
+    return resultado, time.perf_counter() - start
+
+def run_task_graph(tareas:dict[str, Tarea], max_workers:int | None=None) -> tuple[dict[str, Any], dict[str, float]]:
+    """Ejecuta un grafo de tareas lanzando cada una en cuanto sus dependencias han terminado.
+    Cada función recibe como kwargs los resultados de sus dependencias, con el nombre de la tarea.
+
+    Parameters
+    ----------
+    tareas : dict[str, Tarea]
+        nombre de cada tarea y su (funcion, dependencias)
+    max_workers : int | None, optional
+        hilos del pool, by default None (uno por tarea)
+
+    Returns
+    -------
+    tuple[dict[str, Any], dict[str, float]]
+        resultado y duración en segundos de cada tarea
+
+    Raises
+    ------
+    ValueError
+        si hay dependencias circulares o que no existen
+    """
+    resultados, duraciones = {}, {}
+    pendientes = dict(tareas)
+    with ThreadPoolExecutor(max_workers=max_workers or len(tareas), thread_name_prefix='trueform-dag') as executor:
+        en_curso:dict[Future, str] = {}
+        while pendientes or en_curso:
+            listas = [nombre for nombre, tarea in pendientes.items()
+                        if all(dependencia in resultados for dependencia in tarea.dependencias)]
+            for nombre in listas:
+                tarea = pendientes.pop(nombre)
+                kwargs = {dependencia: resultados[dependencia] for dependencia in tarea.dependencias}
+                en_curso[executor.submit(profiled(_run_timed), tarea.funcion, **kwargs)] = nombre
+            if not en_curso:
+                raise ValueError(f"Dependencias circulares o inexistentes en las tareas {sorted(pendientes)}")
+            hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                nombre = en_curso.pop(futuro)
+                resultados[nombre], duraciones[nombre] = futuro.result()
+    return resultados, duraciones
+
+def get_analysis_graph(documento:bytes, nombre_documento:str) -> dict[str, Tarea]:
+    """Grafo del análisis del documento al cargarlo. La temática solo espera al texto
+    si el docx declara su idioma; si no, espera también a la detección del idioma.
+
+    Parameters
+    ----------
+    documento : bytes
+        el docx en bytes
+    nombre_documento : str
+        nombre del archivo, se pasa al prompt de la temática
+
+    Returns
+    -------
+    dict[str, Tarea]
+        tareas: texto, num_words, idioma, tematica y estimated_cost
+    """
+    idioma_pista = LANGUAGE_NAMES_ES.get(get_language_hint(documento))
+    if idioma_pista is not None:
+        tematica = Tarea(lambda texto: get_topic(texto, idioma_pista, nombre_documento), ('texto',))
+    else:
+        tematica = Tarea(lambda texto, idioma: get_topic(texto, idioma[0], nombre_documento), ('texto', 'idioma'))
+    return {
+        'texto': Tarea(lambda: get_text_from_docx(BytesIO(documento))),
+        'num_words': Tarea(lambda texto: get_num_words(texto), ('texto',)),
+        'idioma': Tarea(lambda texto: get_language(texto), ('texto',)),
+        'tematica': tematica,
+        'estimated_cost': Tarea(lambda num_words: estimate_openai_cost(num_words), ('num_words',)),
+    }
+
+def analyze_document(documento:bytes, nombre_documento:str, job_id:str='') -> tuple[dict[str, Any], dict[str, float], float]:
+    """Ejecuta el grafo de análisis del documento (ver get_analysis_graph)
+
+    Parameters
+    ----------
+    documento : bytes
+        el docx en bytes
+    nombre_documento : str
+        nombre del archivo, se pasa al prompt de la temática
+    job_id : str, optional
+        id del trabajo para el profiling de la etapa 'preprocessing', by default ''
+
+    Returns
+    -------
+    tuple[dict[str, Any], dict[str, float], float]
+        resultado y duración de cada tarea y duración total en segundos
+    """
+    start = time.perf_counter()
+    with profile(job_id, 'preprocessing'):
+        analisis, duraciones = run_task_graph(get_analysis_graph(documento, nombre_documento))
+    return analisis, duraciones, time.perf_counter() - start
+
+class AnalysisJob:
+    """Análisis en segundo plano (texto, palabras, idioma, temática y estimación de coste)
+    de un documento identificado por documento_id. Igual que PreprocessingJob, la sesión
+    consulta el futuro en cada rerun y solo espera a él si el usuario pulsa Traducir antes.
+    """
+    def __init__(self, documento_id:str, documento:bytes, nombre_documento:str, job_id:str='') -> None:
+        self.documento_id = documento_id
+        self.job_id = job_id
+        self._futuro:Future = _executor.submit(profiled(analyze_document), documento, nombre_documento, job_id)
+
+    def cancel(self) -> None:
+        """Cancela el análisis si no ha empezado. Si ya ha empezado su resultado se descarta"""
+        self._futuro.cancel()
+
+    def done(self) -> bool:
+        return self._futuro.done()
+
+    def result(self, timeout:float | None=None) -> tuple[dict[str, Any], dict[str, float], float]:
+        """Espera al resultado del análisis (ver analyze_document)"""
+        return self._futuro.result(timeout)
+
+def start_analysis(
+        actual:AnalysisJob | None,
+        documento_id:str,
+        documento:bytes,
+        nombre_documento:str,
+        job_id:str='',
+        ) -> AnalysisJob:
+    """Lanza el análisis del documento. Si ya hay uno en marcha para el mismo documento
+    lo reutiliza; si es de otro documento lo cancela.
+
+    Parameters
+    ----------
+    actual : AnalysisJob | None
+        análisis en curso de la sesión
+    documento_id : str
+        identificador del documento, p.ej. su hash
+    documento : bytes
+        el docx en bytes
+    nombre_documento : str
+        nombre del archivo
+    job_id : str, optional
+        id del trabajo para el profiling, by default ''
+
+    Returns
+    -------
+    AnalysisJob
+        _description_
+    """
+    if actual is not None:
+        if actual.documento_id == documento_id:
+            return actual
+        actual.cancel()
+    return AnalysisJob(documento_id, documento, nombre_documento, job_id)
@@ -0,0 +1,192 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el modo de profiling opcional de los trabajos de traducción.
+# Se activa con variables de entorno:
+# - TRUEFORM_PROFILE: 'sample' (muestreo, bajo overhead), 'cprofile' (determinista) o 'all'
+# - TRUEFORM_PROFILE_STAGES: etapas a perfilar separadas por comas ('all' para todas), por defecto 'job'
+# - TRUEFORM_PROFILE_INTERVAL: segundos entre muestras del modo 'sample', por defecto 0.005
+# La salida se escribe en PROFILE_FOLDER como <job_id>_<etapa>.collapsed (para flame graphs)
+# y/o <job_id>_<etapa>.pstats
+# cProfile solo instrumenta el hilo que lo activa y la traducción corre en hilos de los
+# executors (idiomas, trozos, hedging, preprocesado, validación). Las funciones que se mandan
+# a un executor se envuelven con profiled: si al envolverlas hay una captura cprofile activa
+# en el contexto, cada llamada se perfila en su hilo y sus estadísticas se suman al .pstats
+# de esa captura, sin mezclarse con las de otras sesiones que perfilen a la vez.
+# El modo 'sample' ve todos los hilos sin necesidad de envolver nada.
+
+from collections import Counter
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+from functools import wraps
+import os
+from pathlib import Path
+import pstats
+import sys
+import threading
+
+from .paths import PROFILE_FOLDER
+
+PROFILE_MODES = ('sample', 'cprofile', 'all')
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Captura cprofile del trabajo en curso: recoge los profilers de los hilos de sus executors
+_captura_actual:ContextVar[list[cProfile.Profile] | None] = ContextVar('captura_cprofile', default=None)
+_capturas_lock = threading.Lock()
+
+def get_profile_mode() -> str | None:
+    """Devuelve el modo de profiling configurado o None si está desactivado"""
+    modo = os.environ.get('TRUEFORM_PROFILE', '').strip().lower()
+    if not modo:
+        return None
+    if modo not in PROFILE_MODES:
+        raise ValueError(f"TRUEFORM_PROFILE debe ser uno de {PROFILE_MODES}, no {modo!r}")
+    return modo
+
+def get_profile_stages() -> set[str]:
+    """Devuelve las etapas a perfilar"""
+    return {etapa.strip() for etapa in os.environ.get('TRUEFORM_PROFILE_STAGES', 'job').split(',') if etapa.strip()}
+
+class SamplingProfiler:
+    """Profiler por muestreo: un hilo daemon toma la pila de todos los hilos
+    cada `intervalo` segundos y cuenta las pilas en formato colapsado
+    (frame_raiz;...;frame_hoja), que es la entrada de flamegraph.pl y speedscope.
+    """
+    def __init__(self, intervalo:float=DEFAULT_SAMPLE_INTERVAL) -> None:
+        self.intervalo = intervalo
+        self.stacks:Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trueform-sampler', daemon=True)
+
+    @staticmethod
+    def _format_stack(frame) -> str:
+        pila = []
+        while frame is not None:
+            code = frame.f_code
+            pila.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(pila))
+
+    def _run(self) -> None:
+        propio = threading.get_ident()
+        nombres = {}
+        while not self._stop.wait(self.intervalo):
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                if ident not in nombres:
+                    nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+                self.stacks[f"{nombres.get(ident, ident)};{self._format_stack(frame)}"] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, ruta:Path) -> None:
+        ruta.write_text("".join(f"{pila} {n}\n" for pila, n in self.stacks.most_common()), encoding='utf-8')
+
+@contextmanager
+def profile_thread(captura:list[cProfile.Profile] | None=None):
+    """Perfila el bloque en el hilo actual si hay una captura cprofile y el hilo no tiene
+    ya un profiler (p.ej. el hilo que abrió la captura). Las estadísticas se añaden solo
+    a `captura` (por defecto la del contexto actual). Mientras dura el bloque la captura
+    queda en el contexto del hilo para que las funciones que envuelva con profiled también
+    entren en ella.
+    """
+    if captura is None:
+        captura = _captura_actual.get()
+    if captura is None or sys.getprofile() is not None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Otra herramienta de profiling ocupa el hilo
+        yield
+        return
+    token = _captura_actual.set(captura)
+    try:
+        yield
+    finally:
+        _captura_actual.reset(token)
+        profiler.disable()
+        with _capturas_lock:
+            captura.append(profiler)
+
+def profiled(funcion:Callable) -> Callable:
+    """Envuelve una función que se ejecuta en un hilo de un executor para que entre en
+    la captura cprofile activa en el contexto de quien la envuelve. Sin captura activa
+    devuelve la función sin tocar.
+    """
+    captura = _captura_actual.get()
+    if captura is None:
+        return funcion
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with profile_thread(captura):
+            return funcion(*args, **kwargs)
+    return envoltura
+
+@contextmanager
+def profile(job_id:str, etapa:str='job', modo:str | None=None, carpeta:Path=PROFILE_FOLDER):
+    """Context manager que perfila el bloque si el modo de profiling está activo
+    y la etapa está entre las configuradas. Si no, no hace nada. En modo cprofile el
+    .pstats incluye los hilos de los executors que ejecutan funciones envueltas con profiled.
+
+    Parameters
+    ----------
+    job_id : str
+        id del trabajo, forma parte del nombre de los archivos de salida
+    etapa : str, optional
+        nombre de la etapa perfilada, by default 'job'
+    modo : str | None, optional
+        fuerza un modo en lugar de leerlo del entorno, by default None
+    carpeta : Path, optional
+        carpeta de salida, by default PROFILE_FOLDER
+    """
+    modo = modo or get_profile_mode()
+    if modo is None or (etapa not in get_profile_stages() and 'all' not in get_profile_stages()):
+        yield
+        return
+    sampler, profiler, hilos = None, None, []
+    if modo in ('sample', 'all'):
+        intervalo = float(os.environ.get('TRUEFORM_PROFILE_INTERVAL', DEFAULT_SAMPLE_INTERVAL))
+        sampler = SamplingProfiler(intervalo)
+        sampler.start()
+    if modo in ('cprofile', 'all'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        token = _captura_actual.set(hilos)
+    try:
+        yield
+    finally:
+        carpeta.mkdir(parents=True, exist_ok=True)
+        if profiler is not None:
+            profiler.disable()
+            _captura_actual.reset(token)
+            with _capturas_lock:
+                hilos = list(hilos)
+            # Sumamos las estadísticas de los hilos de los executors a las del hilo principal
+            estadisticas = pstats.Stats(profiler)
+            for profiler_hilo in hilos:
+                estadisticas.add(profiler_hilo)
+            estadisticas.dump_stats(carpeta / f"{job_id}_{etapa}.pstats")
+        if sampler is not None:
+            sampler.stop()
+            sampler.write_collapsed(carpeta / f"{job_id}_{etapa}.collapsed")
@@ -0,0 +1,72 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el limitador de llamadas al LLM compartido entre hilos
+
+import threading
+import time
+
+class RateLimiter:
+    """Token bucket thread-safe: permite `por_segundo` llamadas por segundo de media
+    con ráfagas de hasta `rafaga` llamadas. Varios trabajos que comparten la misma
+    instancia comparten el límite.
+    """
+    def __init__(self, por_segundo:float, rafaga:int=1) -> None:
+        if por_segundo <= 0:
+            raise ValueError(f"por_segundo debe ser positivo, no {por_segundo}")
+        self.por_segundo = por_segundo
+        self.rafaga = max(1, rafaga)
+        self._tokens = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        ahora = time.monotonic()
+        self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def _reservar(self) -> float:
+        """Reserva un token y devuelve los segundos que hay que esperar hasta poder usarlo"""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.por_segundo
+
+    def acquire(self) -> float:
+        """Bloquea hasta que la llamada está permitida.
+
+        Returns
+        -------
+        float
+            segundos esperados
+        """
+        espera = self._reservar()
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+    def try_acquire(self) -> float:
+        """Toma una llamada si está permitida sin esperar.
+
+        Returns
+        -------
+        float
+            0 si se ha tomado la llamada o los segundos que faltan para que haya una disponible
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.por_segundo
@@ -0,0 +1,119 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con la retraducción incremental de revisiones de un documento.
+# De cada documento traducido se guarda la huella de cada párrafo (hash de sus segmentos
+# con el espacio normalizado) con las traducciones de sus segmentos. Al traducir una nueva
+# versión se compara la secuencia de huellas con la guardada (como un diff, de modo que la
+# posición cuenta) y los párrafos iguales reutilizan la traducción anterior sin pasar por el LLM.
+
+from collections.abc import Iterator
+from difflib import SequenceMatcher
+import hashlib
+
+from .models import RevisionMatch, SegmentedPart
+from .segments import SegmentTable
+
+# Separador de segmentos dentro de la huella: dos párrafos con el mismo texto partido
+# en runs distintos tienen huellas distintas porque las traducciones van por segmento
+SEGMENT_SEPARATOR = '\x1f'
+
+def iter_paragraphs(segmentos:SegmentTable) -> Iterator[range]:
+    """Devuelve los índices de los segmentos de cada párrafo, en orden"""
+    inicio = 0
+    for indice in range(1, len(segmentos) + 1):
+        if indice == len(segmentos) or segmentos.parrafo[indice] != segmentos.parrafo[inicio]:
+            yield range(inicio, indice)
+            inicio = indice
+
+def get_fingerprint(segmentos:SegmentTable, parrafo:range) -> str:
+    """Huella del párrafo: hash de sus segmentos con el espacio normalizado"""
+    texto = SEGMENT_SEPARATOR.join(" ".join((segmentos.text(indice) or '').split()) for indice in parrafo)
+    return hashlib.sha1(texto.encode()).hexdigest()[:16]
+
+def build_revision_record(partes:list[SegmentedPart], traducciones:dict[str, list[str | None]],
+                            sin_traducir:dict[str, set[int]] | None=None) -> list[dict]:
+    """Genera las partes del registro de la revisión para la db: por cada parte, la huella de
+    cada párrafo del original y las traducciones de sus segmentos.
+    Los párrafos con algún segmento sin traducir se quedan fuera para que la próxima versión
+    los mande al LLM en lugar de reutilizar el texto original.
+    Son listas y no dicts porque los nombres de parte llevan puntos y no valen como claves en Mongo.
+
+    Parameters
+    ----------
+    partes : list[SegmentedPart]
+        partes segmentadas del original
+    traducciones : dict[str, list[str | None]]
+        texto traducido de cada segmento por parte (TranslationResult.traducciones)
+    sin_traducir : dict[str, set[int]] | None, optional
+        índices de los segmentos sin traducir por parte (TranslationResult.sin_traducir), by default None
+
+    Returns
+    -------
+    list[dict]
+        [{'nombre': parte, 'parrafos': [{'huella': ..., 'traducciones': [...]}]}]
+    """
+    sin_traducir = sin_traducir or {}
+    registro_partes = []
+    for parte in partes:
+        traducidos = traducciones[parte.nombre]
+        pendientes = sin_traducir.get(parte.nombre, set())
+        registro_partes.append({
+            'nombre': parte.nombre,
+            'parrafos': [{'huella': get_fingerprint(parte.segmentos, parrafo),
+                            'traducciones': [traducidos[indice] for indice in parrafo]}
+                            for parrafo in iter_paragraphs(parte.segmentos)
+                            if pendientes.isdisjoint(parrafo)],
+        })
+    return registro_partes
+
+def match_revision(partes:list[SegmentedPart], registro:list[dict]) -> RevisionMatch:
+    """Compara las partes del documento nuevo con el registro de la versión anterior.
+    Los párrafos que el diff de huellas empareja reutilizan su traducción; los que no,
+    la reutilizan si el mismo párrafo aparece en otro sitio de la parte (párrafo movido).
+
+    Parameters
+    ----------
+    partes : list[SegmentedPart]
+        partes segmentadas del documento nuevo
+    registro : list[dict]
+        partes del registro de build_revision_record de la versión anterior
+
+    Returns
+    -------
+    RevisionMatch
+        traducciones a reutilizar por parte e índice de segmento y recuento de párrafos
+    """
+    anteriores = {parte['nombre']: parte['parrafos'] for parte in registro}
+    traducciones, reutilizados, total = {}, 0, 0
+    for parte in partes:
+        parrafos = list(iter_paragraphs(parte.segmentos))
+        huellas = [get_fingerprint(parte.segmentos, parrafo) for parrafo in parrafos]
+        total += len(parrafos)
+        previos = anteriores.get(parte.nombre, [])
+        huellas_previas = [previo['huella'] for previo in previos]
+        emparejados = {}
+        for bloque in SequenceMatcher(None, huellas_previas, huellas, autojunk=False).get_matching_blocks():
+            for desplazamiento in range(bloque.size):
+                emparejados[bloque.b + desplazamiento] = previos[bloque.a + desplazamiento]
+        por_huella = {previo['huella']: previo for previo in previos}
+        reutilizar = {}
+        for posicion, (parrafo, huella) in enumerate(zip(parrafos, huellas)):
+            previo = emparejados.get(posicion) or por_huella.get(huella)
+            if previo is None or len(previo['traducciones']) != len(parrafo):
+                continue
+            reutilizados += 1
+            reutilizar.update(zip(parrafo, previo['traducciones']))
+        traducciones[parte.nombre] = reutilizar
+    return RevisionMatch(traducciones, reutilizados, total)
@@ -0,0 +1,139 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el enrutado de segmentos entre un modelo económico y uno premium
+# según longitud, complejidad y especialidad del documento.
+# La política se guarda por usuario en el campo 'routing' de la db.
+
+from collections import namedtuple
+import re
+
+from pydantic import BaseModel
+
+from .utils import get_cost_for_tokens
+
+RoutingDecision = namedtuple('RoutingDecision', ['modelo', 'motivo'])
+
+WORD_PATTERN = re.compile(r'\w+')
+# Signos que suelen indicar frases con estructura compleja
+COMPLEX_PUNCTUATION = re.compile(r'[;:()\[\]«»"“”]')
+
+class RoutingPolicy(BaseModel):
+    activo:bool = False
+    modelo_economico:str = 'gpt-3.5-turbo'
+    modelo_premium:str | None = None # None: el modelo contratado por el usuario
+    max_palabras_simple:int = 8 # hasta aquí un segmento es 'corto'
+    min_palabras_premium:int = 60 # desde aquí un párrafo es 'largo'
+    max_complejidad:float = 0.35 # umbral de get_complexity para el modelo económico
+    especialidades_premium:list[str] = ['Legal', 'Médico', 'Filosófico', 'Novela']
+
+def get_complexity(texto:str) -> float:
+    """Devuelve una puntuación de complejidad entre 0 y 1 a partir de la proporción
+    de palabras largas y de signos de puntuación que indican subordinadas o citas.
+
+    Parameters
+    ----------
+    texto : str
+        _description_
+
+    Returns
+    -------
+    float
+        _description_
+    """
+    palabras = WORD_PATTERN.findall(texto)
+    if not palabras:
+        return 0.0
+    largas = sum(len(palabra) > 9 for palabra in palabras) / len(palabras)
+    signos = min(1.0, len(COMPLEX_PUNCTUATION.findall(texto)) / len(palabras) * 5)
+    return min(1.0, 0.7 * largas + 0.3 * signos)
+
+def route_segment(texto:str, doc_context:str, policy:RoutingPolicy, modelo_usuario:str) -> RoutingDecision:
+    """Elige el modelo con el que traducir el segmento
+
+    Parameters
+    ----------
+    texto : str
+        segmento a traducir
+    doc_context : str
+        especialidad del documento (una de LISTA_ESPECIALIDADES)
+    policy : RoutingPolicy
+        política del usuario
+    modelo_usuario : str
+        modelo contratado por el usuario
+
+    Returns
+    -------
+    RoutingDecision
+        (modelo, motivo)
+    """
+    premium = policy.modelo_premium or modelo_usuario
+    if not policy.activo:
+        return RoutingDecision(modelo_usuario, 'desactivado')
+    num_palabras = len(texto.split())
+    complejidad = get_complexity(texto)
+    if num_palabras <= policy.max_palabras_simple and complejidad <= policy.max_complejidad:
+        return RoutingDecision(policy.modelo_economico, 'corto')
+    if num_palabras >= policy.min_palabras_premium:
+        return RoutingDecision(premium, 'largo')
+    if doc_context in policy.especialidades_premium:
+        return RoutingDecision(premium, 'especialidad')
+    if complejidad > policy.max_complejidad:
+        return RoutingDecision(premium, 'complejo')
+    return RoutingDecision(policy.modelo_economico, 'simple')
+
+def get_routing_savings(tokens:int, modelo:str, modelo_premium:str) -> float:
+    """Ahorro estimado por haber usado modelo en lugar del premium para los tokens de la llamada
+
+    Parameters
+    ----------
+    tokens : int
+        tokens de la llamada
+    modelo : str
+        modelo usado
+    modelo_premium : str
+        modelo premium de la política
+
+    Returns
+    -------
+    float
+        _description_
+    """
+    if modelo == modelo_premium:
+        return 0.0
+    return get_cost_for_tokens(tokens, modelo_premium) - get_cost_for_tokens(tokens, modelo)
+
+def get_routing_latency_savings(latencias:dict[str, tuple[int, float]], modelo_economico:str, modelo_premium:str) -> float | None:
+    """Segundos de LLM ahorrados por haber enviado segmentos al modelo económico: llamadas
+    al económico por la diferencia entre la latencia media del premium y la del económico
+
+    Parameters
+    ----------
+    latencias : dict[str, tuple[int, float]]
+        llamadas y latencia media en segundos por modelo (ver JobMetrics.latency_by_model)
+    modelo_economico : str
+        modelo económico de la política
+    modelo_premium : str
+        modelo premium de la política
+
+    Returns
+    -------
+    float | None
+        segundos ahorrados (negativos si el económico ha sido más lento) o None
+        si en el trabajo no hay llamadas a alguno de los dos modelos
+    """
+    if modelo_economico == modelo_premium or modelo_economico not in latencias or modelo_premium not in latencias:
+        return None
+    llamadas_economico, media_economico = latencias[modelo_economico]
+    return llamadas_economico * (latencias[modelo_premium][1] - media_economico)
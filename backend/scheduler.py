@@ -0,0 +1,173 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con el planificador justo de llamadas al LLM compartido por todas las sesiones.
+# Todos los usuarios comparten los límites de OpenAI de la organización: cada llamada pide
+# turno al planificador, que reparte la capacidad entre usuarios (tenants, por clave) con
+# start-time fair queuing ponderado, da más peso a los trabajos pequeños o interactivos
+# y respeta un límite global de llamadas por segundo y de llamadas concurrentes.
+# Se configura con las variables de entorno TRUEFORM_LLM_RPS y TRUEFORM_LLM_CONCURRENCY.
+
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from .ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALLS_PER_SECOND = 8
+DEFAULT_MAX_CONCURRENT = 8
+# Palabras (por el número de idiomas) por debajo de las cuales un trabajo es prioritario
+SMALL_JOB_WORDS = 2_000
+# Multiplicador del peso de los trabajos prioritarios. Es un peso y no una prioridad estricta:
+# los trabajos grandes siguen avanzando aunque lleguen muchos pequeños
+PRIORITY_WEIGHT = 4
+# Esperas recientes que se guardan por tenant para los percentiles
+MAX_SAMPLES = 1_000
+
+def tenant_label(clave:str) -> str:
+    """Etiqueta del tenant para logs y métricas: nunca se expone la clave"""
+    return hashlib.sha256(clave.encode()).hexdigest()[:8]
+
+def is_priority_job(num_words:int, n_idiomas:int=1) -> bool:
+    """Un trabajo es prioritario si es pequeño"""
+    return num_words * n_idiomas <= SMALL_JOB_WORDS
+
+class FairScheduler:
+    """Planificador justo de llamadas al LLM. Cada llamada recibe una etiqueta virtual
+    de fin = max(reloj virtual, última etiqueta de su tenant) + 1 / peso y se atienden
+    por orden de etiqueta, de forma que un trabajo de 500 páginas no acapara la capacidad:
+    cada tenant con llamadas pendientes recibe una parte proporcional a su peso.
+    Es thread-safe y está pensado para compartirse entre sesiones.
+    """
+    def __init__(self, llamadas_por_segundo:float=DEFAULT_CALLS_PER_SECOND,
+                    max_concurrentes:int=DEFAULT_MAX_CONCURRENT) -> None:
+        self.max_concurrentes = max_concurrentes
+        self.rate_limiter = RateLimiter(llamadas_por_segundo, rafaga=max_concurrentes)
+        self._cond = threading.Condition()
+        self._cola:list[tuple[float, int, float, str]] = []
+        self._ultima_etiqueta:dict[str, float] = {}
+        self._reloj_virtual = 0.0
+        self._en_curso = 0
+        self._secuencia = itertools.count()
+        self._esperas:dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._atendidas:Counter[str] = Counter()
+
+    @classmethod
+    def from_env(cls) -> 'FairScheduler':
+        """Crea el planificador con los límites de TRUEFORM_LLM_RPS y TRUEFORM_LLM_CONCURRENCY"""
+        return cls(float(os.environ.get('TRUEFORM_LLM_RPS', DEFAULT_CALLS_PER_SECOND)),
+                    int(os.environ.get('TRUEFORM_LLM_CONCURRENCY', DEFAULT_MAX_CONCURRENT)))
+
+    def acquire(self, tenant:str, prioritario:bool=False, peso:float=1.0) -> float:
+        """Bloquea hasta que la llamada del tenant tiene turno, hay hueco de concurrencia
+        y el límite global de llamadas lo permite. Hay que llamar a release al terminar.
+
+        Parameters
+        ----------
+        tenant : str
+            identificador del usuario, p.ej. su clave
+        prioritario : bool, optional
+            trabajo pequeño o interactivo, multiplica el peso por PRIORITY_WEIGHT, by default False
+        peso : float, optional
+            peso del tenant, by default 1.0
+
+        Returns
+        -------
+        float
+            segundos de espera en la cola
+        """
+        encolado = time.monotonic()
+        with self._cond:
+            inicio = max(self._reloj_virtual, self._ultima_etiqueta.get(tenant, 0.0))
+            fin = inicio + 1 / (peso * (PRIORITY_WEIGHT if prioritario else 1))
+            self._ultima_etiqueta[tenant] = fin
+            entrada = (fin, next(self._secuencia), inicio, tenant)
+            heapq.heappush(self._cola, entrada)
+            self._cond.notify_all()
+            while True:
+                if self._cola[0] is entrada and self._en_curso < self.max_concurrentes:
+                    if (espera_rate := self.rate_limiter.try_acquire()) == 0:
+                        break
+                    self._cond.wait(espera_rate)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._cola)
+            self._reloj_virtual = max(self._reloj_virtual, inicio)
+            self._en_curso += 1
+            espera = time.monotonic() - encolado
+            self._esperas[tenant].append(espera)
+            self._atendidas[tenant] += 1
+            # La siguiente de la cola puede tener ya su turno
+            self._cond.notify_all()
+        return espera
+
+    def try_acquire(self, tenant:str) -> bool:
+        """Toma un hueco sin esperar solo si nadie espera en la cola, hay hueco de concurrencia
+        y el límite global lo permite. Para llamadas extra (duplicadas) que no deben adelantar
+        a las de otros tenants. Si devuelve True hay que llamar a release al terminar.
+        """
+        with self._cond:
+            if self._cola or self._en_curso >= self.max_concurrentes or self.rate_limiter.try_acquire() != 0:
+                return False
+            self._en_curso += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self._en_curso -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tenant:str, prioritario:bool=False, peso:float=1.0):
+        """Context manager con acquire y release alrededor de la llamada al LLM"""
+        self.acquire(tenant, prioritario, peso)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_delays(self) -> dict[str, dict[str, float]]:
+        """Espera en cola por tenant (etiquetado con tenant_label) sobre las últimas MAX_SAMPLES llamadas
+
+        Returns
+        -------
+        dict[str, dict[str, float]]
+            llamadas atendidas, media, p95 y máximo de la espera en segundos
+        """
+        with self._cond:
+            esperas = {tenant: sorted(valores) for tenant, valores in self._esperas.items()}
+            atendidas = dict(self._atendidas)
+        return {
+            tenant_label(tenant): {
+                'calls': atendidas[tenant],
+                'mean': sum(valores) / len(valores),
+                'p95': valores[min(len(valores) - 1, round(0.95 * (len(valores) - 1)))],
+                'max': valores[-1],
+            }
+            for tenant, valores in esperas.items() if valores
+        }
+
+    def log_queue_delays(self) -> None:
+        """Vuelca al logging la espera en cola de cada tenant"""
+        for tenant, espera in self.queue_delays().items():
+            logger.info("Tenant %s: %d llamadas, espera media %.2fs, p95 %.2fs, máx %.2fs",
+                        tenant, espera['calls'], espera['mean'], espera['p95'], espera['max'])
@@ -0,0 +1,118 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con la tabla compacta de segmentos de un documento.
+# En vez de una tupla (elemento, texto) por run, el texto de todos los segmentos va en un
+# único buffer UTF-8 con arrays de offset y longitud, y el resto de atributos en columnas
+# numéricas (parte, párrafo, flags, tokens y nodo). El nodo es la posición del w:t entre todos
+# los w:t de su parte (extractor.iter_text_elements): el elemento se recupera del tree, o de
+# cualquier copia suya, solo cuando se necesita y sin repetir la selección.
+
+from array import array
+from collections.abc import Iterator
+
+from .classifier import MASK, SKIP, TRANSLATE
+from .utils import convert_words_to_tokens, format_surrounding_text
+
+# Etiqueta del clasificador en los 2 bits bajos de flags
+LABELS = (TRANSLATE, SKIP, MASK)
+LABEL_CODES = {etiqueta: codigo for codigo, etiqueta in enumerate(LABELS)}
+LABEL_MASK = 0b11
+# El w:t no tiene texto (element.text es None)
+FLAG_NONE = 0b100
+# Separador entre párrafos en el buffer: no pertenece a ningún segmento pero da el contexto
+PARAGRAPH_SEPARATOR = b'\n'
+
+class SegmentTable:
+    """Tabla de segmentos en columnas. Se rellena con append en orden de documento"""
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._inicio = array('Q')
+        self._longitud = array('I')
+        self.parte = array('H')
+        self.parrafo = array('I')
+        self.flags = array('B')
+        self.tokens = array('I')
+        self.nodo = array('I')
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def append(self, texto:str | None, etiqueta:str, parte:int, parrafo:int, nodo:int) -> None:
+        """Añade un segmento
+
+        Parameters
+        ----------
+        texto : str | None
+            texto del w:t
+        etiqueta : str
+            etiqueta del clasificador
+        parte : int
+            índice de la parte del documento
+        parrafo : int
+            índice del párrafo dentro del documento
+        nodo : int
+            posición del w:t entre todos los w:t de su parte (extractor.iter_text_elements)
+        """
+        if self.parrafo and parrafo != self.parrafo[-1]:
+            self._buffer += PARAGRAPH_SEPARATOR
+        codificado = texto.encode() if texto else b''
+        self._inicio.append(len(self._buffer))
+        self._longitud.append(len(codificado))
+        self._buffer += codificado
+        self.parte.append(parte)
+        self.parrafo.append(parrafo)
+        self.flags.append(LABEL_CODES[etiqueta] | (FLAG_NONE if texto is None else 0))
+        self.tokens.append(convert_words_to_tokens(len(texto.split())) if texto else 0)
+        self.nodo.append(nodo)
+
+    def text(self, indice:int) -> str | None:
+        if self.flags[indice] & FLAG_NONE:
+            return None
+        inicio = self._inicio[indice]
+        return self._buffer[inicio:inicio + self._longitud[indice]].decode()
+
+    def label(self, indice:int) -> str:
+        return LABELS[self.flags[indice] & LABEL_MASK]
+
+    def texts(self) -> Iterator[str | None]:
+        return (self.text(indice) for indice in range(len(self)))
+
+    def surrounding_text(self, indice:int, num_caracteres:int=100) -> tuple[str, str]:
+        """Devuelve el texto anterior y posterior al segmento para la 'memoria' del prompt,
+        tomado de los segmentos vecinos y formateado con utils.format_surrounding_text
+
+        Parameters
+        ----------
+        indice : int
+            _description_
+        num_caracteres : int, optional
+            bytes a coger por cada lado, by default 100
+
+        Returns
+        -------
+        tuple[str, str]
+            texto_anterior, texto_posterior
+        """
+        inicio = self._inicio[indice]
+        fin = inicio + self._longitud[indice]
+        # Un corte a mitad de un carácter multibyte se descarta al decodificar
+        anterior = self._buffer[max(0, inicio - num_caracteres):inicio].decode(errors='ignore')
+        posterior = self._buffer[fin:fin + num_caracteres].decode(errors='ignore')
+        return format_surrounding_text(anterior, posterior)
+
+    def nbytes(self) -> int:
+        """Memoria ocupada por el buffer y las columnas"""
+        columnas = (self._inicio, self._longitud, self.parte, self.parrafo, self.flags, self.tokens, self.nodo)
+        return len(self._buffer) + sum(columna.itemsize * len(columna) for columna in columnas)
@@ -0,0 +1,153 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con la división de segmentos demasiado largos para una sola llamada al LLM.
+# Un w:t (o un párrafo fusionado) de miles de palabras supera el contexto y la salida del
+# modelo o tarda un minuto en volver. Se parte por presupuesto de tokens en fronteras de
+# frase (y si una frase no cabe, de cláusula, coma y palabra), se traduce cada trozo por
+# separado y se vuelve a unir con los espacios originales entre trozos.
+
+import re
+
+from .models import SegmentPieces
+from .utils import convert_words_to_tokens, format_surrounding_text
+
+# Tokens máximos de texto por llamada: el prompt, el contexto y la traducción tienen que
+# caber en los 4K de contexto de gpt-3.5-turbo
+DEFAULT_MAX_SEGMENT_TOKENS = 1_000
+# Abreviaturas habituales tras las que un punto no cierra la frase
+ABBREVIATIONS = {
+    'art', 'arts', 'núm', 'nº', 'pág', 'págs', 'pp', 'vol', 'cap', 'apdo', 'párr', 'sr', 'sra', 'srta',
+    'sres', 'dr', 'dra', 'dña', 'lic', 'ing', 'etc', 'ej', 'vid', 'cf', 'cfr', 'avda', 'tel', 'fig', 'figs',
+    'mr', 'mrs', 'ms', 'prof', 'st', 'vs', 'sec', 'e.g', 'i.e', 'approx', 'inc', 'ltd', 'co', 'corp', 's.a', 's.l',
+}
+# Fronteras de mayor a menor preferencia. El grupo 1 es el espacio entre trozos
+BOUNDARIES = (
+    re.compile(r'[.!?…]["»”’)\]]*(\s+)'),
+    re.compile(r'[;:]["»”’)\]]*(\s+)'),
+    re.compile(r',(\s+)'),
+    re.compile(r'(\s+)'),
+)
+LAST_WORD = re.compile(r'([\w.]+)\.$')
+
+def count_tokens(texto:str) -> int:
+    return convert_words_to_tokens(len(texto.split()))
+
+def _is_abbreviation(texto:str, fin:int) -> bool:
+    """Si el punto en texto[fin - 1] es de una abreviatura o una inicial y no cierra la frase"""
+    if texto[fin - 1] != '.' or (match := LAST_WORD.search(texto, 0, fin)) is None:
+        return False
+    palabra = match.group(1).lower()
+    return palabra in ABBREVIATIONS or (len(palabra) == 1 and palabra.isalpha())
+
+def _split_at(texto:str, nivel:int) -> list[tuple[str, str]]:
+    """Parte el texto (sin espacios en los bordes) en las fronteras del nivel.
+    Devuelve (contenido, espacio que le sigue) y el último separador es ''.
+    """
+    unidades, inicio = [], 0
+    for match in BOUNDARIES[nivel].finditer(texto):
+        if nivel == 0 and _is_abbreviation(texto, match.start(1)):
+            continue
+        unidades.append((texto[inicio:match.start(1)], match.group(1)))
+        inicio = match.end(1)
+    unidades.append((texto[inicio:], ''))
+    return unidades
+
+def _pack(texto:str, max_tokens:int, nivel:int=0) -> list[tuple[str, str]]:
+    """Agrupa las unidades del nivel en trozos de hasta max_tokens. Una unidad que no cabe
+    sola se parte en el nivel siguiente.
+    """
+    if count_tokens(texto) <= max_tokens or nivel == len(BOUNDARIES):
+        return [(texto, '')]
+    trozos:list[tuple[str, str]] = []
+    # Contamos palabras y no tokens: el redondeo de cada unidad no suma igual que el del trozo
+    actual, separador, palabras = '', '', 0
+    for contenido, espacio in _split_at(texto, nivel):
+        palabras_unidad = len(contenido.split())
+        if actual and convert_words_to_tokens(palabras + palabras_unidad) > max_tokens:
+            trozos.append((actual, separador))
+            actual, palabras = '', 0
+        if convert_words_to_tokens(palabras_unidad) > max_tokens:
+            subtrozos = _pack(contenido, max_tokens, nivel + 1)
+            trozos.extend(subtrozos[:-1])
+            trozos.append((subtrozos[-1][0], espacio))
+            continue
+        actual = actual + separador + contenido if actual else contenido
+        separador, palabras = espacio, palabras + palabras_unidad
+    if actual:
+        trozos.append((actual, separador))
+    return trozos
+
+def split_segment(texto:str, max_tokens:int=DEFAULT_MAX_SEGMENT_TOKENS) -> SegmentPieces:
+    """Parte el texto en trozos de hasta max_tokens tokens estimados, en fronteras de frase
+    siempre que se pueda. Se cumple prefijo + "".join(trozo + separador) == texto.
+
+    Parameters
+    ----------
+    texto : str
+        _description_
+    max_tokens : int, optional
+        presupuesto de tokens por trozo, by default DEFAULT_MAX_SEGMENT_TOKENS
+
+    Returns
+    -------
+    SegmentPieces
+        espacio inicial, trozos sin espacios en los bordes y el espacio original tras cada trozo
+    """
+    contenido = texto.strip()
+    inicio = texto.find(contenido) if contenido else len(texto)
+    prefijo, sufijo = texto[:inicio], texto[inicio + len(contenido):]
+    trozos = _pack(contenido, max_tokens)
+    # El espacio final del texto va tras el último trozo
+    trozos[-1] = (trozos[-1][0], trozos[-1][1] + sufijo)
+    return SegmentPieces(prefijo, [trozo for trozo, _ in trozos], [separador for _, separador in trozos])
+
+def join_pieces(piezas:SegmentPieces, traducciones:list[str]) -> str:
+    """Une las traducciones de los trozos con los espacios originales entre trozos"""
+    return piezas.prefijo + "".join(traduccion.strip() + separador
+                                    for traduccion, separador in zip(traducciones, piezas.separadores))
+
+def get_piece_context(
+        piezas:SegmentPieces,
+        indice:int,
+        texto_anterior:str,
+        texto_posterior:str,
+        num_caracteres:int=100,
+        ) -> tuple[str, str]:
+    """Contexto del trozo para el prompt: el final del trozo anterior y el principio del
+    siguiente, o el contexto del segmento completo en los extremos
+
+    Parameters
+    ----------
+    piezas : SegmentPieces
+        _description_
+    indice : int
+        índice del trozo
+    texto_anterior : str
+        contexto anterior del segmento completo
+    texto_posterior : str
+        contexto posterior del segmento completo
+    num_caracteres : int, optional
+        caracteres a coger de cada trozo vecino, by default 100
+
+    Returns
+    -------
+    tuple[str, str]
+        texto_anterior, texto_posterior
+    """
+    if indice > 0:
+        texto_anterior, _ = format_surrounding_text(piezas.trozos[indice - 1][-num_caracteres:], '')
+    if indice + 1 < len(piezas.trozos):
+        _, texto_posterior = format_surrounding_text('', piezas.trozos[indice + 1][:num_caracteres])
+    return texto_anterior, texto_posterior
@@ -0,0 +1,357 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Script con la importación y exportación de memorias de traducción en TMX y XLIFF.
+# Los archivos se leen en streaming con iterparse, liberando cada unidad tras procesarla,
+# y se escriben con xmlfile unidad a unidad, de modo que la memoria no depende del tamaño
+# del archivo. Las unidades se guardan con la misma clave que la memoria del pipeline
+# (texto sin espacios en los bordes, con las entidades enmascaradas) para que una unidad
+# importada sea un acierto de caché al traducir, junto al par sin enmascarar para exportarlo.
+# Las entradas de las que solo se conoce la plantilla se exportan con cada marcador ⟦n⟧
+# como código en línea <ph>, que las herramientas CAT no traducen y que se relee como marcador.
+
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from itertools import groupby
+from pathlib import Path
+from typing import BinaryIO
+
+from lxml import etree
+
+from .classifier import MASK, SKIP
+from .extractor import LANGUAGE_NAMES_ES
+from .masking import PLACEHOLDER, PLACEHOLDER_PATTERN, mask_segment
+from .models import MemoryEntry, SegmentedPart, TranslationUnit
+
+TMX = 'tmx'
+XLIFF = 'xliff'
+FORMATS = {'.tmx': TMX, '.xlf': XLIFF, '.xliff': XLIFF}
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+XLIFF_NAMESPACE = 'urn:oasis:names:tc:xliff:document:1.2'
+# Marcas en línea cuyo contenido es código nativo y no texto (TMX y XLIFF 1.2)
+INLINE_CODE_TAGS = {'bpt', 'ept', 'ph', 'it', 'bx', 'ex', 'x', 'sc', 'ec'}
+# Unidades que se escriben entre flush del xmlfile
+FLUSH_EVERY = 1_000
+LANGUAGE_CODES = {nombre: codigo for codigo, nombre in reversed(LANGUAGE_NAMES_ES.items())}
+
+class TranslationMemoryError(ValueError):
+    """El archivo de memoria de traducción no se puede importar"""
+
+def get_format(nombre_archivo:str) -> str:
+    """Devuelve TMX o XLIFF según la extensión del archivo
+
+    Raises
+    ------
+    TranslationMemoryError
+        si la extensión no es de TMX ni de XLIFF
+    """
+    if (formato := FORMATS.get(Path(nombre_archivo).suffix.lower())) is None:
+        raise TranslationMemoryError(f"Formato no soportado: {nombre_archivo}. Usa .tmx, .xlf o .xliff")
+    return formato
+
+def get_language_name(codigo:str | None) -> str | None:
+    """Nombre en español del código de idioma del archivo (es, es-ES, fr_FR...).
+    Si no se conoce se devuelve el código tal cual.
+    """
+    if not codigo:
+        return None
+    codigo = codigo.lower().replace('_', '-')
+    return LANGUAGE_NAMES_ES.get(codigo) or LANGUAGE_NAMES_ES.get(codigo.split('-')[0]) or codigo
+
+def get_language_code(nombre:str) -> str:
+    """Código ISO 639 del idioma a partir de su nombre en español"""
+    return LANGUAGE_CODES.get(nombre, nombre)
+
+def get_memory_key(texto:str) -> tuple[str, tuple[str, ...]]:
+    """Clave de la memoria para el texto, la misma que usa el pipeline: la plantilla
+    enmascarada sin espacios en los bordes. Un texto que ya es plantilla (exportado) se deja igual.
+
+    Returns
+    -------
+    tuple[str, tuple[str, ...]]
+        clave y valores enmascarados
+    """
+    if PLACEHOLDER_PATTERN.search(texto):
+        return texto.strip(), ()
+    plantilla, valores = mask_segment(texto)
+    return plantilla.strip(), valores
+
+def to_memory_entry(origen:str, traduccion:str) -> tuple[str, str] | None:
+    """Convierte un par del archivo en una entrada de la memoria (clave, traducción).
+    Si el origen tiene entidades, la traducción debe contener los mismos valores para
+    sustituirlos por los marcadores del origen; si no, el par no se puede reutilizar.
+    Si el origen ya es una plantilla, la traducción debe llevar los mismos marcadores.
+
+    Returns
+    -------
+    tuple[str, str] | None
+        _description_
+    """
+    if not origen.strip() or not traduccion.strip():
+        return None
+    clave, valores = get_memory_key(origen)
+    if not valores:
+        # Una herramienta CAT puede haber borrado o renumerado algún <ph>
+        if Counter(PLACEHOLDER_PATTERN.findall(clave)) != Counter(PLACEHOLDER_PATTERN.findall(traduccion)):
+            return None
+        return clave, traduccion.strip()
+    plantilla_destino, valores_destino = mask_segment(traduccion)
+    # Solo si cada valor aparece una vez sabemos qué marcador le corresponde
+    if len(set(valores)) != len(valores) or sorted(valores) != sorted(valores_destino):
+        return None
+    numero = {valor: indice for indice, valor in enumerate(valores, start=1)}
+    plantilla_destino = PLACEHOLDER_PATTERN.sub(
+        lambda match: PLACEHOLDER.format(numero[valores_destino[int(match.group(1)) - 1]]), plantilla_destino)
+    return clave, plantilla_destino.strip()
+
+def get_memory_keys(partes:list[SegmentedPart]) -> set[str]:
+    """Claves de la memoria de los segmentos a traducir del documento, para cargar de la
+    memoria de traducción solo las unidades que pueden acertar.
+    """
+    claves = set()
+    for parte in partes:
+        segmentos = parte.segmentos
+        for indice in range(len(segmentos)):
+            if (etiqueta := segmentos.label(indice)) == SKIP:
+                continue
+            texto = parte.mascaras[indice].plantilla if etiqueta == MASK else segmentos.text(indice)
+            claves.add(texto.strip())
+    return claves
+
+def _local_name(elemento:etree._Element) -> str:
+    return etree.QName(elemento).localname
+
+def _segment_text(elemento:etree._Element) -> str:
+    """Texto de un seg/source/target sin el contenido de las marcas de código en línea,
+    salvo los <ph> con un marcador ⟦n⟧ que escribimos al exportar
+    """
+    partes = [elemento.text or '']
+    for hijo in elemento:
+        if not isinstance(hijo.tag, str):
+            partes.append(hijo.tail or '')
+            continue
+        if _local_name(hijo) not in INLINE_CODE_TAGS:
+            partes.append(_segment_text(hijo))
+        elif _local_name(hijo) == 'ph' and PLACEHOLDER_PATTERN.fullmatch(hijo.text or ''):
+            partes.append(hijo.text)
+        partes.append(hijo.tail or '')
+    return "".join(partes)
+
+def _set_segment_text(elemento:etree._Element, texto:str, atributo:str, ns:str='') -> None:
+    """Escribe el texto en el seg/source/target con cada marcador ⟦n⟧ como <ph>.
+    atributo es el que numera el código: x en TMX e id en XLIFF.
+    """
+    anterior, inicio = elemento, 0
+    for match in PLACEHOLDER_PATTERN.finditer(texto):
+        fragmento = texto[inicio:match.start()]
+        if anterior is elemento:
+            elemento.text = fragmento
+        else:
+            anterior.tail = fragmento
+        anterior = etree.SubElement(elemento, f'{ns}ph', {atributo: match.group(1)})
+        anterior.text = match.group()
+        inicio = match.end()
+    if anterior is elemento:
+        elemento.text = texto[inicio:]
+    else:
+        anterior.tail = texto[inicio:]
+
+def _release(elemento:etree._Element) -> None:
+    """Libera el elemento ya procesado y sus hermanos anteriores para que iterparse no acumule el árbol"""
+    elemento.clear(keep_tail=True)
+    while elemento.getprevious() is not None:
+        del elemento.getparent()[0]
+
+def iter_tmx(fuente:Path | BinaryIO, idioma_origen:str | None=None) -> Iterator[TranslationUnit]:
+    """Lee en streaming las unidades de un TMX. Cada tu produce una unidad por cada
+    idioma distinto del de origen.
+
+    Parameters
+    ----------
+    fuente : Path | BinaryIO
+        ruta o archivo abierto en binario
+    idioma_origen : str | None, optional
+        nombre en español del idioma de origen. Por defecto el srclang de la cabecera
+
+    Yields
+    ------
+    Iterator[TranslationUnit]
+        _description_
+    """
+    codigo_origen = get_language_code(idioma_origen) if idioma_origen else None
+    for evento, elemento in etree.iterparse(fuente, events=('start', 'end'), tag=('{*}header', '{*}tu'),
+                                            resolve_entities=False, huge_tree=True):
+        if _local_name(elemento) == 'header':
+            if evento == 'start' and codigo_origen is None:
+                codigo_origen = elemento.get('srclang')
+            continue
+        if evento == 'start':
+            continue
+        variantes = {}
+        for tuv in elemento:
+            if not isinstance(tuv.tag, str) or _local_name(tuv) != 'tuv':
+                continue
+            seg = next((hijo for hijo in tuv if isinstance(hijo.tag, str) and _local_name(hijo) == 'seg'), None)
+            if seg is not None:
+                variantes[(tuv.get(XML_LANG) or tuv.get('lang') or '').lower()] = _segment_text(seg)
+        # srclang puede ser '*all*' o no coincidir en mayúsculas: entonces el primer tuv es el origen
+        origen_tu = (elemento.get('srclang') if codigo_origen in (None, '*all*') else codigo_origen) or ''
+        origen_tu = origen_tu.lower()
+        if origen_tu not in variantes:
+            origen_tu = next((codigo for codigo in variantes if codigo.split('-')[0] == origen_tu.split('-')[0]),
+                                next(iter(variantes), None))
+        if origen_tu is not None:
+            for codigo, texto in variantes.items():
+                if codigo != origen_tu:
+                    yield TranslationUnit(variantes[origen_tu], texto, get_language_name(origen_tu),
+                                            get_language_name(codigo))
+        _release(elemento)
+
+def iter_xliff(fuente:Path | BinaryIO) -> Iterator[TranslationUnit]:
+    """Lee en streaming las unidades de un XLIFF 1.2 (trans-unit) o 2.x (segment).
+    Las unidades sin target se ignoran.
+
+    Parameters
+    ----------
+    fuente : Path | BinaryIO
+        ruta o archivo abierto en binario
+
+    Yields
+    ------
+    Iterator[TranslationUnit]
+        _description_
+    """
+    idioma_origen = idioma_destino = None
+    for evento, elemento in etree.iterparse(fuente, events=('start', 'end'),
+                                            tag=('{*}xliff', '{*}file', '{*}trans-unit', '{*}segment'),
+                                            resolve_entities=False, huge_tree=True):
+        nombre = _local_name(elemento)
+        if evento == 'start':
+            if nombre == 'xliff':
+                idioma_origen, idioma_destino = elemento.get('srcLang'), elemento.get('trgLang')
+            elif nombre == 'file':
+                idioma_origen = elemento.get('source-language') or idioma_origen
+                idioma_destino = elemento.get('target-language') or idioma_destino
+            continue
+        if nombre in ('xliff', 'file'):
+            continue
+        textos = {_local_name(hijo): hijo for hijo in elemento if isinstance(hijo.tag, str)}
+        if 'source' in textos and 'target' in textos:
+            yield TranslationUnit(_segment_text(textos['source']), _segment_text(textos['target']),
+                                    get_language_name(idioma_origen), get_language_name(idioma_destino))
+        _release(elemento)
+
+def iter_units(fuente:Path | BinaryIO, formato:str, idioma_origen:str | None=None) -> Iterator[TranslationUnit]:
+    """Lee en streaming las unidades del archivo TMX o XLIFF
+
+    Raises
+    ------
+    TranslationMemoryError
+        si el archivo no es xml bien formado
+    """
+    try:
+        if formato == TMX:
+            yield from iter_tmx(fuente, idioma_origen)
+        else:
+            yield from iter_xliff(fuente)
+    except etree.XMLSyntaxError as exc:
+        raise TranslationMemoryError(f"El archivo no es un {formato.upper()} válido: {exc}") from exc
+
+def iter_memory_entries(unidades:Iterable[TranslationUnit]) -> Iterator[MemoryEntry]:
+    """Convierte las unidades leídas del archivo a entradas de la memoria y descarta las no reutilizables.
+    Si la unidad no es ya una plantilla (exportada con marcadores) se guarda también el par original.
+    """
+    for unidad in unidades:
+        if unidad.idioma_origen is None or unidad.idioma_destino is None:
+            continue
+        if (entrada := to_memory_entry(unidad.origen, unidad.traduccion)) is None:
+            continue
+        if PLACEHOLDER_PATTERN.search(unidad.origen):
+            yield MemoryEntry(*entrada, unidad.idioma_origen, unidad.idioma_destino)
+        else:
+            yield MemoryEntry(*entrada, unidad.idioma_origen, unidad.idioma_destino, unidad.origen.strip(),
+                                unidad.traduccion.strip())
+
+def write_tmx(destino:Path | BinaryIO, unidades:Iterable[TranslationUnit]) -> int:
+    """Escribe las unidades en un TMX 1.4 en streaming
+
+    Parameters
+    ----------
+    destino : Path | BinaryIO
+        ruta o archivo abierto en binario
+    unidades : Iterable[TranslationUnit]
+        _description_
+
+    Returns
+    -------
+    int
+        unidades escritas
+    """
+    n = 0
+    with etree.xmlfile(destino, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('tmx', version='1.4'):
+            xf.write(etree.Element('header', creationtool='TrueForm Translator', creationtoolversion='1.0',
+                                    datatype='plaintext', segtype='sentence', adminlang='en', srclang='*all*',
+                                    **{'o-tmf': 'TrueForm'}))
+            with xf.element('body'):
+                for n, unidad in enumerate(unidades, start=1):
+                    tu = etree.Element('tu')
+                    for idioma, texto in ((unidad.idioma_origen, unidad.origen), (unidad.idioma_destino, unidad.traduccion)):
+                        tuv = etree.SubElement(tu, 'tuv', {XML_LANG: get_language_code(idioma)})
+                        _set_segment_text(etree.SubElement(tuv, 'seg'), texto, 'x')
+                    xf.write(tu)
+                    if not n % FLUSH_EVERY:
+                        xf.flush()
+    return n
+
+def write_xliff(destino:Path | BinaryIO, unidades:Iterable[TranslationUnit]) -> int:
+    """Escribe las unidades en un XLIFF 1.2 en streaming, con un file por cada grupo
+    de unidades consecutivas del mismo par de idiomas
+
+    Parameters
+    ----------
+    destino : Path | BinaryIO
+        ruta o archivo abierto en binario
+    unidades : Iterable[TranslationUnit]
+        _description_
+
+    Returns
+    -------
+    int
+        unidades escritas
+    """
+    n = 0
+    ns = f'{{{XLIFF_NAMESPACE}}}'
+    with etree.xmlfile(destino, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(f'{ns}xliff', version='1.2', nsmap={None: XLIFF_NAMESPACE}):
+            for (idioma_origen, idioma_destino), grupo in groupby(unidades, key=lambda u: (u.idioma_origen, u.idioma_destino)):
+                with xf.element(f'{ns}file', {'original': 'trueform', 'datatype': 'plaintext',
+                                                'source-language': get_language_code(idioma_origen),
+                                                'target-language': get_language_code(idioma_destino)}):
+                    with xf.element(f'{ns}body'):
+                        for unidad in grupo:
+                            n += 1
+                            trans_unit = etree.Element(f'{ns}trans-unit', id=str(n), nsmap={None: XLIFF_NAMESPACE})
+                            _set_segment_text(etree.SubElement(trans_unit, f'{ns}source'), unidad.origen, 'id', ns)
+                            _set_segment_text(etree.SubElement(trans_unit, f'{ns}target'), unidad.traduccion, 'id', ns)
+                            xf.write(trans_unit)
+                            if not n % FLUSH_EVERY:
+                                xf.flush()
+    return n
+
+def write_units(destino:Path | BinaryIO, unidades:Iterable[TranslationUnit], formato:str) -> int:
+    """Escribe las unidades en TMX o XLIFF en streaming y devuelve cuántas se han escrito"""
+    return write_tmx(destino, unidades) if formato == TMX else write_xliff(destino, unidades)
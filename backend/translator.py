@@ -14,12 +14,9 @@
 
 # Script con el código relacionado con la traducción de OpenAI
 
-from langchain_community.callbacks import get_openai_callback
+# langchain y las chains se importan al traducir y no al importar el módulo,
+# para no retrasar el arranque de la app
 
-from .chains import (get_translation_prompt_chain, 
-                        get_translation_chain, 
-                        get_translation_chain_with_memory
-                        )
 from .models import OpenAIResponse
 
 
@@ -33,6 +30,8 @@ def translate(
         texto_anterior:str,
         texto_posterior:str,
         text:str,
+        glosario:str='',
+        timeout:float | None=None,
         ) -> OpenAIResponse:
     """Ejecuta la chain de traducción y devuelve un objeto
     TranslationResponse con (texto traducido, coste)
@@ -53,14 +52,22 @@ def translate(
         _description_
     text : str
         _description_
+    glosario : str, optional
+        entradas del glosario presentes en el texto, formateadas para el prompt, by default ''
+    timeout : float | None, optional
+        segundos máximos de la petición a OpenAI, by default None
 
     Returns
     -------
     OpenAIResponse
         _description_
     """
+    from langchain_community.callbacks import get_openai_callback
+    from .chains import PromptUsageCallback, get_translation_chain_with_memory
     # Obtenemos la chain
-    chain = get_translation_chain_with_memory(apikey, model) # o get_translation_chain
+    chain = get_translation_chain_with_memory(apikey, model, timeout) # o get_translation_chain
+    # Tokens de prompt y tokens servidos desde la caché de prompts del proveedor
+    uso_prompt = PromptUsageCallback()
     with get_openai_callback() as cb:
         response = chain.invoke({
             'idioma_origen': origin_lang,
@@ -70,9 +77,11 @@ def translate(
             'texto': text,
             'texto_anterior': texto_anterior,
             'texto_posterior': texto_posterior,
-        })
+            'glosario': glosario,
+        }, config={'callbacks': [uso_prompt]})
         coste_total = cb.total_cost
-    return OpenAIResponse(response, coste_total)
+        tokens_totales = cb.total_tokens
+    return OpenAIResponse(response, coste_total, tokens_totales, uso_prompt.prompt_tokens, uso_prompt.cached_tokens)
 
 def get_translation_prompt( # ! Deprecated
         apikey:str,
@@ -106,6 +115,8 @@ def get_translation_prompt( # ! Deprecated
     OpenAIResponse
         (response, cost)
     """
+    from langchain_community.callbacks import get_openai_callback
+    from .chains import get_translation_prompt_chain
     # instanciamos la chain
     chain = get_translation_prompt_chain(apikey, model)
     # Envolvemos en context manager para sacar el coste
@@ -19,6 +19,7 @@ import os
 from pathlib import Path
 import pytz
 import random
+import re
 import string
 import time
 
@@ -29,6 +30,8 @@ PRICING_PER_TOKEN = {
     "gpt-4-32k": 0.12e-3, # 32K de contexto
     "gpt-4": 0.06e-3, 
 }
+# Caracteres no permitidos en XML 1.0 (controles salvo tabulador y saltos de línea)
+INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
 
 def get_model_version(model:str) -> str:
     """Dado un modelo de openAI, devuelve 
@@ -216,3 +219,67 @@ def wait_randomly(max:int=1):
     """
     cooldown = round(random.random(), 1) * max
     time.sleep(cooldown)
+
+def sanitize_xml_text(texto:str) -> str:
+    """Elimina del texto los caracteres que no son válidos en XML 1.0
+    y que lxml rechaza al asignarlos a un elemento
+
+    Parameters
+    ----------
+    texto : str
+        _description_
+
+    Returns
+    -------
+    str
+        _description_
+    """
+    return INVALID_XML_CHARS.sub('', texto)
+
+def format_surrounding_text(texto_anterior:str, texto_posterior:str) -> tuple[str, str]:
+    """Quita la palabra cortada de cada extremo del contexto y añade '...'"""
+    texto_anterior = "..." + " ".join(texto_anterior.split()[1:]) # Quitamos primera palabra y añadimos ...
+    texto_posterior = " ".join(texto_posterior.split()[:-1]) + "..."
+    return texto_anterior, texto_posterior
+
+def restore_edge_spaces(original:str, traduccion:str) -> str:
+    """Verifica que los espacios al principio y al final de la traducción coincidan con el texto original.
+    Si no coinciden añade los espacios pertinentes.
+
+    Parameters
+    ----------
+    original : str
+        texto original
+    traduccion : str
+        texto traducido
+
+    Returns
+    -------
+    str
+        traducción con los espacios de los extremos del original
+    """
+    if not traduccion:
+        return original
+    if original[0].isspace() and (not traduccion[0].isspace()):
+        traduccion = " " + traduccion
+    if original[-1].isspace() and (not traduccion[-1].isspace()):
+        traduccion = traduccion + " "
+    return traduccion
+
+def get_cost_for_tokens(tokens:int, model:str) -> float:
+    """Devuelve el coste estimado de los tokens con el pricing del modelo.
+    0 si el modelo no está en PRICING_PER_TOKEN
+
+    Parameters
+    ----------
+    tokens : int
+        _description_
+    model : str
+        _description_
+
+    Returns
+    -------
+    float
+        _description_
+    """
+    return tokens * PRICING_PER_TOKEN.get(model, 0)
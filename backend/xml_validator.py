@@ -14,9 +14,20 @@
 
 # Script para realizar alguna validación de archivos xml con etree de lxml
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+
 from lxml import etree
 from pathlib import Path
 
+from .profiling import profiled
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+# A partir de este tamaño total de partes se valida en paralelo
+PARALLEL_THRESHOLD_BYTES = 2_000_000
+# Contenedores en los que puede aparecer un w:t según el esquema de WordprocessingML
+TEXT_PARENTS = {f'{{{W_NAMESPACE}}}r'}
+
 def get_xml_validation_errors(path:Path) -> dict[str, str]:
     """Devuelve un dict con los archivos xml que han dado error
     y el error en cuestión. Si no hay errores devuelve un dict vacío.
@@ -38,7 +49,7 @@ def get_xml_validation_errors(path:Path) -> dict[str, str]:
                 with open(xml_file, 'rb') as f:
                     xml_doc = etree.parse(f)
             except etree.XMLSyntaxError as err_synt:
-                vals[xml_file.name] = err
+                vals[xml_file.name] = err_synt
             except Exception as err:
                 vals[xml_file.name] = err
     return vals
@@ -61,4 +72,112 @@ def all_xml_files_good(path:Path) -> tuple[bool, None] | tuple[bool, dict[str, s
     if not vals:
         return True, None
     else:
-        return False, vals
\ No newline at end of file
+        return False, vals
+
+def get_schema_errors(root:etree._Element) -> list[str]:
+    """Comprobaciones ligeras de esquema sobre los elementos que modifica
+    la traducción: los w:t deben colgar de un w:r y contener solo texto.
+
+    Parameters
+    ----------
+    root : etree._Element
+        raíz de la parte xml
+
+    Returns
+    -------
+    list[str]
+        lista de errores encontrados. Vacía si todo es correcto
+    """
+    errores = []
+    for text_elem in root.iter(f'{{{W_NAMESPACE}}}t'):
+        parent = text_elem.getparent()
+        if parent is None or parent.tag not in TEXT_PARENTS:
+            errores.append(f"w:t fuera de w:r en la línea {text_elem.sourceline}")
+        if len(text_elem):
+            errores.append(f"w:t con elementos hijos en la línea {text_elem.sourceline}")
+    return errores
+
+def validate_xml_part(contenido:bytes, validar_esquema:bool=False) -> str | None:
+    """Parsea en memoria una parte xml y devuelve el error encontrado
+    o None si es válida.
+
+    Parameters
+    ----------
+    contenido : bytes
+        bytes de la parte xml
+    validar_esquema : bool, optional
+        si True hace además las comprobaciones de get_schema_errors, by default False
+
+    Returns
+    -------
+    str | None
+        descripción del error o None
+    """
+    parser = etree.XMLParser(resolve_entities=False, huge_tree=True)
+    try:
+        root = etree.fromstring(contenido, parser)
+    except etree.XMLSyntaxError as err_synt:
+        return str(err_synt)
+    except Exception as err:
+        return str(err)
+    if validar_esquema and (errores := get_schema_errors(root)):
+        return "; ".join(errores)
+    return None
+
+def get_parts_validation_errors(
+        partes:dict[str, bytes],
+        validar_esquema:bool=False,
+        max_workers:int | None=None,
+        ) -> dict[str, str]:
+    """Valida en memoria solo las partes xml pasadas (las que se han modificado)
+    y devuelve un dict con las partes que han dado error y el error.
+    Si el tamaño total supera PARALLEL_THRESHOLD_BYTES se valida en un pool de hilos.
+
+    Parameters
+    ----------
+    partes : dict[str, bytes]
+        nombre de la parte y sus bytes
+    validar_esquema : bool, optional
+        si True hace comprobaciones de esquema sobre los w:t, by default False
+    max_workers : int | None, optional
+        número de hilos del pool, by default None (según núcleos)
+
+    Returns
+    -------
+    dict[str, str]
+        {nombre_parte: error}
+    """
+    nombres = list(partes)
+    contenidos = [partes[nombre] for nombre in nombres]
+    if len(partes) > 1 and sum(map(len, contenidos)) > PARALLEL_THRESHOLD_BYTES:
+        max_workers = max_workers or min(len(partes), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            resultados = list(pool.map(profiled(validate_xml_part), contenidos, [validar_esquema] * len(partes)))
+    else:
+        resultados = [validate_xml_part(contenido, validar_esquema) for contenido in contenidos]
+    return {nombre: error for nombre, error in zip(nombres, resultados) if error is not None}
+
+def all_xml_parts_good(
+        partes:dict[str, bytes],
+        validar_esquema:bool=False,
+        ) -> tuple[bool, None] | tuple[bool, dict[str, str]]:
+    """Devuelve True, None si todas las partes son válidas,
+    False, dict con partes y errores producidos en caso contrario
+
+    Parameters
+    ----------
+    partes : dict[str, bytes]
+        nombre de la parte y sus bytes
+    validar_esquema : bool, optional
+        si True hace comprobaciones de esquema sobre los w:t, by default False
+
+    Returns
+    -------
+    tuple[bool, None] | tuple[bool, dict[str, str]]
+        _description_
+    """
+    vals = get_parts_validation_errors(partes, validar_esquema)
+    if not vals:
+        return True, None
+    else:
+        return False, vals
@@ -0,0 +1,100 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark del clasificador y el enmascarado de entidades: comprueba una tabla de casos
+# (texto, etiqueta y plantilla esperadas), incluidos los de prosa que no se debe enmascarar,
+# y mide segmentos por segundo clasificando y enmascarando. Sale con error si falla algún caso.
+# Uso:
+#   python -m benchmarks.bench_classifier [--segments 1000000]
+
+import argparse
+from itertools import cycle, islice
+import json
+from pathlib import Path
+import sys
+import time
+
+from backend.classifier import MASK, SKIP, TRANSLATE, classify_segment
+from backend.masking import mask_segment
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+# (texto, etiqueta esperada, plantilla esperada)
+CASES = [
+    ('El cliente y/o el proveedor firmarán el contrato', TRANSLATE, 'El cliente y/o el proveedor firmarán el contrato'),
+    ('Input/output devices are listed below', TRANSLATE, 'Input/output devices are listed below'),
+    ('120 km/h en autopista', MASK, '⟦1⟧ km/h en autopista'),
+    ('Copia el archivo en /usr/local/share/trueform', MASK, 'Copia el archivo en ⟦1⟧'),
+    ('Guardado en C:\\Datos\\Informes', MASK, 'Guardado en ⟦1⟧'),
+    ('Ver ~/proyectos/trueform y ./build/salida', MASK, 'Ver ⟦1⟧ y ⟦2⟧'),
+    ('/usr/local/bin', SKIP, '⟦1⟧'),
+    ('Factura 2024-0173 con vencimiento 15/03/2024', MASK, 'Factura ⟦1⟧ con vencimiento ⟦2⟧'),
+    ('https://www.example.com/docs', SKIP, '⟦1⟧'),
+    ('I am here', TRANSLATE, 'I am here'),
+    ('MI CASA', TRANSLATE, 'MI CASA'),
+    ('MIX', TRANSLATE, 'MIX'),
+    ('VI', TRANSLATE, 'VI'),
+    ('Capítulo IV', MASK, 'Capítulo ⟦1⟧'),
+    ('En el siglo XXI', MASK, 'En el siglo ⟦1⟧'),
+    ('II) Objeto del contrato', MASK, '⟦1⟧) Objeto del contrato'),
+    ('Ver EN-ISO;9001', MASK, 'Ver EN-ISO;⟦1⟧'),
+    ('3.1.2', SKIP, '⟦1⟧'),
+    ('1.2.3 Scope', MASK, '⟦1⟧ Scope'),
+    ('Section 4.2.1 applies', MASK, 'Section ⟦1⟧ applies'),
+    ('Importe de 1.234,56 kg', MASK, 'Importe de ⟦1⟧ kg'),
+]
+
+def check_cases() -> list[dict]:
+    """Devuelve los casos que no dan la etiqueta o la plantilla esperadas"""
+    fallos = []
+    for texto, etiqueta, plantilla in CASES:
+        obtenida, (obtenida_plantilla, _) = classify_segment(texto), mask_segment(texto)
+        if obtenida != etiqueta or obtenida_plantilla != plantilla:
+            fallos.append({'texto': texto, 'etiqueta': obtenida, 'esperada': etiqueta,
+                            'plantilla': obtenida_plantilla, 'plantilla_esperada': plantilla})
+    return fallos
+
+def measure(num_segmentos:int) -> dict:
+    textos = list(islice(cycle(texto for texto, _, _ in CASES), num_segmentos))
+    start = time.perf_counter()
+    for texto in textos:
+        classify_segment(texto)
+    clasificar = time.perf_counter() - start
+    start = time.perf_counter()
+    for texto in textos:
+        mask_segment(texto)
+    enmascarar = time.perf_counter() - start
+    return {'classify_per_second': num_segmentos / clasificar, 'mask_per_second': num_segmentos / enmascarar}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Casos y throughput del clasificador y el enmascarado")
+    parser.add_argument('--segments', type=int, default=1_000_000)
+    args = parser.parse_args()
+    fallos = check_cases()
+    for fallo in fallos:
+        print(f"FALLO {fallo['texto']!r}: {fallo['etiqueta']} {fallo['plantilla']!r} "
+                f"(esperado {fallo['esperada']} {fallo['plantilla_esperada']!r})")
+    print(f"Casos correctos: {len(CASES) - len(fallos)} de {len(CASES)}")
+    resultado = measure(args.segments)
+    print(f"Clasificar {resultado['classify_per_second']:,.0f} segmentos/s | "
+            f"enmascarar {resultado['mask_per_second']:,.0f} segmentos/s")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"classifier_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'failures': fallos, 'results': resultado}, indent=2,
+                                ensure_ascii=False), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+    if fallos:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de la latencia de cola con y sin hedging: traduce un docx sintético con
+# translator.translate y el backend 'fake' de chains.get_llm, con latencia de cola pesada
+# (una fracción de llamadas se queda colgada varios segundos), y reporta p50/p99 de latencia
+# por segmento, tiempo total del trabajo, llamadas duplicadas, coste extra de las llamadas
+# descartadas y segmentos que se quedan sin traducir porque ni reintentando responden en el plazo.
+# Uso:
+#   python -m benchmarks.bench_hedging [--paragraphs 300] [--llm-latency lognormal:0.02,0.3]
+#                                      [--stall-rate 0.02] [--stall-seconds 2] [--deadline 30]
+
+import argparse
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+import zipfile
+
+from backend import events
+from backend.events import EventBus
+from backend.extractor import get_text_from_docx
+from backend.hedging import Hedger
+from backend.llm_backends import reset_fake_generators
+from backend.metrics import JobMetrics
+from backend.models import Evento
+from backend.pipeline import extract_translate_replace
+from backend.translator import translate
+from backend.utils import get_to_extract_list
+from benchmarks.load_test import percentile
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+MODEL = 'gpt-3.5-turbo'
+
+def run_job(docx:bytes, translate_fn, hedger:Hedger | None) -> dict:
+    """Traduce el docx y devuelve latencias por segmento, tiempo total y coste"""
+    docx_text = get_text_from_docx(BytesIO(docx))
+    metricas = JobMetrics('bench_hedging')
+    latencias = []
+
+    def on_segment(evento:Evento) -> None:
+        if evento.datos['origen'] == 'llm':
+            latencias.append(evento.datos['latencia'])
+
+    bus = EventBus()
+    bus.subscribe(metricas.on_event)
+    bus.subscribe(on_segment, [events.SEGMENTO_FINALIZADO])
+    with tempfile.TemporaryDirectory() as carpeta:
+        xml_folder = Path(carpeta)
+        with zipfile.ZipFile(BytesIO(docx)) as zip_ref:
+            zip_ref.extractall(xml_folder)
+        start = time.perf_counter()
+        extract_translate_replace(
+            apikey='', model=MODEL, document_words=len(docx_text.split()),
+            filename='benchmark', to_extract_list=get_to_extract_list(xml_folder / 'word'),
+            chain_params={'origin_lang': 'Español', 'destiny_lang': 'Francés',
+                            'doc_features': 'un contrato', 'doc_context': 'Legal'},
+            diccionario={}, bus=bus, xml_folder=xml_folder, translate_fn=translate_fn,
+            max_cooldown=0, hedger=hedger)
+        segundos = time.perf_counter() - start
+    return {
+        'seconds': segundos,
+        'segments': len(latencias),
+        'p50': percentile(latencias, 50),
+        'p99': percentile(latencias, 99),
+        'max': max(latencias),
+        'cost_dollars': metricas.get_counter('cost_dollars_total'),
+        'hedged_calls': metricas.get_counter('hedged_calls_total'),
+        'discarded_cost_dollars': metricas.get_counter('hedge_discarded_cost_dollars_total'),
+        'untranslated': metricas.get_counter('segments_total', origen='sin_traducir'),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia de cola con y sin hedging")
+    parser.add_argument('--paragraphs', type=int, default=300)
+    parser.add_argument('--llm-latency', default='lognormal:0.02,0.3', help="Distribución de latencia del LLM falso")
+    parser.add_argument('--stall-rate', type=float, default=0.02, help="Proporción de llamadas que se quedan colgadas")
+    parser.add_argument('--stall-seconds', type=float, default=2.0, help="Segundos extra de las llamadas colgadas")
+    parser.add_argument('--deadline', type=float, default=30.0, help="Plazo por llamada en segundos")
+    args = parser.parse_args()
+    os.environ['TRUEFORM_LLM_BACKEND'] = 'fake'
+    os.environ['TRUEFORM_FAKE_LATENCY'] = args.llm_latency
+    os.environ['TRUEFORM_FAKE_STALL_RATE'] = str(args.stall_rate)
+    os.environ['TRUEFORM_FAKE_STALL_SECONDS'] = str(args.stall_seconds)
+    # Sin repetidos: cada segmento pasa por el LLM
+    docx = build_synthetic_docx(SyntheticDocxConfig(num_parrafos=args.paragraphs, ratio_repetido=0.0))
+    resultados = {}
+    for modo, hedging in (('off', False), ('on', True)):
+        # Los dos modos parten de la misma secuencia de sorteos
+        reset_fake_generators()
+        resultados[modo] = resultado = run_job(docx, translate, Hedger(args.deadline, hedging))
+        print(f"hedging {modo:>3} | {resultado['segments']} segmentos en {resultado['seconds']:6.2f}s | "
+                f"p50 {resultado['p50']:.3f}s p99 {resultado['p99']:.3f}s máx {resultado['max']:.3f}s | "
+                f"duplicadas {resultado['hedged_calls']:.0f} | coste {resultado['cost_dollars']:.4f} $ "
+                f"(descartadas {resultado['discarded_cost_dollars']:.4f} $) | sin traducir {resultado['untranslated']:.0f}")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"hedging_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'results': resultados}, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark del arranque en frío: importa un módulo (por defecto app) en un intérprete
+# nuevo con `python -X importtime`, agrupa el coste por paquete de primer nivel y lista
+# los módulos más lentos. Guarda los resultados en benchmarks/results/importtime_<fecha>_<commit>.json
+# Uso:
+#   python -m benchmarks.bench_import_time [--module app] [--repeat 3] [--top 20]
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+import json
+from pathlib import Path
+import re
+import subprocess
+import sys
+
+# Sin imports del proyecto: el propio benchmark no debe cargar lo que mide
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+# import time:       self [us] |   cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+def measure_imports(modulo:str) -> tuple[float, list[dict]]:
+    """Importa el módulo en un intérprete nuevo con -X importtime
+
+    Parameters
+    ----------
+    modulo : str
+        módulo a importar
+
+    Returns
+    -------
+    tuple[float, list[dict]]
+        segundos totales de pared y una entrada por módulo importado
+        con su tiempo propio, acumulado y profundidad en el árbol de imports
+    """
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+                                capture_output=True, text=True)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"No se ha podido importar {modulo}:\n{proceso.stderr[-2000:]}")
+    modulos = []
+    for linea in proceso.stderr.splitlines():
+        if (match := IMPORTTIME_LINE.match(linea)) is None:
+            continue
+        propio, acumulado, sangria, nombre = match.groups()
+        modulos.append({'module': nombre, 'self_us': int(propio), 'cumulative_us': int(acumulado),
+                        'depth': len(sangria) // 2})
+    # Los imports de primer nivel (profundidad 0) suman el total
+    total = sum(m['cumulative_us'] for m in modulos if m['depth'] == 0) / 1e6
+    return total, modulos
+
+def group_by_package(modulos:list[dict]) -> dict[str, float]:
+    """Suma el tiempo propio de cada módulo en su paquete de primer nivel, en segundos"""
+    paquetes = defaultdict(float)
+    for modulo in modulos:
+        paquetes[modulo['module'].split('.')[0]] += modulo['self_us'] / 1e6
+    return dict(sorted(paquetes.items(), key=lambda item: item[1], reverse=True))
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste de importación en frío por módulo")
+    parser.add_argument('--module', default='app', help="Módulo a importar, by default app")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones; se guarda la más rápida")
+    parser.add_argument('--top', type=int, default=20, help="Paquetes y módulos a mostrar")
+    args = parser.parse_args()
+    total, modulos = min((measure_imports(args.module) for _ in range(args.repeat)), key=lambda medida: medida[0])
+    paquetes = group_by_package(modulos)
+    print(f"import {args.module}: {total:.3f} s, {len(modulos):,} módulos")
+    print("\nPaquetes (tiempo propio acumulado):")
+    for paquete, segundos in list(paquetes.items())[:args.top]:
+        print(f"  {paquete:<32} {segundos * 1e3:9.1f} ms")
+    print("\nMódulos más lentos (acumulado):")
+    for modulo in sorted(modulos, key=lambda m: m['cumulative_us'], reverse=True)[:args.top]:
+        print(f"  {modulo['module']:<48} {modulo['cumulative_us'] / 1e3:9.1f} ms")
+    commit = get_commit()
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"importtime_{datetime.now():%Y%m%d-%H%M%S}_{commit}.json"
+    ruta.write_text(json.dumps({
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'module': args.module,
+        'total_seconds': total,
+        'packages_seconds': paquetes,
+        'modules': modulos,
+    }, indent=2), encoding='utf-8')
+    print(f"\nResultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
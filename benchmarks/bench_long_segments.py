@@ -0,0 +1,123 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de los segmentos largos: traduce segmentos de cientos a miles de palabras con un
+# LLM falso con el límite de contexto de gpt-3.5-turbo (4K tokens entre prompt y respuesta,
+# la respuesta se trunca y un prompt que no cabe falla) y latencia proporcional a los tokens
+# generados. Compara una sola llamada por segmento con la división en frases traducidas en
+# paralelo: tiempo, llamadas, palabras devueltas y si se conservan los espacios originales.
+# Uso:
+#   python -m benchmarks.bench_long_segments [--words 500 1500 3000 6000] [--max-tokens 1000]
+
+import argparse
+import json
+from pathlib import Path
+import random
+import re
+import threading
+import time
+
+from backend.models import OpenAIResponse
+from backend.pipeline import translate_pieces
+from backend.utils import convert_words_to_tokens, get_cost_for_tokens
+from benchmarks.synthetic_docx import PALABRAS
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+MODEL = 'gpt-3.5-turbo'
+CONTEXT_TOKENS = 4_096
+# Tokens del prompt de sistema, el contexto y el glosario
+PROMPT_TOKENS = 300
+SEPARATORS = (' ', ' ', ' ', '  ', '\n', '\t')
+
+class ContextLengthExceeded(Exception):
+    """El prompt no cabe en el contexto del modelo"""
+
+def build_long_segment(palabras:int, seed:int=0) -> str:
+    """Segmento tipo anexo legal: frases de 10 a 40 palabras separadas por espacios variados"""
+    rng, frases, total = random.Random(seed), [], 0
+    while total < palabras:
+        n = min(rng.randint(10, 40), palabras - total)
+        frase = " ".join(rng.choices(PALABRAS, k=n)).capitalize()
+        frases.append(frase + rng.choice(('.', '.', ';', '.')) + rng.choice(SEPARATORS))
+        total += n
+    return " " + "".join(frases)
+
+def get_limited_translate(segundos_por_token:float, segundos_base:float):
+    """Traductor falso con el límite de contexto y latencia proporcional a la respuesta"""
+    llamadas, lock = [], threading.Lock()
+    def fake_translate(texto:str) -> OpenAIResponse:
+        tokens_entrada = convert_words_to_tokens(len(texto.split())) + PROMPT_TOKENS
+        if tokens_entrada >= CONTEXT_TOKENS:
+            raise ContextLengthExceeded(f"{tokens_entrada} tokens")
+        # La traducción ocupa lo mismo que el original: lo que no cabe se trunca
+        palabras_salida = int((CONTEXT_TOKENS - tokens_entrada) * 0.75)
+        partes = re.split(r'(\s+)', texto)
+        salida, palabras = [], 0
+        for parte in partes:
+            if parte and not parte.isspace():
+                palabras += 1
+                if palabras > palabras_salida:
+                    break
+            salida.append(parte.upper())
+        respuesta = "".join(salida)
+        tokens_salida = convert_words_to_tokens(min(palabras, palabras_salida))
+        time.sleep(segundos_base + segundos_por_token * tokens_salida)
+        with lock:
+            llamadas.append(tokens_entrada)
+        tokens = tokens_entrada + tokens_salida
+        return OpenAIResponse(respuesta, get_cost_for_tokens(tokens, MODEL), tokens)
+    return fake_translate, llamadas
+
+def run(texto:str, max_tokens:int, segundos_por_token:float, segundos_base:float) -> dict:
+    fake_translate, llamadas = get_limited_translate(segundos_por_token, segundos_base)
+    start = time.perf_counter()
+    try:
+        response, _, _, trozos = translate_pieces(texto, max_tokens, {'texto_anterior': '...', 'texto_posterior': '...'},
+                                                    lambda trozo, params: (fake_translate(trozo), False, 0.0))
+    except ContextLengthExceeded as exc:
+        return {'seconds': time.perf_counter() - start, 'calls': len(llamadas), 'error': str(exc)}
+    return {
+        'seconds': time.perf_counter() - start,
+        'calls': len(llamadas),
+        'pieces': trozos,
+        'words_returned': len(response.response.split()) / len(texto.split()),
+        'whitespace_preserved': re.findall(r'\s+', response.response) == re.findall(r'\s+', texto),
+        'cost_dollars': response.total_cost,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Segmentos largos: una llamada frente a trozos en paralelo")
+    parser.add_argument('--words', type=int, nargs='+', default=[500, 1_500, 3_000, 6_000])
+    parser.add_argument('--max-tokens', type=int, default=1_000, help="Presupuesto de tokens por trozo")
+    parser.add_argument('--seconds-per-token', type=float, default=0.002, help="Latencia de generación del LLM falso")
+    parser.add_argument('--base-seconds', type=float, default=0.2)
+    args = parser.parse_args()
+    resultados = {}
+    for palabras in args.words:
+        texto = build_long_segment(palabras)
+        for modo, max_tokens in (('single', 10**9), ('split', args.max_tokens)):
+            resultados[f"{palabras}_{modo}"] = resultado = run(texto, max_tokens, args.seconds_per_token, args.base_seconds)
+            if 'error' in resultado:
+                detalle = f"error: contexto excedido ({resultado['error']})"
+            else:
+                detalle = (f"{resultado['pieces']:>2} trozos | palabras devueltas {resultado['words_returned']:6.1%} | "
+                            f"espacios conservados {resultado['whitespace_preserved']}")
+            print(f"{palabras:>6,} palabras {modo:<6} | {resultado['seconds']:6.2f}s | {resultado['calls']:>2} llamadas | {detalle}")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"long_segments_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'results': resultados}, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de la normalización de runs: elementos, w:t (segmentos) y tamaño del xml antes
+# y después de normalize_tree, con la comprobación de que el texto de cada párrafo no cambia
+# y de que el xml resultante es válido. Acepta un docx real o genera uno sintético con ruido de Word.
+# Uso:
+#   python -m benchmarks.bench_normalization [--docx documento.docx] [--paragraphs 2000] [--noise 0.3]
+
+import argparse
+import json
+from pathlib import Path
+import time
+
+from backend.extractor import NAMESPACES, parse_xml, read_parts_from_docx, serialize_tree
+from backend.normalizer import normalize_tree
+from backend.xml_validator import all_xml_parts_good
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+
+def get_paragraph_texts(tree) -> list[str]:
+    """Texto de cada w:p: lo que se ve del documento"""
+    return ["".join(texto.text or '' for texto in parrafo.iter(f"{{{NAMESPACES['w']}}}t"))
+            for parrafo in tree.iter(f"{{{NAMESPACES['w']}}}p")]
+
+def normalize_part(xml:bytes) -> dict:
+    tree = parse_xml(xml)
+    textos = get_paragraph_texts(tree)
+    start = time.perf_counter()
+    estadisticas = normalize_tree(tree)
+    segundos = time.perf_counter() - start
+    normalizado = serialize_tree(tree)
+    return {
+        **estadisticas._asdict(),
+        'bytes_antes': len(xml),
+        'bytes_despues': len(normalizado),
+        'seconds': segundos,
+        'texto_identico': get_paragraph_texts(tree) == textos,
+        'xml': normalizado,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Elementos, segmentos y tamaño antes y después de normalizar")
+    parser.add_argument('--docx', type=Path, help="docx a normalizar; si no se pasa se genera uno sintético")
+    parser.add_argument('--paragraphs', type=int, default=2_000)
+    parser.add_argument('--noise', type=float, default=0.3, help="Proporción de runs con ruido de Word en el sintético")
+    args = parser.parse_args()
+    if args.docx is not None:
+        documento = args.docx.read_bytes()
+    else:
+        documento = build_synthetic_docx(SyntheticDocxConfig(num_parrafos=args.paragraphs, ratio_ruido=args.noise,
+                                                                num_imagenes=0))
+    resultados, partes = {}, {}
+    for nombre, xml in read_parts_from_docx(documento).items():
+        resultado = normalize_part(xml)
+        partes[nombre] = resultado.pop('xml')
+        resultados[nombre] = resultado
+        print(f"{nombre:<20} elementos {resultado['elementos_antes']:>9,} -> {resultado['elementos_despues']:<9,} | "
+                f"w:t {resultado['textos_antes']:>8,} -> {resultado['textos_despues']:<8,} | "
+                f"{resultado['bytes_antes'] / 1e3:9.1f} -> {resultado['bytes_despues'] / 1e3:<9.1f} KB | "
+                f"{resultado['seconds']:.3f}s | texto idéntico {resultado['texto_identico']}")
+    xml_ok, errores = all_xml_parts_good(partes, True)
+    print(f"xml válido: {xml_ok}" + (f" {errores}" if errores else ""))
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"normalization_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': {**vars(args), 'docx': str(args.docx)}, 'xml_ok': xml_ok, 'parts': resultados},
+                                indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de la retraducción incremental: traduce un docx sintético (v1), genera una v2
+# con unos pocos párrafos editados e insertados y la traduce desde cero y reutilizando la
+# revisión de la v1. Reporta llamadas al LLM, coste, párrafos reutilizados y ahorro, y
+# comprueba que el resultado es el mismo que traduciendo desde cero. También vuelve a
+# traducir la v1 sin cambios, en la que todos los párrafos se reutilizan.
+# Uso:
+#   python -m benchmarks.bench_revisions [--paragraphs 1000] [--edited 20] [--inserted 5]
+
+import argparse
+import copy
+import json
+from pathlib import Path
+import random
+import time
+
+from backend.events import EventBus
+from backend.extractor import NAMESPACES, PARAGRAPH_TAG, parse_xml, read_parts_from_docx, serialize_tree
+from backend.metrics import JobMetrics
+from backend.models import OpenAIResponse, TranslationResult
+from backend.pipeline import extract_translate_replace, segment_part
+from backend.revisions import build_revision_record, match_revision
+from backend.utils import convert_words_to_tokens, get_cost_for_tokens
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+MODEL = 'gpt-3.5-turbo'
+DOCUMENT_PART = 'word/document.xml'
+TEXT_TAG = f"{{{NAMESPACES['w']}}}t"
+
+def fake_translate(apikey:str, model:str, text:str, texto_anterior:str, texto_posterior:str,
+                    **chain_params) -> OpenAIResponse:
+    """Traductor falso determinista que cobra los tokens con el pricing del modelo.
+    Pide el contexto como la chain real para detectar llamadas sin él.
+    """
+    tokens = convert_words_to_tokens(len(text.split()))
+    return OpenAIResponse(text.upper(), get_cost_for_tokens(tokens, model), tokens)
+
+def revise_document(partes:dict[str, bytes], editados:int, insertados:int, seed:int=0) -> dict[str, bytes]:
+    """Nueva versión del documento: cambia el primer w:t de editados párrafos e inserta
+    insertados párrafos nuevos en posiciones aleatorias del document.xml
+    """
+    rng = random.Random(seed)
+    tree = parse_xml(partes[DOCUMENT_PART])
+    parrafos = [parrafo for parrafo in tree.iter(PARAGRAPH_TAG) if next(parrafo.iter(TEXT_TAG), None) is not None]
+    for indice, parrafo in enumerate(rng.sample(parrafos, editados)):
+        texto = next(parrafo.iter(TEXT_TAG))
+        texto.text = f"cláusula modificada {indice} " + (texto.text or '')
+    for indice, parrafo in enumerate(rng.sample(parrafos, insertados)):
+        nuevo = copy.deepcopy(parrafo)
+        for texto in nuevo.iter(TEXT_TAG):
+            texto.text = f"cláusula nueva {indice} " + (texto.text or '')
+        parrafo.addnext(nuevo)
+    return {**partes, DOCUMENT_PART: serialize_tree(tree)}
+
+def translate(partes:dict[str, bytes], revision:dict | None=None) -> tuple[dict, TranslationResult, list]:
+    """Segmenta y traduce las partes. Devuelve las métricas, el resultado de la traducción y las partes segmentadas"""
+    segmentadas = [segment_part(nombre, contenido, parte_id) for parte_id, (nombre, contenido) in enumerate(partes.items())]
+    coincidencia = match_revision(segmentadas, revision) if revision is not None else None
+    metricas = JobMetrics('bench_revisions')
+    bus = EventBus()
+    bus.subscribe(metricas.on_event)
+    start = time.perf_counter()
+    resultado = extract_translate_replace(
+        apikey='', model=MODEL, document_words=10**9, filename='benchmark',
+        chain_params={'origin_lang': 'Español', 'destiny_lang': 'Francés',
+                        'doc_features': 'un contrato', 'doc_context': 'Legal'},
+        diccionario={}, bus=bus, partes=segmentadas, translate_fn=fake_translate, max_cooldown=0,
+        revision=coincidencia.traducciones if coincidencia is not None else None)
+    resumen = {
+        'seconds': time.perf_counter() - start,
+        'llm_calls': metricas.get_counter('segments_total', origen='llm'),
+        'cost_dollars': metricas.get_counter('cost_dollars_total'),
+        'reused_segments': metricas.get_counter('segments_total', origen='revision'),
+        'reuse_ratio': metricas.revision_reuse_ratio(),
+        'saved_dollars': metricas.get_counter('revision_savings_dollars_total'),
+    }
+    if coincidencia is not None:
+        resumen['reused_paragraphs'] = coincidencia.parrafos_reutilizados
+        resumen['paragraphs'] = coincidencia.parrafos
+    return resumen, resultado, segmentadas
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Retraducción incremental de una nueva versión de un documento")
+    parser.add_argument('--paragraphs', type=int, default=1_000)
+    parser.add_argument('--edited', type=int, default=20, help="Párrafos editados en la v2")
+    parser.add_argument('--inserted', type=int, default=5, help="Párrafos nuevos en la v2")
+    args = parser.parse_args()
+    # Sin repetidos para que la caché de traducciones no se mezcle con la reutilización
+    v1 = read_parts_from_docx(build_synthetic_docx(SyntheticDocxConfig(num_parrafos=args.paragraphs, ratio_repetido=0.0,
+                                                                        num_imagenes=0)))
+    v2 = revise_document(v1, args.edited, args.inserted)
+    resultados = {}
+    resultados['v1'], traducido_v1, segmentadas_v1 = translate(v1)
+    registro = build_revision_record(segmentadas_v1, traducido_v1.traducciones, traducido_v1.sin_traducir)
+    resultados['v2_full'], traducido_completo, _ = translate(v2)
+    resultados['v2_incremental'], traducido_incremental, _ = translate(v2, registro)
+    # La misma versión otra vez: todo se reutiliza y solo se traduce el nombre del archivo
+    resultados['v1_unchanged'], _, _ = translate(v1, registro)
+    identico = traducido_completo.partes_modificadas == traducido_incremental.partes_modificadas
+    for nombre, resultado in resultados.items():
+        print(f"{nombre:<15} llamadas {resultado['llm_calls']:>6,.0f} | coste {resultado['cost_dollars']:.4f} $ | "
+                f"reutilizados {resultado['reused_segments']:>6,.0f} ({resultado['reuse_ratio']:.1%}) | "
+                f"ahorro {resultado['saved_dollars']:.4f} $ | {resultado['seconds']:.2f}s")
+    incremental = resultados['v2_incremental']
+    print(f"Párrafos reutilizados: {incremental['reused_paragraphs']:,} de {incremental['paragraphs']:,} | "
+            f"resultado idéntico a traducir desde cero: {identico}")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"revisions_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'identical': identico, 'results': resultados}, indent=2),
+                    encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
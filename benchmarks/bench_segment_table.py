@@ -0,0 +1,94 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de memoria por segmento: compara la lista de tuplas (elemento, texto) con
+# etiquetas y MaskedSegment por run (la representación anterior) con la SegmentTable
+# en un docx sintético de un millón de runs. Mide con tracemalloc la memoria de Python
+# que queda retenida (el árbol de libxml2 es el mismo en ambos casos y no se cuenta).
+# El tiempo se mide en otra ejecución sin tracemalloc, que lo infla.
+# Uso:
+#   python -m benchmarks.bench_segment_table [--runs 1000000] [--runs-per-paragraph 5]
+
+import argparse
+from io import BytesIO
+import json
+from pathlib import Path
+import time
+import tracemalloc
+import zipfile
+
+from backend.classifier import MASK, classify_segments
+from backend.extractor import get_text_elements, parse_xml
+from backend.masking import mask_segment
+from backend.models import MaskedSegment
+from backend.pipeline import segment_part
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+
+def build_tuples(document_xml:bytes) -> tuple:
+    """Representación anterior: tuplas (elemento, texto), etiquetas y un MaskedSegment por segmento"""
+    tree = parse_xml(document_xml)
+    text_elements = [(elemento, elemento.text) for elemento in get_text_elements(tree)]
+    etiquetas, _ = classify_segments(text for _, text in text_elements)
+    mascaras = [mask_segment(text) if etiqueta == MASK else MaskedSegment(text, ())
+                for (_, text), etiqueta in zip(text_elements, etiquetas)]
+    return tree, text_elements, etiquetas, mascaras
+
+def measure(funcion, *args) -> tuple[object, int, int, float]:
+    """Devuelve el resultado, los bytes retenidos, el pico y los segundos de funcion(*args).
+    Los segundos son de una primera ejecución sin tracemalloc.
+    """
+    start = time.perf_counter()
+    funcion(*args)
+    segundos = time.perf_counter() - start
+    tracemalloc.start()
+    resultado = funcion(*args)
+    retenidos, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, retenidos, pico, segundos
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memoria por segmento: tuplas frente a SegmentTable")
+    parser.add_argument('--runs', type=int, default=1_000_000, help="Runs (segmentos) del documento sintético")
+    parser.add_argument('--runs-per-paragraph', type=int, default=5)
+    args = parser.parse_args()
+    config = SyntheticDocxConfig(num_parrafos=args.runs // args.runs_per_paragraph, runs_por_parrafo=args.runs_per_paragraph,
+                                    num_tablas=0, num_headers=0, num_footers=0, num_imagenes=0)
+    with zipfile.ZipFile(BytesIO(build_synthetic_docx(config))) as zip_ref:
+        document_xml = zip_ref.read('word/document.xml')
+    resultados = {}
+    # Medimos de una en una y soltamos el resultado para que no se sumen
+    (_, text_elements, _, _), retenidos, pico, segundos = measure(build_tuples, document_xml)
+    n_segmentos = len(text_elements)
+    resultados['tuples'] = {'retained_bytes': retenidos, 'peak_bytes': pico, 'seconds': segundos}
+    del text_elements
+    # Sin normalizar, para comparar el mismo número de segmentos
+    parte, retenidos, pico, segundos = measure(segment_part, 'word/document.xml', document_xml, 0, False)
+    resultados['segment_table'] = {'retained_bytes': retenidos, 'peak_bytes': pico, 'seconds': segundos,
+                                    'table_nbytes': parte.segmentos.nbytes(), 'masked_segments': len(parte.mascaras)}
+    del parte
+    print(f"{n_segmentos:,} segmentos")
+    for nombre, resultado in resultados.items():
+        resultado['retained_bytes_per_segment'] = resultado['retained_bytes'] / n_segmentos
+        print(f"  {nombre:<14} {resultado['retained_bytes_per_segment']:8.1f} B/segmento retenidos | "
+                f"pico {resultado['peak_bytes'] / 1e6:8.1f} MB | {resultado['seconds']:6.2f}s")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"segment_table_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'segments': n_segmentos, 'results': resultados}, indent=2),
+                    encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
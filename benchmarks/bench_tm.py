@@ -0,0 +1,111 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark de la importación y exportación de memorias de traducción: genera un TMX
+# sintético de N unidades y mide en unidades por segundo la lectura en streaming, la
+# importación por lotes en la memoria (sustituto de Mongo en memoria) y la exportación a
+# TMX y XLIFF. El pico de memoria de la lectura no debe crecer con el tamaño del archivo.
+# Comprueba también que reimportar el archivo no duplica unidades y que la exportación
+# devuelve los textos originales (y las plantillas con sus marcadores como <ph>).
+# Uso:
+#   python -m benchmarks.bench_tm [--units 200000] [--batch 1000]
+
+import argparse
+from collections.abc import Iterator
+import json
+from pathlib import Path
+import random
+import tempfile
+import time
+import tracemalloc
+
+from backend.db import TranslationMemoryDBHandler
+from backend.models import MemoryEntry, TranslationUnit
+from backend.tm import TMX, XLIFF, iter_memory_entries, iter_units, write_tmx, write_units
+from benchmarks.mongo_standin import InMemoryMongoClient
+from benchmarks.synthetic_docx import PALABRAS
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+CLAVE = 'bench'
+# Entrada aprendida en un trabajo, de la que solo se conoce la plantilla
+TEMPLATE_ENTRY = MemoryEntry('Factura ⟦1⟧ con vencimiento ⟦2⟧', 'Facture ⟦1⟧ échéance ⟦2⟧', 'Español', 'Francés')
+
+def iter_synthetic_units(n:int, seed:int=0) -> Iterator[TranslationUnit]:
+    """Unidades español-francés con un 20% de segmentos con números o fechas"""
+    rng = random.Random(seed)
+    for indice in range(n):
+        texto = " ".join(rng.choices(PALABRAS, k=rng.randint(3, 20)))
+        if rng.random() < 0.2:
+            texto = f"{texto} {indice} del {rng.randint(1, 28)}/03/2024"
+        yield TranslationUnit(texto, texto.upper(), 'Español', 'Francés')
+
+def throughput(n:int, segundos:float) -> dict:
+    return {'units': n, 'seconds': segundos, 'units_per_second': n / segundos if segundos else 0}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Unidades por segundo de la importación y exportación de TMX y XLIFF")
+    parser.add_argument('--units', type=int, default=200_000)
+    parser.add_argument('--batch', type=int, default=1_000, help="Documentos por insert_many")
+    args = parser.parse_args()
+    resultados = {}
+    with tempfile.TemporaryDirectory() as carpeta:
+        origen = Path(carpeta) / 'memoria.tmx'
+        write_tmx(origen, iter_synthetic_units(args.units))
+        resultados['tmx_bytes'] = origen.stat().st_size
+        # 1. Lectura en streaming y conversión a entradas de la memoria
+        start = time.perf_counter()
+        n = sum(1 for _ in iter_memory_entries(iter_units(origen, TMX)))
+        resultados['parse'] = throughput(n, time.perf_counter() - start)
+        tracemalloc.start()
+        for _ in iter_memory_entries(iter_units(origen, TMX)):
+            pass
+        resultados['parse']['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # 2. Importación por lotes
+        memoria = TranslationMemoryDBHandler(client=InMemoryMongoClient())
+        start = time.perf_counter()
+        n = memoria.insert_units(CLAVE, iter_memory_entries(iter_units(origen, TMX)), args.batch)
+        resultados['import'] = throughput(n, time.perf_counter() - start)
+        # Reimportar el mismo archivo sustituye las unidades en vez de duplicarlas
+        documentos = len(memoria.conn.documents)
+        memoria.insert_units(CLAVE, iter_memory_entries(iter_units(origen, TMX)), args.batch)
+        resultados['import']['reimport_duplicates'] = len(memoria.conn.documents) - documentos
+        memoria.insert_units(CLAVE, [TEMPLATE_ENTRY])
+        esperadas = {*iter_synthetic_units(args.units),
+                        TranslationUnit(TEMPLATE_ENTRY.origen, TEMPLATE_ENTRY.traduccion, 'Español', 'Francés')}
+        # 3. Exportación en streaming a cada formato y relectura
+        for formato in (TMX, XLIFF):
+            destino = Path(carpeta) / f'exportada.{formato}'
+            start = time.perf_counter()
+            n = write_units(destino, memoria.iter_units(CLAVE), formato)
+            resultados[f'export_{formato}'] = throughput(n, time.perf_counter() - start)
+            resultados[f'export_{formato}']['roundtrip_units'] = sum(1 for _ in iter_memory_entries(iter_units(destino, formato)))
+            # Las unidades con la misma plantilla comparten entrada: cada exportada es una de las originales
+            resultados[f'export_{formato}']['roundtrip_identical'] = set(iter_units(destino, formato)) <= esperadas
+    print(f"TMX de {args.units:,} unidades ({resultados['tmx_bytes'] / 1e6:.1f} MB)")
+    for etapa in ('parse', 'import', f'export_{TMX}', f'export_{XLIFF}'):
+        resultado = resultados[etapa]
+        extra = f" | pico {resultado['peak_bytes'] / 1e6:.1f} MB" if 'peak_bytes' in resultado else ''
+        extra += f" | relectura {resultado['roundtrip_units']:,}" if 'roundtrip_units' in resultado else ''
+        extra += f" | textos originales {resultado['roundtrip_identical']}" if 'roundtrip_identical' in resultado else ''
+        extra += f" | duplicados al reimportar {resultado['reimport_duplicates']:,}" if 'reimport_duplicates' in resultado else ''
+        print(f"  {etapa:<13} {resultado['units']:>10,} unidades en {resultado['seconds']:6.2f}s "
+                f"({resultado['units_per_second']:>9,.0f} unidades/s){extra}")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"tm_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'results': resultados}, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
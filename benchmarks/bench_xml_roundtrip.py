@@ -0,0 +1,62 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark del ciclo parse -> selección de w:t -> serialización de una parte xml
+# comparando el camino antiguo (xml.etree.ElementTree) con el actual (lxml).
+# Uso: python -m benchmarks.bench_xml_roundtrip [num_parrafos]
+
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from backend.extractor import get_text_elements_and_tree, serialize_tree, NAMESPACES
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_document_xml
+
+REPETICIONES = 3
+
+def roundtrip_etree(xml:bytes) -> bytes:
+    """Camino antiguo con xml.etree.ElementTree"""
+    root = ET.fromstring(xml)
+    for paragraph in root.iterfind('.//w:p', NAMESPACES):
+        for text_elem in paragraph.iterfind('.//w:t', NAMESPACES):
+            text_elem.text = text_elem.text
+    return ET.tostring(root, encoding='UTF-8', xml_declaration=True)
+
+def roundtrip_lxml(xml:bytes) -> bytes:
+    """Camino actual con lxml"""
+    text_elements, tree = get_text_elements_and_tree(xml)
+    for text_elem, text in text_elements:
+        text_elem.text = text
+    return serialize_tree(tree)
+
+def best_time(funcion, xml:bytes) -> tuple[float, bytes]:
+    """Devuelve el mejor tiempo de REPETICIONES ejecuciones y la salida"""
+    tiempos = []
+    for _ in range(REPETICIONES):
+        start = time.perf_counter()
+        salida = funcion(xml)
+        tiempos.append(time.perf_counter() - start)
+    return min(tiempos), salida
+
+def main(num_parrafos:int=20_000) -> None:
+    xml = build_document_xml(SyntheticDocxConfig(num_parrafos=num_parrafos, num_tablas=0, num_imagenes=0))
+    size_mb = len(xml) / 1e6
+    print(f"Parte sintética: {num_parrafos:,} párrafos, {size_mb:.1f} MB")
+    for nombre, funcion in [('xml.etree', roundtrip_etree), ('lxml', roundtrip_lxml)]:
+        tiempo, salida = best_time(funcion, xml)
+        print(f"{nombre:>10}: {tiempo:.3f} s | {size_mb / tiempo:.1f} MB/s | "
+                f"salida {len(salida) / 1e6:.1f} MB | prefijos ns0: {salida.count(b'ns0:'):,}")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
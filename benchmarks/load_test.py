@@ -0,0 +1,231 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Prueba de carga multi-sesión: N usuarios concurrentes (un hilo por usuario, como las
+# sesiones de Streamlit en un mismo servidor) envían documentos por el pipeline del backend
+# contra un LLM falso y un sustituto de Mongo en memoria. Para cada N se reporta throughput,
+# latencias p50/p95/p99 por trabajo, interferencias entre trabajos (salida con textos de otro
+# documento o errores) y uso de recursos.
+# Con --scheduler-rps todas las sesiones comparten un FairScheduler y se reporta la espera
+# en cola por usuario; con --heavy-paragraphs el usuario 0 envía un documento mucho mayor.
+# Uso: python -m benchmarks.load_test --users 1 2 4 8 --jobs-per-user 3 --llm-latency lognormal:0.05,0.5
+
+import argparse
+from dataclasses import replace
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import random
+import re
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import zipfile
+
+from backend.builder import build_docx_from_original
+from backend.db import UserDBHandler, UsuarioDB
+from backend.events import CHECKPOINT, EventBus
+from backend.extractor import extract_word_to_xml, get_text_from_docx
+from backend.llm_backends import sample_latency
+from backend.models import OpenAIResponse
+from backend.paths import WORD_FOLDER
+from backend.pipeline import extract_translate_replace
+from backend.scheduler import FairScheduler, is_priority_job, tenant_label
+from backend.utils import convert_words_to_tokens, get_to_extract_list
+from backend.xml_validator import all_xml_parts_good
+from benchmarks.mongo_standin import InMemoryMongoClient
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+TEXT_PATTERN = re.compile(rb'<w:t(?:\s[^>]*)?>(.*?)</w:t>', re.DOTALL)
+
+def get_texts(document_xml:bytes) -> list[bytes]:
+    return TEXT_PATTERN.findall(document_xml)
+
+def get_fake_translate(spec:str):
+    """Traductor falso que devuelve el mismo texto con la latencia de la distribución spec"""
+    def fake_translate(apikey:str, model:str, text:str, **chain_params) -> OpenAIResponse:
+        time.sleep(sample_latency(spec, random.Random()))
+        return OpenAIResponse(text, 0.0, convert_words_to_tokens(len(text.split())))
+    return fake_translate
+
+class ResourceMonitor:
+    """Muestrea CPU, memoria máxima e hilos activos mientras dura la prueba"""
+    def __init__(self, intervalo:float=0.1) -> None:
+        self.intervalo = intervalo
+        self.max_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.intervalo):
+            self.max_threads = max(self.max_threads, threading.active_count())
+
+    def __enter__(self) -> 'ResourceMonitor':
+        self._inicio = resource.getrusage(resource.RUSAGE_SELF)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        fin = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu_seconds = (fin.ru_utime - self._inicio.ru_utime) + (fin.ru_stime - self._inicio.ru_stime)
+        self.max_rss_mb = fin.ru_maxrss / 1024 # en Linux ru_maxrss va en KB
+
+def run_job(usuario:int, docx:bytes, esperado:list[bytes], client:InMemoryMongoClient, translate_fn,
+            scheduler:FairScheduler | None=None) -> dict:
+    """Ejecuta un trabajo completo como lo hace app.py y comprueba que la salida
+    contiene exactamente los textos de su propio documento. Se compara el texto concatenado:
+    la normalización fusiona runs y cambia el número de w:t.
+    """
+    clave = f"clave-{usuario}"
+    start = time.perf_counter()
+    try:
+        # Como en app.py: un handler con su propio cliente por sesión
+        db_handler = UserDBHandler('usuarios', client=client)
+        docx_text = get_text_from_docx(BytesIO(docx))
+        extract_word_to_xml(BytesIO(docx))
+        to_extract_list = get_to_extract_list(WORD_FOLDER)
+        document_words = len(docx_text.split())
+        bus = EventBus()
+        bus.subscribe(lambda evento: db_handler.update('clave', clave, {'ultimo_texto_traducido': evento.datos['texto_traducido']}),
+                        [CHECKPOINT])
+        resultado = extract_translate_replace(
+            apikey='', model='gpt-3.5-turbo', document_words=document_words,
+            filename=f"documento {usuario}", to_extract_list=to_extract_list,
+            chain_params={'origin_lang': 'Español', 'destiny_lang': 'Francés',
+                            'doc_features': 'un contrato', 'doc_context': 'Legal'},
+            diccionario={}, bus=bus, translate_fn=translate_fn, max_cooldown=0,
+            scheduler=scheduler, tenant=clave, prioritario=is_priority_job(document_words))
+        xml_ok, _ = all_xml_parts_good(resultado.partes_modificadas)
+        salida = BytesIO()
+        build_docx_from_original(salida, docx, resultado.partes_modificadas)
+        with zipfile.ZipFile(salida) as zip_ref:
+            textos = get_texts(zip_ref.read('word/document.xml'))
+        db_handler.increment_number('clave', clave, 'palabras_acumulado', len(docx_text.split()))
+        interferencia = (b''.join(textos) != b''.join(esperado)) or not xml_ok
+        error = None
+    except Exception as exc:
+        interferencia, error = True, f"{type(exc).__name__}: {exc}"
+    return {'usuario': usuario, 'latencia': time.perf_counter() - start, 'interferencia': interferencia, 'error': error}
+
+def percentile(valores:list[float], p:float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, round(p / 100 * (len(ordenados) - 1)))]
+
+def run_level(n_usuarios:int, jobs_por_usuario:int, config:SyntheticDocxConfig, translate_fn, mongo_latencia:float,
+                scheduler:FairScheduler | None=None, parrafos_pesado:int=0) -> dict:
+    """Lanza n_usuarios hilos que envían jobs_por_usuario documentos cada uno.
+    Si parrafos_pesado > 0 el usuario 0 envía documentos con ese número de párrafos.
+    """
+    client = InMemoryMongoClient(mongo_latencia)
+    client.seed('TrueFormTranslator', 'usuarios', [
+        UsuarioDB(nombre=f"usuario {i}", email='', telefono='', clave=f"clave-{i}", apikey='',
+                    palabras_limite=10**9, facturado_accumulado=0).model_dump()
+        for i in range(n_usuarios)])
+    # Cada usuario tiene su propio documento para detectar mezclas entre trabajos
+    documentos = []
+    for i in range(n_usuarios):
+        if i == 0 and parrafos_pesado:
+            docx = build_synthetic_docx(replace(config, seed=i, num_parrafos=parrafos_pesado))
+        else:
+            docx = build_synthetic_docx(replace(config, seed=i))
+        with zipfile.ZipFile(BytesIO(docx)) as zip_ref:
+            documentos.append((docx, get_texts(zip_ref.read('word/document.xml'))))
+    resultados, lock = [], threading.Lock()
+
+    def usuario(i:int) -> None:
+        for _ in range(jobs_por_usuario):
+            resultado = run_job(i, *documentos[i], client, translate_fn, scheduler)
+            with lock:
+                resultados.append(resultado)
+
+    hilos = [threading.Thread(target=usuario, args=(i,)) for i in range(n_usuarios)]
+    with ResourceMonitor() as monitor:
+        start = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - start
+    latencias = [r['latencia'] for r in resultados]
+    return {
+        'users': n_usuarios,
+        'jobs': len(resultados),
+        'seconds': duracion,
+        'throughput_jobs_per_s': len(resultados) / duracion,
+        'p50': percentile(latencias, 50),
+        'p95': percentile(latencias, 95),
+        'p99': percentile(latencias, 99),
+        'mean': statistics.mean(latencias),
+        'interfered_jobs': sum(r['interferencia'] for r in resultados),
+        'errors': sorted({r['error'] for r in resultados if r['error']}),
+        'cpu_seconds': monitor.cpu_seconds,
+        'max_rss_mb': monitor.max_rss_mb,
+        'max_threads': monitor.max_threads,
+        'latency_by_user': {f"clave-{i}": statistics.mean(r['latencia'] for r in resultados if r['usuario'] == i)
+                            for i in range(n_usuarios)},
+        'queue_delays': scheduler.queue_delays() if scheduler is not None else {},
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga multi-sesión del pipeline")
+    parser.add_argument('--users', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--jobs-per-user', type=int, default=3)
+    parser.add_argument('--paragraphs', type=int, default=200)
+    parser.add_argument('--llm-latency', default='lognormal:0.02,0.5', help="Distribución de latencia del LLM falso")
+    parser.add_argument('--mongo-latency', type=float, default=0.002, help="Segundos por operación de Mongo")
+    parser.add_argument('--scheduler-rps', type=float, default=0,
+                        help="Llamadas por segundo del FairScheduler compartido; 0 sin planificador")
+    parser.add_argument('--scheduler-concurrency', type=int, default=8, help="Llamadas concurrentes del planificador")
+    parser.add_argument('--heavy-paragraphs', type=int, default=0, help="Párrafos del documento del usuario 0; 0 igual que el resto")
+    args = parser.parse_args()
+    config = SyntheticDocxConfig(num_parrafos=args.paragraphs, num_tablas=2, num_imagenes=1, kb_por_imagen=64)
+    translate_fn = get_fake_translate(args.llm_latency)
+    resultados = []
+    # XML_FOLDER es relativo: trabajamos en un directorio temporal para no tocar el del repositorio
+    directorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory() as carpeta:
+        os.chdir(carpeta)
+        try:
+            for n_usuarios in args.users:
+                scheduler = (FairScheduler(args.scheduler_rps, args.scheduler_concurrency)
+                                if args.scheduler_rps else None)
+                resultado = run_level(n_usuarios, args.jobs_per_user, config, translate_fn, args.mongo_latency,
+                                        scheduler, args.heavy_paragraphs)
+                resultados.append(resultado)
+                print(f"N={n_usuarios:>3} | {resultado['throughput_jobs_per_s']:6.2f} jobs/s | "
+                        f"p50 {resultado['p50']:6.2f}s p95 {resultado['p95']:6.2f}s p99 {resultado['p99']:6.2f}s | "
+                        f"interferidos {resultado['interfered_jobs']}/{resultado['jobs']} | "
+                        f"cpu {resultado['cpu_seconds']:.1f}s rss {resultado['max_rss_mb']:.0f}MB hilos {resultado['max_threads']}")
+                for error in resultado['errors']:
+                    print(f"      error: {error}")
+                for i in range(n_usuarios):
+                    clave = f"clave-{i}"
+                    espera = resultado['queue_delays'].get(tenant_label(clave))
+                    cola = f" | cola media {espera['mean']:.3f}s p95 {espera['p95']:.3f}s" if espera else ''
+                    print(f"      {clave}: latencia media {resultado['latency_by_user'][clave]:6.2f}s{cola}")
+        finally:
+            os.chdir(directorio_original)
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"load_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps({'args': vars(args), 'levels': resultados}, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Sustituto en memoria de MongoClient con las operaciones que usa backend.db.
+# Permite pruebas de carga sin servidor Mongo. Simula la latencia de red por operación.
+
+import copy
+import threading
+import time
+from typing import Any
+
+class InMemoryCursor(list):
+    """Resultado de find con el sort de los cursores de pymongo"""
+    def sort(self, claves:list[tuple[str, int]]) -> 'InMemoryCursor':
+        for campo, direccion in reversed(claves):
+            super().sort(key=lambda doc: doc.get(campo), reverse=direccion < 0)
+        return self
+
+class InMemoryCollection:
+    def __init__(self, latencia:float=0.0) -> None:
+        self.documents:list[dict] = []
+        self.latencia = latencia
+        self._lock = threading.Lock()
+        # Documentos por filtro de los upserts de bulk_write, como los encontraría el índice
+        self._upserts:dict[tuple, dict] = {}
+
+    def _matches(self, document:dict, filtro:dict) -> bool:
+        return all(document.get(campo) in valor['$in'] if isinstance(valor, dict) else document.get(campo) == valor
+                    for campo, valor in filtro.items())
+
+    def _wait(self) -> None:
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def find(self, filtro:dict | None=None) -> InMemoryCursor:
+        self._wait()
+        if filtro:
+            # $in se resuelve con un set como lo haría el índice
+            filtro = {campo: {'$in': set(valor['$in'])} if isinstance(valor, dict) else valor
+                        for campo, valor in filtro.items()}
+        with self._lock:
+            return InMemoryCursor(copy.deepcopy(doc) for doc in self.documents if self._matches(doc, filtro or {}))
+
+    def find_one(self, filtro:dict) -> dict | None:
+        encontrados = self.find(filtro)
+        return encontrados[0] if encontrados else None
+
+    def insert_one(self, document:dict) -> None:
+        self._wait()
+        with self._lock:
+            self.documents.append({'_id': len(self.documents), **copy.deepcopy(document)})
+
+    def insert_many(self, documents:list[dict], ordered:bool=True) -> None:
+        self._wait()
+        with self._lock:
+            for document in documents:
+                self.documents.append({'_id': len(self.documents), **copy.deepcopy(document)})
+
+    def create_index(self, claves:list[tuple[str, int]], **opciones) -> None:
+        pass
+
+    def bulk_write(self, operaciones:list, ordered:bool=True) -> None:
+        """bulk_write con UpdateOne($set, upsert=True) de pymongo"""
+        self._wait()
+        with self._lock:
+            for operacion in operaciones:
+                filtro, modificaciones = operacion._filter, operacion._doc
+                clave = tuple(sorted(filtro.items()))
+                if (document := self._upserts.get(clave)) is None:
+                    if not operacion._upsert:
+                        continue
+                    document = {'_id': len(self.documents), **copy.deepcopy(filtro)}
+                    self.documents.append(document)
+                    self._upserts[clave] = document
+                document.update(copy.deepcopy(modificaciones.get('$set', {})))
+
+    def update_one(self, filtro:dict, modificaciones:dict) -> None:
+        self._wait()
+        with self._lock:
+            for document in self.documents:
+                if self._matches(document, filtro):
+                    document.update(copy.deepcopy(modificaciones.get('$set', {})))
+                    for campo, incremento in modificaciones.get('$inc', {}).items():
+                        document[campo] = document.get(campo, 0) + incremento
+                    return
+
+    def delete_one(self, filtro:dict) -> None:
+        self._wait()
+        with self._lock:
+            for idx, document in enumerate(self.documents):
+                if self._matches(document, filtro):
+                    del self.documents[idx]
+                    return
+
+class InMemoryDatabase(dict):
+    def __init__(self, latencia:float=0.0) -> None:
+        super().__init__()
+        self.latencia = latencia
+
+    def __missing__(self, nombre:str) -> InMemoryCollection:
+        self[nombre] = InMemoryCollection(self.latencia)
+        return self[nombre]
+
+class InMemoryMongoClient(dict):
+    """Cliente compatible con client[database][collection] de pymongo"""
+    def __init__(self, latencia:float=0.0) -> None:
+        super().__init__()
+        self.latencia = latencia
+
+    def __missing__(self, nombre:str) -> InMemoryDatabase:
+        self[nombre] = InMemoryDatabase(self.latencia)
+        return self[nombre]
+
+    def seed(self, database:str, collection:str, documents:list[dict[str, Any]]) -> None:
+        for document in documents:
+            self[database][collection].insert_one(document)
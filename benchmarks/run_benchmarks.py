@@ -0,0 +1,211 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Suite de benchmarks de extremo a extremo sobre documentos sintéticos.
+# Mide tiempo, throughput y pico de memoria de cada etapa del pipeline y guarda
+# los resultados en benchmarks/results/<fecha>_<commit>.json para comparar commits.
+# Uso:
+#   python -m benchmarks.run_benchmarks [--scenarios small medium large] [--llm-latency 0.0]
+#   python -m benchmarks.run_benchmarks --compare base.json nuevo.json
+
+import argparse
+from collections.abc import Callable
+from dataclasses import asdict
+from datetime import datetime
+from io import BytesIO
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from backend.builder import build_docx_from_original
+from backend.events import EventBus
+from backend.extractor import get_text_from_docx, get_text_elements_and_tree
+from backend.models import OpenAIResponse
+from backend.pipeline import extract_translate_replace
+from backend.translator import translate
+from backend.utils import convert_words_to_tokens, get_to_extract_list
+from backend.xml_validator import all_xml_files_good, all_xml_parts_good
+from benchmarks.synthetic_docx import SyntheticDocxConfig, build_synthetic_docx
+
+RESULTS_FOLDER = Path(__file__).parent / 'results'
+SCENARIOS = {
+    'small': SyntheticDocxConfig(num_parrafos=200, num_tablas=2, num_imagenes=1, kb_por_imagen=64),
+    'medium': SyntheticDocxConfig(num_parrafos=2_000, num_tablas=20, num_headers=3, num_footers=3,
+                                    num_imagenes=5, kb_por_imagen=512),
+    'large': SyntheticDocxConfig(num_parrafos=20_000, runs_por_parrafo=6, num_tablas=100, ratio_repetido=0.4,
+                                    num_headers=3, num_footers=3, num_imagenes=20, kb_por_imagen=1024),
+}
+
+def get_fake_translate(latencia:float=0.0) -> Callable[..., OpenAIResponse]:
+    """Devuelve una función con la firma de translator.translate que no llama a ningún LLM:
+    devuelve el mismo texto tras `latencia` segundos y estima los tokens.
+    """
+    def fake_translate(apikey:str, model:str, text:str, **chain_params) -> OpenAIResponse:
+        if latencia:
+            time.sleep(latencia)
+        return OpenAIResponse(text, 0.0, convert_words_to_tokens(len(text.split())))
+    return fake_translate
+
+def measure(etapa:str, funcion:Callable, unidades:float, unidad:str, memoria:bool=True) -> dict:
+    """Ejecuta funcion y devuelve tiempo, throughput y pico de memoria.
+    El pico se mide en una segunda ejecución para no penalizar el tiempo con tracemalloc.
+
+    Parameters
+    ----------
+    etapa : str
+        nombre de la etapa
+    funcion : Callable
+        función sin argumentos a medir
+    unidades : float
+        unidades procesadas (MB, segmentos...) para el throughput
+    unidad : str
+        nombre de la unidad
+    memoria : bool, optional
+        si se mide el pico de memoria, by default True
+
+    Returns
+    -------
+    dict
+        _description_
+    """
+    start = time.perf_counter()
+    funcion()
+    segundos = time.perf_counter() - start
+    pico_mb = None
+    if memoria:
+        tracemalloc.start()
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pico_mb = pico / 1e6
+    return {
+        'stage': etapa,
+        'seconds': segundos,
+        'throughput': unidades / segundos if segundos else None,
+        'unit': f"{unidad}/s",
+        'peak_memory_mb': pico_mb,
+    }
+
+def run_scenario(config:SyntheticDocxConfig, translate_fn:Callable[..., OpenAIResponse], memoria:bool) -> dict:
+    """Ejecuta todas las etapas sobre un docx sintético generado con config"""
+    docx = build_synthetic_docx(config)
+    docx_mb = len(docx) / 1e6
+    with zipfile.ZipFile(BytesIO(docx)) as zip_ref:
+        document_xml = zip_ref.read('word/document.xml')
+    document_mb = len(document_xml) / 1e6
+    docx_text = get_text_from_docx(BytesIO(docx))
+    num_words = len(docx_text.split())
+    n_segmentos = len(get_text_elements_and_tree(document_xml)[0])
+    resultados = [
+        measure('get_text_from_docx', lambda: get_text_from_docx(BytesIO(docx)), docx_mb, 'MB', memoria),
+        measure('get_text_elements_and_tree', lambda: get_text_elements_and_tree(document_xml), document_mb, 'MB', memoria),
+    ]
+    with tempfile.TemporaryDirectory() as carpeta:
+        xml_folder = Path(carpeta)
+        with zipfile.ZipFile(BytesIO(docx)) as zip_ref:
+            zip_ref.extractall(xml_folder)
+        to_extract_list = get_to_extract_list(xml_folder / 'word')
+        translation = {}
+        def translate_loop():
+            translation['result'] = extract_translate_replace(
+                apikey='', model='gpt-3.5-turbo', document_words=num_words,
+                filename='benchmark', to_extract_list=to_extract_list,
+                chain_params={'origin_lang': 'Español', 'destiny_lang': 'Francés',
+                                'doc_features': 'un contrato', 'doc_context': 'Legal'},
+                diccionario={}, bus=EventBus(), xml_folder=xml_folder,
+                translate_fn=translate_fn, max_cooldown=0)
+        resultados.append(measure('translate_loop_fake_llm', translate_loop, n_segmentos, 'segments', memoria))
+        partes = translation['result'].partes_modificadas
+        resultados.append(measure('build_docx_from_original',
+                                    lambda: build_docx_from_original(BytesIO(), docx, partes), docx_mb, 'MB', memoria))
+        partes_mb = sum(map(len, partes.values())) / 1e6
+        resultados.append(measure('all_xml_parts_good', lambda: all_xml_parts_good(partes, True), partes_mb, 'MB', memoria))
+        resultados.append(measure('all_xml_files_good', lambda: all_xml_files_good(xml_folder / 'word'),
+                                    partes_mb, 'MB', memoria))
+    return {
+        'config': asdict(config),
+        'docx_mb': docx_mb,
+        'document_xml_mb': document_mb,
+        'words': num_words,
+        'segments': n_segmentos,
+        'stages': resultados,
+    }
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(base:Path, nuevo:Path) -> None:
+    """Imprime la variación de tiempo y memoria por escenario y etapa entre dos resultados"""
+    datos_base = json.loads(base.read_text(encoding='utf-8'))
+    datos_nuevo = json.loads(nuevo.read_text(encoding='utf-8'))
+    print(f"{datos_base['commit']} -> {datos_nuevo['commit']}")
+    for escenario, resultado in datos_nuevo['scenarios'].items():
+        etapas_base = {e['stage']: e for e in datos_base['scenarios'].get(escenario, {}).get('stages', [])}
+        for etapa in resultado['stages']:
+            if (anterior := etapas_base.get(etapa['stage'])) is None:
+                continue
+            ratio = etapa['seconds'] / anterior['seconds'] if anterior['seconds'] else float('nan')
+            print(f"{escenario:>8} {etapa['stage']:<28} {anterior['seconds']:8.3f}s -> {etapa['seconds']:8.3f}s (x{ratio:.2f})")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks de extremo a extremo de TrueForm Translator")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=['small', 'medium'])
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="Latencia en segundos del LLM falso")
+    parser.add_argument('--langchain', action='store_true',
+                        help="Traducir con translator.translate y el backend 'fake' de chains.get_llm (incluye el overhead de langchain)")
+    parser.add_argument('--no-memory', action='store_true', help="No medir el pico de memoria")
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BASE', 'NUEVO'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.langchain:
+        os.environ['TRUEFORM_LLM_BACKEND'] = 'fake'
+        os.environ['TRUEFORM_FAKE_LATENCY'] = f"fixed:{args.llm_latency}"
+        translate_fn = translate
+    else:
+        translate_fn = get_fake_translate(args.llm_latency)
+    commit = get_commit()
+    resultados = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'llm_latency': args.llm_latency,
+        'langchain': args.langchain,
+        'scenarios': {},
+    }
+    for escenario in args.scenarios:
+        resultado = run_scenario(SCENARIOS[escenario], translate_fn, not args.no_memory)
+        resultados['scenarios'][escenario] = resultado
+        for etapa in resultado['stages']:
+            memoria = f"{etapa['peak_memory_mb']:8.1f} MB" if etapa['peak_memory_mb'] is not None else ''
+            print(f"{escenario:>8} {etapa['stage']:<28} {etapa['seconds']:8.3f}s "
+                    f"{etapa['throughput']:10.1f} {etapa['unit']:<12} {memoria}")
+    RESULTS_FOLDER.mkdir(exist_ok=True)
+    ruta = RESULTS_FOLDER / f"{datetime.now():%Y%m%d-%H%M%S}_{commit}.json"
+    ruta.write_text(json.dumps(resultados, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {ruta}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Generador de documentos .docx sintéticos para los benchmarks.
+# Uso: python -m benchmarks.synthetic_docx salida.docx [num_parrafos]
+
+from dataclasses import dataclass
+from io import BytesIO
+import random
+import sys
+from xml.sax.saxutils import escape
+import zipfile
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+WP = 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+PALABRAS = ("el contrato de suministro entre las partes establece que la entrega se realizará "
+            "en el plazo acordado y conforme a las condiciones técnicas descritas en el anexo "
+            "con garantía de calidad revisión mantenimiento factura importe cliente proveedor").split()
+BOILERPLATE = [
+    "Página",
+    "Confidencial",
+    "Todos los derechos reservados.",
+    "Documento controlado. Prohibida su copia sin autorización.",
+]
+
+@dataclass
+class SyntheticDocxConfig:
+    """Parámetros del documento sintético"""
+    num_parrafos:int = 1_000
+    runs_por_parrafo:int = 4
+    palabras_por_run:int = 6
+    num_tablas:int = 10
+    filas_por_tabla:int = 5
+    columnas_por_tabla:int = 4
+    ratio_repetido:float = 0.2 # proporción de runs que son texto repetido (boilerplate)
+    ratio_ruido:float = 0.0 # proporción de runs precedidos de w:proofErr o con w:lastRenderedPageBreak, como los deja Word
+    num_headers:int = 1
+    num_footers:int = 1
+    num_imagenes:int = 2
+    kb_por_imagen:int = 256
+    seed:int = 0
+
+def _run(texto:str, salto_renderizado:bool=False) -> str:
+    salto = '<w:lastRenderedPageBreak/>' if salto_renderizado else ''
+    return (f'<w:r w:rsidR="00A1B2C3"><w:rPr><w:sz w:val="22"/></w:rPr>'
+            f'{salto}<w:t xml:space="preserve">{escape(texto)}</w:t></w:r>')
+
+def _paragraph(rng:random.Random, config:SyntheticDocxConfig) -> str:
+    runs = []
+    for _ in range(config.runs_por_parrafo):
+        if rng.random() < config.ratio_repetido:
+            texto = rng.choice(BOILERPLATE)
+        else:
+            texto = " ".join(rng.choices(PALABRAS, k=config.palabras_por_run))
+        if rng.random() < config.ratio_ruido:
+            if rng.random() < 0.5:
+                runs.append('<w:proofErr w:type="spellStart"/>')
+                runs.append(_run(texto + " "))
+                runs.append('<w:proofErr w:type="spellEnd"/>')
+            else:
+                runs.append(_run(texto + " ", salto_renderizado=True))
+        else:
+            runs.append(_run(texto + " "))
+    return f'<w:p><w:pPr><w:pStyle w:val="Normal"/></w:pPr>{"".join(runs)}</w:p>'
+
+def _table(rng:random.Random, config:SyntheticDocxConfig) -> str:
+    filas = []
+    for _ in range(config.filas_por_tabla):
+        celdas = "".join(f'<w:tc><w:p>{_run(" ".join(rng.choices(PALABRAS, k=2)))}</w:p></w:tc>'
+                        for _ in range(config.columnas_por_tabla))
+        filas.append(f'<w:tr>{celdas}</w:tr>')
+    return f'<w:tbl>{"".join(filas)}</w:tbl>'
+
+def _image_paragraph(indice:int) -> str:
+    return (f'<w:p><w:r><w:drawing><wp:inline><wp:docPr id="{indice}" name="Imagen {indice}"/>'
+            f'</wp:inline></w:drawing></w:r></w:p>')
+
+def build_document_xml(config:SyntheticDocxConfig) -> bytes:
+    """Genera el document.xml del documento sintético
+
+    Parameters
+    ----------
+    config : SyntheticDocxConfig
+        _description_
+
+    Returns
+    -------
+    bytes
+        _description_
+    """
+    rng = random.Random(config.seed)
+    bloques = [_paragraph(rng, config) for _ in range(config.num_parrafos)]
+    # Intercalamos tablas e imágenes a lo largo del documento
+    for i in range(config.num_tablas):
+        bloques.insert(rng.randint(0, len(bloques)), _table(rng, config))
+    for i in range(1, config.num_imagenes + 1):
+        bloques.insert(rng.randint(0, len(bloques)), _image_paragraph(i))
+    return (f'{XML_DECLARATION}<w:document xmlns:w="{W}" xmlns:r="{R}" xmlns:wp="{WP}">'
+            f'<w:body>{"".join(bloques)}<w:sectPr/></w:body></w:document>').encode('utf-8')
+
+def _header_footer_xml(etiqueta:str, texto:str) -> bytes:
+    return (f'{XML_DECLARATION}<w:{etiqueta} xmlns:w="{W}" xmlns:r="{R}">'
+            f'<w:p>{_run(texto)}</w:p></w:{etiqueta}>').encode('utf-8')
+
+def build_synthetic_docx(config:SyntheticDocxConfig=SyntheticDocxConfig()) -> bytes:
+    """Genera un docx sintético en bytes según la configuración pasada
+
+    Parameters
+    ----------
+    config : SyntheticDocxConfig, optional
+        _description_, by default SyntheticDocxConfig()
+
+    Returns
+    -------
+    bytes
+        el docx
+    """
+    rng = random.Random(config.seed)
+    headers = [f'header{i}.xml' for i in range(1, config.num_headers + 1)]
+    footers = [f'footer{i}.xml' for i in range(1, config.num_footers + 1)]
+    imagenes = [f'image{i}.png' for i in range(1, config.num_imagenes + 1)]
+    overrides = "".join(
+        f'<Override PartName="/word/{nombre}" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.{tipo}+xml"/>'
+        for nombre, tipo in [(h, 'header') for h in headers] + [(f, 'footer') for f in footers])
+    content_types = (f'{XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Default Extension="png" ContentType="image/png"/>'
+                    '<Override PartName="/word/document.xml" '
+                    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                    f'{overrides}</Types>')
+    rels = (f'{XML_DECLARATION}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>')
+    tipo_rel = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    document_rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{tipo_rel}{tipo}" Target="{destino}"/>'
+        for i, (tipo, destino) in enumerate(
+            [('header', h) for h in headers] + [('footer', f) for f in footers]
+            + [('image', f'media/{img}') for img in imagenes], start=1))
+    document_rels = (f'{XML_DECLARATION}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                    f'{document_rels}</Relationships>')
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', content_types)
+        docx.writestr('_rels/.rels', rels)
+        docx.writestr('word/document.xml', build_document_xml(config))
+        docx.writestr('word/_rels/document.xml.rels', document_rels)
+        for header in headers:
+            docx.writestr(f'word/{header}', _header_footer_xml('hdr', BOILERPLATE[1]))
+        for footer in footers:
+            docx.writestr(f'word/{footer}', _header_footer_xml('ftr', BOILERPLATE[2]))
+        for imagen in imagenes:
+            # Bytes aleatorios: igual que una imagen real, no se comprimen
+            docx.writestr(f'word/media/{imagen}', rng.randbytes(config.kb_por_imagen * 1024))
+    return buffer.getvalue()
+
+if __name__ == '__main__':
+    num_parrafos = int(sys.argv[2]) if len(sys.argv) > 2 else SyntheticDocxConfig.num_parrafos
+    with open(sys.argv[1], 'wb') as f:
+        f.write(build_synthetic_docx(SyntheticDocxConfig(num_parrafos=num_parrafos)))
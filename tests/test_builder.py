@@ -0,0 +1,78 @@
+# Copyright 2024 Sergio Tejedor Moreno
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests de la reconstrucción del docx traducido a partir del original.
+# La copia en bruto depende de atributos internos de zipfile: se prueba también el camino
+# con la API pública que se usa cuando can_copy_raw es False, para que un cambio de versión
+# de Python que lo active no lo rompa sin que nadie se entere.
+# Uso: python -m pytest tests
+
+from io import BytesIO
+import zipfile
+
+import pytest
+
+from backend import builder
+
+DOCUMENT_PART = 'word/document.xml'
+
+def build_original() -> bytes:
+    """Docx mínimo con partes deflate, una imagen sin comprimir y una entrada con data descriptor"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as docx:
+        docx.writestr('[Content_Types].xml', b'<Types/>', compress_type=zipfile.ZIP_DEFLATED)
+        docx.writestr(DOCUMENT_PART, b'<w:document>original</w:document>' * 50, compress_type=zipfile.ZIP_DEFLATED)
+        docx.writestr('word/media/image1.png', bytes(range(256)) * 20, compress_type=zipfile.ZIP_STORED)
+        # Escribir con open() sin tamaño conocido deja el CRC y los tamaños en un data descriptor
+        with docx.open('word/styles.xml', 'w') as estilos:
+            estilos.write(b'<w:styles/>' * 100)
+    return buffer.getvalue()
+
+def rebuild(original:bytes, partes_modificadas:dict[str, bytes]) -> bytes:
+    buffer = BytesIO()
+    builder.build_docx_from_original(buffer, original, partes_modificadas)
+    return buffer.getvalue()
+
+@pytest.fixture(params=[True, False], ids=['raw', 'public_api'])
+def copia_en_bruto(request, monkeypatch) -> bool:
+    """Ejecuta el test con la copia en bruto y con el camino de la API pública"""
+    if not request.param:
+        monkeypatch.setattr(builder, 'can_copy_raw', lambda zip_destino: False)
+        monkeypatch.setattr(builder, '_write_raw_member', lambda *args: pytest.fail("Se ha copiado en bruto"))
+    elif not builder.can_copy_raw(zipfile.ZipFile(BytesIO(), 'w')):
+        pytest.skip("La copia en bruto no está soportada en esta versión de Python")
+    return request.param
+
+def test_rebuild_keeps_untouched_parts(copia_en_bruto):
+    original = build_original()
+    traducido = b'<w:document>traducido</w:document>'
+    with zipfile.ZipFile(BytesIO(rebuild(original, {DOCUMENT_PART: traducido}))) as resultado, \
+            zipfile.ZipFile(BytesIO(original)) as origen:
+        assert resultado.testzip() is None
+        assert resultado.namelist() == origen.namelist()
+        for info in origen.infolist():
+            esperado = traducido if info.filename == DOCUMENT_PART else origen.read(info)
+            assert resultado.read(info.filename) == esperado
+            assert resultado.getinfo(info.filename).date_time == info.date_time
+        assert resultado.getinfo('word/media/image1.png').compress_type == zipfile.ZIP_STORED
+
+def test_rebuild_paths_produce_same_contents(monkeypatch):
+    original = build_original()
+    partes = {DOCUMENT_PART: b'<w:document>traducido</w:document>'}
+    en_bruto = rebuild(original, partes)
+    monkeypatch.setattr(builder, 'can_copy_raw', lambda zip_destino: False)
+    publica = rebuild(original, partes)
+    with zipfile.ZipFile(BytesIO(en_bruto)) as a, zipfile.ZipFile(BytesIO(publica)) as b:
+        assert a.namelist() == b.namelist()
+        assert all(a.read(nombre) == b.read(nombre) for nombre in a.namelist())